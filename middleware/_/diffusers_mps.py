@@ -1,87 +1,1134 @@
 from fastapi import FastAPI, HTTPException
+from fastapi import Response
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+import asyncio
+import gc
+import inspect
+import json
+import os
+import random
+import threading
+import time
+import uuid
 import torch
-from diffusers import StableDiffusionPipeline
+from diffusers import (
+    AutoPipelineForText2Image,
+    DiffusionPipeline,
+    StableDiffusionPipeline,
+    DDIMScheduler,
+    DEISMultistepScheduler,
+    DPMSolverMultistepScheduler,
+    EulerAncestralDiscreteScheduler,
+    EulerDiscreteScheduler,
+    HeunDiscreteScheduler,
+    KDPM2AncestralDiscreteScheduler,
+    KDPM2DiscreteScheduler,
+    LMSDiscreteScheduler,
+    PNDMScheduler,
+    UniPCMultistepScheduler,
+)
 # FluxPipeline StableDiffusionPipeline
 import base64
 from io import BytesIO
+from PIL import Image
+
+# 실행 프로필 (PROFILE 환경변수로 선택)
+# - latency: 요청 하나를 빨리 끝내는 설정 (짧은 배치 대기, UNet 컴파일)
+# - throughput: 배치를 크게 모아서 초당 이미지 수를 높이는 설정
+# - low-memory: 컴파일 없이 attention / VAE slicing을 항상 켬
+# bf16은 CPU가 bf16 연산을 지원할 때만 사용 (MPS는 float32가 더 안정적)
+PROFILES = {
+    "latency": {"bf16": True, "channels_last": True, "compile": True, "slicing": "auto",
+                "batch_window": 0.01, "batch_max_size": 2},
+    "throughput": {"bf16": True, "channels_last": True, "compile": True, "slicing": "auto",
+                   "batch_window": 0.2, "batch_max_size": 8},
+    "low-memory": {"bf16": True, "channels_last": False, "compile": False, "slicing": "always",
+                   "batch_window": 0.05, "batch_max_size": 1},
+}
+PROFILE = os.getenv("PROFILE", "latency")
+if PROFILE not in PROFILES:
+    raise ValueError(f"알 수 없는 PROFILE입니다: {PROFILE} ({', '.join(PROFILES)})")
+PROFILE_SETTINGS = PROFILES[PROFILE]
+# slicing=auto일 때 attention / VAE slicing을 켜는 해상도 (가로×세로 픽셀 수)
+SLICING_MIN_PIXELS = int(os.getenv("SLICING_MIN_PIXELS", str(768 * 768)))
+# 컴파일 후 미리 한 번 실행해둘 해상도 (쉼표로 구분, "가로x세로")
+WARMUP_RESOLUTIONS = [r.strip() for r in os.getenv("WARMUP_RESOLUTIONS", "512x512").split(",") if r.strip()]
+
+# 마이크로 배치 설정 (환경변수로 덮어쓰기 가능, 기본값은 프로필 기준)
+# - BATCH_WINDOW: 같은 설정의 요청을 모으는 최대 대기 시간 (초)
+# - BATCH_MAX_SIZE: 파이프라인 한 번에 넣는 최대 프롬프트 수
+BATCH_WINDOW = float(os.getenv("BATCH_WINDOW", str(PROFILE_SETTINGS["batch_window"])))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", str(PROFILE_SETTINGS["batch_max_size"])))
+# 요청 하나의 batch_size 상한 (BATCH_MAX_SIZE보다 크면 그 요청만 단독으로 실행)
+MAX_IMAGES_PER_REQUEST = int(os.getenv("MAX_IMAGES_PER_REQUEST", "8"))
+
+
+# 작업 API 설정
+# - PREVIEW_EVERY: 몇 스텝마다 미리보기를 만들지 (0이면 끔)
+# - JOB_HISTORY_LIMIT: 메모리에 보관하는 작업 수
+PREVIEW_EVERY = int(os.getenv("PREVIEW_EVERY", "5"))
+JOB_HISTORY_LIMIT = int(os.getenv("JOB_HISTORY_LIMIT", "200"))
+SSE_KEEPALIVE = float(os.getenv("SSE_KEEPALIVE", "15"))
+
+# 결과 인코딩 설정
+# - ENCODE_WORKERS: 이미지 인코딩 스레드 수
+# - ARTIFACT_DIR: response_format=url일 때 결과 파일을 저장하는 폴더
+# - ARTIFACT_MAX_MB: 결과 파일 폴더 최대 크기 (MB, 넘으면 저장할 때 오래된 파일부터 삭제)
+ENCODE_WORKERS = int(os.getenv("ENCODE_WORKERS", "2"))
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "outputs")
+ARTIFACT_MAX_MB = int(os.getenv("ARTIFACT_MAX_MB", "1024"))
+# 형식 -> (Pillow 형식, MIME 타입, 확장자)
+IMAGE_FORMATS = {
+    "png": ("PNG", "image/png", "png"),
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+    "webp": ("WEBP", "image/webp", "webp"),
+}
+RESPONSE_FORMATS = ("base64", "binary", "url")
+
+
+class TextToImageRequest(BaseModel):
+    prompt: str
+    negative_prompt: str = ""
+    model: Optional[str] = None  # 없으면 기본 모델
+    width: int = 512
+    height: int = 512
+    steps: int = 20
+    cfg_scale: float = 7.0
+    sampler_name: str = "Euler a"
+    seed: int = -1  # -1이면 랜덤
+    batch_size: int = 1  # 같은 프롬프트로 만들 이미지 수 (시드는 seed, seed+1, ...)
+    response_format: str = "base64"  # base64 / binary / url
+    image_format: str = "png"  # png / jpeg / webp
+    compression: Optional[int] = None  # png: 0~9 압축 레벨, jpeg/webp: 1~100 품질
+
+
+# 취소된 작업
+class GenerationCancelled(Exception):
+    pass
+
+
+# 이미지 생성 작업 하나 (배치 대기열 항목 + 진행 상태)
+class GenerationJob:
+    def __init__(self, request: TextToImageRequest):
+        self.job_id = str(uuid.uuid4())
+        self.request = request
+        seed = request.seed if request.seed >= 0 else random.randint(0, 2**32 - 1)
+        self.seeds = [seed + i for i in range(request.batch_size)]
+        self.loop = asyncio.get_running_loop()
+        self.future = self.loop.create_future()
+        self.status = "queued"
+        self.step = 0
+        self.eta: Optional[float] = None
+        self.preview: Optional[bytes] = None
+        self.preview_step = 0
+        self.images: List[Any] = []
+        # (형식, 압축) -> 인코딩된 이미지
+        self.encoded: Dict[tuple, List[bytes]] = {}
+        self.error: Optional[str] = None
+        self.cancelled = False
+        self.created_at = time.time()
+        self.enqueued_at = time.perf_counter()
+        # 배치 대기열에 들어온 시간 (모델 로드 대기는 빼고 배치 window 계산)
+        self.batched_at: Optional[float] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # 파이프라인 한 번에 같이 실행된 이미지 수
+        self.pipeline_batch = request.batch_size
+        self.version = 0
+        self._updated = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled")
+
+    def touch(self):
+        # 대기 중인 SSE 요청을 깨움
+        self.version += 1
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    async def wait_update(self, version: int, timeout: float) -> bool:
+        if self.version != version or self.finished:
+            return True
+        try:
+            await asyncio.wait_for(self._updated.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    # 워커 스레드의 스텝 콜백에서 call_soon_threadsafe로 호출
+    def set_progress(self, step: int, eta: float, preview: Optional[bytes]):
+        self.step = step
+        self.eta = eta
+        if preview is not None:
+            self.preview = preview
+            self.preview_step = step
+        self.touch()
+
+    def timings(self) -> Dict[str, Any]:
+        # 요청별 지연 시간 (대기 / 생성 / 전체, 초)
+        end = self.finished_at or time.perf_counter()
+        started = self.started_at or end
+        return {
+            "queue_wait": round(started - self.enqueued_at, 4),
+            "inference": round(end - started, 4),
+            "total": round(end - self.enqueued_at, 4),
+            "batch_size": self.pipeline_batch,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        total = self.request.steps
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "step": self.step,
+            "total_steps": total,
+            "progress": round(self.step / total, 4) if total else 0.0,
+            "eta": None if self.eta is None else round(self.eta, 2),
+            "seeds": self.seeds,
+            "error": self.error,
+            "created_at": self.created_at,
+            "timings": self.timings(),
+        }
+
+
+# 마이크로 배치 스케줄러
+# - 크기/스텝/CFG/샘플러가 같은 요청을 BATCH_WINDOW 동안 모아서 파이프라인 한 번으로 실행
+# - 배치 크기는 이미지 수 기준 (요청의 batch_size 합계가 BATCH_MAX_SIZE 이하)
+# - 파이프라인은 전용 워커 스레드 하나에서만 실행 (이벤트 루프를 막지 않고, GPU 작업은 순서대로)
+# - 실행 중에 들어온 요청은 다음 배치로 자연스럽게 모임
+class MicroBatcher:
+    def __init__(self, run_batch: Callable[[List[GenerationJob]], List[Any]],
+                 key: Callable[[TextToImageRequest], Hashable],
+                 window: float = BATCH_WINDOW, max_size: int = BATCH_MAX_SIZE):
+        self.run_batch = run_batch
+        self.key = key
+        self.window = window
+        self.max_size = max_size
+        # 설정별 대기열 (먼저 들어온 설정부터 처리)
+        self.pending: "OrderedDict[Hashable, List[GenerationJob]]" = OrderedDict()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="diffusers")
+        self.stats = {"requests": 0, "batches": 0, "batched_requests": 0}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def submit(self, job: GenerationJob):
+        job.batched_at = time.perf_counter()
+        self.pending.setdefault(self.key(job.request), []).append(job)
+        self.stats["requests"] += 1
+        self._wakeup.set()
+        return await job.future
+
+    def cancel(self, job: GenerationJob) -> bool:
+        # 아직 실행 전인 작업은 대기열에서 빼고, 실행 중이면 표시만 (스텝 콜백이 확인)
+        job.cancelled = True
+        for key, jobs in list(self.pending.items()):
+            if job in jobs:
+                jobs.remove(job)
+                if not jobs:
+                    del self.pending[key]
+                if not job.future.done():
+                    job.future.set_exception(GenerationCancelled())
+                return True
+        return False
+
+    async def run_exclusive(self, fn: Callable[..., Any], *args):
+        # 배치와 같은 워커 스레드에서 실행 (워밍업 등이 실행 중인 배치와 같은 파이프라인 / GPU를 동시에 쓰지 않게)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def _weight(self, jobs: List[GenerationJob]) -> int:
+        return sum(job.request.batch_size for job in jobs)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            key, jobs = next(iter(self.pending.items()))
+            # 배치가 다 차지 않았으면 가장 오래된 요청이 배치 대기열에 들어온 시간 기준으로 window까지 기다림
+            # (enqueued_at은 모델 로드 전이라 로드가 오래 걸리면 window 없이 바로 실행됨)
+            deadline = jobs[0].batched_at + self.window
+            while self._weight(jobs) < self.max_size and time.perf_counter() < deadline:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), deadline - time.perf_counter())
+                except asyncio.TimeoutError:
+                    break
+                # 기다리는 동안 취소로 목록이 비워지고 같은 설정의 새 목록이 생길 수 있으므로 다시 읽음
+                jobs = self.pending.get(key, [])
+            jobs = self.pending.get(key)
+            if not jobs:
+                # 기다리는 동안 전부 취소됨
+                continue
+
+            # 이미지 수가 max_size를 넘지 않게 앞에서부터 자름 (최소 한 개)
+            count, weight = 0, 0
+            for job in jobs:
+                if count and weight + job.request.batch_size > self.max_size:
+                    break
+                count += 1
+                weight += job.request.batch_size
+            batch, rest = jobs[:count], jobs[count:]
+            del self.pending[key]
+            if rest:
+                # 남은 요청은 같은 설정의 다음 배치로 (순서 유지를 위해 맨 앞에)
+                self.pending[key] = rest
+                self.pending.move_to_end(key, last=False)
+
+            started_at = time.perf_counter()
+            for job in batch:
+                job.started_at = started_at
+                job.pipeline_batch = weight
+                job.status = "running"
+                job.touch()
+            self.stats["batches"] += 1
+            self.stats["batched_requests"] += len(batch)
+
+            try:
+                results = await loop.run_in_executor(self.executor, self.run_batch, batch)
+            except Exception as e:
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                continue
+
+            for job, result in zip(batch, results):
+                if job.future.done():
+                    continue
+                if job.cancelled:
+                    job.future.set_exception(GenerationCancelled())
+                else:
+                    job.future.set_result(result)
+
+    def info(self) -> Dict[str, Any]:
+        batches = self.stats["batches"]
+        return {
+            **self.stats,
+            "window": self.window,
+            "max_size": self.max_size,
+            "pending": sum(len(jobs) for jobs in self.pending.values()),
+            "avg_batch_size": round(self.stats["batched_requests"] / batches, 2) if batches else 0,
+        }
+
+
+# 모델 설정
+# - MODELS: 요청에서 사용할 수 있는 모델 목록 (쉼표로 구분, 첫 번째가 기본 모델)
+# - WARM_MODELS: 서버 시작 후 백그라운드에서 미리 올려둘 모델
+# - PIPELINE_MEMORY_MB: 동시에 올려둘 파이프라인 가중치 합계 (넘으면 오래 안 쓴 모델부터 내림)
+MODELS = [m.strip() for m in os.getenv("MODELS", "runwayml/stable-diffusion-v1-5,Linaqruf/anything-v3.0").split(",") if m.strip()]
+DEFAULT_MODEL = MODELS[0]
+WARM_MODELS = [m.strip() for m in os.getenv("WARM_MODELS", DEFAULT_MODEL).split(",") if m.strip()]
+PIPELINE_MEMORY_MB = int(os.getenv("PIPELINE_MEMORY_MB", "8192"))
+# 프롬프트 임베딩 캐시 크기 (항목 수)
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "256"))
+
+# A1111 샘플러 이름 -> diffusers 스케줄러 (클래스, from_config 옵션)
+SAMPLERS = {
+    "Euler a": (EulerAncestralDiscreteScheduler, {}),
+    "Euler": (EulerDiscreteScheduler, {}),
+    "LMS": (LMSDiscreteScheduler, {}),
+    "LMS Karras": (LMSDiscreteScheduler, {"use_karras_sigmas": True}),
+    "Heun": (HeunDiscreteScheduler, {}),
+    "DPM2": (KDPM2DiscreteScheduler, {}),
+    "DPM2 a": (KDPM2AncestralDiscreteScheduler, {}),
+    "DPM++ 2M": (DPMSolverMultistepScheduler, {}),
+    "DPM++ 2M Karras": (DPMSolverMultistepScheduler, {"use_karras_sigmas": True}),
+    "DPM++ 2M SDE": (DPMSolverMultistepScheduler, {"algorithm_type": "sde-dpmsolver++"}),
+    "DPM++ 2M SDE Karras": (DPMSolverMultistepScheduler, {"algorithm_type": "sde-dpmsolver++", "use_karras_sigmas": True}),
+    "DDIM": (DDIMScheduler, {}),
+    "PLMS": (PNDMScheduler, {}),
+    "UniPC": (UniPCMultistepScheduler, {}),
+    "DEIS": (DEISMultistepScheduler, {}),
+}
+
+# 같은 가중치면 모델끼리 공유할 수 있는 구성 요소
+SHAREABLE_COMPONENTS = ("vae", "text_encoder", "text_encoder_2", "tokenizer", "tokenizer_2")
+WEIGHT_SUFFIXES = (".safetensors", ".bin")
+
+device = "mps" if torch.backends.mps.is_available() else "cpu"
+print(f"using device: {device}")
+
+
+def _cpu_supports_bf16() -> bool:
+    # AVX512-BF16 / AMX가 없으면 bf16이 오히려 느림
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def pick_dtype():
+    if device == "cpu" and PROFILE_SETTINGS["bf16"] and _cpu_supports_bf16():
+        return torch.bfloat16
+    # MPS에서는 float32가 더 안정적
+    return torch.float32
+
+
+dtype = pick_dtype()
+# MPS에서는 torch.compile 이득이 없고 불안정함
+compile_unet = PROFILE_SETTINGS["compile"] and device != "mps"
+print(f"profile: {PROFILE} (dtype={dtype}, compile={compile_unet})")
+
+
+# 프로필 / 해상도별 측정 속도
+class ProfileStats:
+    def __init__(self):
+        self.resolutions: Dict[str, Dict[str, float]] = {}
+
+    def record(self, width: int, height: int, steps: int, images: int, elapsed: float):
+        key = f"{width}x{height}"
+        its = steps / elapsed if elapsed > 0 else 0.0
+        ips = images / elapsed if elapsed > 0 else 0.0
+        stats = self.resolutions.get(key)
+        if stats is None:
+            self.resolutions[key] = {"it_s": its, "images_s": ips, "runs": 1}
+            return
+        stats["it_s"] = stats["it_s"] * 0.8 + its * 0.2
+        stats["images_s"] = stats["images_s"] * 0.8 + ips * 0.2
+        stats["runs"] += 1
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "name": PROFILE,
+            "dtype": str(dtype).replace("torch.", ""),
+            "channels_last": PROFILE_SETTINGS["channels_last"],
+            "compile": compile_unet,
+            "slicing": PROFILE_SETTINGS["slicing"],
+            "slicing_min_pixels": SLICING_MIN_PIXELS,
+            "measured": {
+                key: {"it_s": round(v["it_s"], 3), "images_s": round(v["images_s"], 3), "runs": v["runs"]}
+                for key, v in self.resolutions.items()
+            },
+        }
+
+
+profile_stats = ProfileStats()
+
+
+def _module_bytes(module) -> int:
+    if not isinstance(module, torch.nn.Module):
+        return 0
+    return sum(p.numel() * p.element_size() for p in module.parameters())
+
+
+def _component_fingerprint(folder: str) -> Optional[tuple]:
+    # HF 캐시의 blob 파일 이름은 내용 해시이므로, 실제 파일 경로가 같으면 같은 가중치
+    if not os.path.isdir(folder):
+        return None
+    return tuple(sorted(
+        os.path.basename(os.path.realpath(os.path.join(folder, name)))
+        for name in os.listdir(folder)
+    ))
+
+
+# 프롬프트 임베딩 캐시 (같은 프롬프트를 시드/크기만 바꿔서 다시 요청할 때 CLIP 인코딩 생략)
+# encode는 배치 워커 스레드, forget(모델 내림) / info는 이벤트 루프에서 호출되므로 entries는 락으로 보호
+# (인코딩 자체는 락 밖에서 실행)
+class PromptEmbeddingCache:
+    def __init__(self, limit: int = EMBED_CACHE_SIZE):
+        self.limit = limit
+        self.entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    def encode(self, model: str, pipe, prompt: str, negative_prompt: str, guidance: bool):
+        key = (model, prompt, negative_prompt, guidance)
+        with self._lock:
+            cached = self.entries.get(key)
+            if cached is not None:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return cached
+            self.stats["misses"] += 1
+
+        with torch.no_grad():
+            cached = pipe.encode_prompt(
+                prompt, pipe.device, 1, guidance, negative_prompt=negative_prompt or None,
+            )
+        with self._lock:
+            self.entries[key] = cached
+            while len(self.entries) > self.limit:
+                self.entries.popitem(last=False)
+        return cached
+
+    def forget(self, model: str):
+        with self._lock:
+            for key in [k for k in self.entries if k[0] == model]:
+                del self.entries[key]
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            entries = len(self.entries)
+        total = stats["hits"] + stats["misses"]
+        return {
+            **stats,
+            "entries": entries,
+            "hit_rate": round(stats["hits"] / total, 4) if total else 0.0,
+        }
+
+
+embeddings = PromptEmbeddingCache()
+
+
+# 메모리에 올라간 파이프라인 하나
+class LoadedPipeline:
+    def __init__(self, model: str, pipe, fingerprints: Dict[str, tuple]):
+        self.model = model
+        self.pipe = pipe
+        self.fingerprints = fingerprints
+        # 샘플러별 스케줄러 (모델의 기본 스케줄러 설정으로 한 번만 생성)
+        self.default_scheduler = pipe.scheduler
+        self.schedulers: Dict[str, Any] = {}
+        self.stats = {"scheduler_hits": 0, "scheduler_misses": 0}
+        self.in_use = 0
+        self.last_used = time.time()
+        self.loaded_at = time.time()
+
+    # 해상도에 따라 slicing을 켜고 끔
+    # VAE / UNet은 다른 파이프라인과 공유될 수 있어서 (다른 파이프라인이 바꿨을 수 있음) 배치마다 다시 적용
+    def set_slicing(self, width: int, height: int):
+        mode = PROFILE_SETTINGS["slicing"]
+        enabled = mode == "always" or (mode == "auto" and width * height >= SLICING_MIN_PIXELS)
+        if enabled:
+            self.pipe.enable_attention_slicing()
+            self.pipe.enable_vae_slicing()
+            self.pipe.enable_vae_tiling()
+        else:
+            self.pipe.disable_attention_slicing()
+            self.pipe.disable_vae_slicing()
+            self.pipe.disable_vae_tiling()
+
+    def scheduler(self, sampler_name: str):
+        # Flux 등 flow matching 모델은 전용 스케줄러만 사용
+        if "FlowMatch" in type(self.default_scheduler).__name__:
+            return self.default_scheduler
+        scheduler = self.schedulers.get(sampler_name)
+        if scheduler is not None:
+            self.stats["scheduler_hits"] += 1
+            return scheduler
+        self.stats["scheduler_misses"] += 1
+        scheduler_class, options = SAMPLERS[sampler_name]
+        scheduler = scheduler_class.from_config(self.default_scheduler.config, **options)
+        self.schedulers[sampler_name] = scheduler
+        return scheduler
+
+
+# 파이프라인 관리
+# - 처음 요청될 때 로드 (모델별 락으로 같은 모델을 두 번 로드하지 않음)
+# - VAE / 텍스트 인코더 / 토크나이저는 가중치 파일이 같으면 이미 올라간 모델의 것을 재사용
+# - 가중치 합계가 PIPELINE_MEMORY_MB를 넘으면 사용 중이 아닌 모델을 LRU 순서로 내림
+class PipelineManager:
+    def __init__(self, models: List[str] = MODELS, memory_limit: int = PIPELINE_MEMORY_MB * 1024 * 1024):
+        self.models = models
+        self.memory_limit = memory_limit
+        self.loaded: "OrderedDict[str, LoadedPipeline]" = OrderedDict()
+        self.loading: Dict[str, str] = {}
+        self.errors: Dict[str, str] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def memory_used(self) -> int:
+        # 공유된 구성 요소는 한 번만 계산
+        seen = {}
+        for entry in self.loaded.values():
+            for component in entry.pipe.components.values():
+                if isinstance(component, torch.nn.Module):
+                    seen[id(component)] = _module_bytes(component)
+        return sum(seen.values())
+
+    async def acquire(self, model: str) -> LoadedPipeline:
+        if model not in self.models:
+            raise ValueError(f"사용할 수 없는 모델입니다: {model}")
+        entry = self.loaded.get(model)
+        if entry is None:
+            lock = self._locks.setdefault(model, asyncio.Lock())
+            async with lock:
+                entry = self.loaded.get(model)
+                if entry is None:
+                    entry = await self._load(model)
+        entry.in_use += 1
+        entry.last_used = time.time()
+        self.loaded.move_to_end(model)
+        return entry
+
+    def release(self, entry: LoadedPipeline):
+        entry.in_use -= 1
+        entry.last_used = time.time()
+
+    async def _load(self, model: str) -> LoadedPipeline:
+        self.loading[model] = "downloading"
+        try:
+            folder = await asyncio.to_thread(DiffusionPipeline.download, model)
+            fingerprints = {}
+            shared = {}
+            new_bytes = 0
+            for name in os.listdir(folder):
+                path = os.path.join(folder, name)
+                fingerprint = _component_fingerprint(path)
+                if fingerprint is None:
+                    continue
+                fingerprints[name] = fingerprint
+                component = self._find_shared(name, fingerprint)
+                if component is not None:
+                    shared[name] = component
+                    continue
+                new_bytes += sum(
+                    os.path.getsize(os.path.join(path, f)) for f in os.listdir(path) if f.endswith(WEIGHT_SUFFIXES)
+                )
+
+            self._evict(new_bytes)
+            self.loading[model] = "loading"
+            if shared:
+                print(f"구성 요소 공유 ({model}): {', '.join(shared)}")
+            pipe = await asyncio.to_thread(self._create, folder, shared)
+            if compile_unet and (getattr(pipe, "unet", None) or getattr(pipe, "transformer", None)) is not None:
+                # 컴파일 워밍업은 배치 워커 스레드에서 (공유 구성 요소를 쓰는 배치와 동시에 실행되지 않게)
+                self.loading[model] = "warming up"
+                await batcher.run_exclusive(self._warmup, pipe)
+        except Exception as e:
+            self.errors[model] = str(e)
+            raise
+        finally:
+            self.loading.pop(model, None)
+
+        self.errors.pop(model, None)
+        entry = LoadedPipeline(model, pipe, fingerprints)
+        self.loaded[model] = entry
+        print(f"모델 로드 완료: {model} ({self.memory_used() // (1024 * 1024)}MB 사용 중)")
+        return entry
+
+    def _find_shared(self, name: str, fingerprint: tuple):
+        if name not in SHAREABLE_COMPONENTS:
+            return None
+        for entry in self.loaded.values():
+            if entry.fingerprints.get(name) == fingerprint and name in entry.pipe.components:
+                return entry.pipe.components[name]
+        return None
+
+    def _create(self, folder: str, shared: Dict[str, Any]):
+        # Stable Diffusion의 전체 과정을 하나의 파이프라인으로 처리 (모델 종류는 model_index.json 기준)
+        pipe = AutoPipelineForText2Image.from_pretrained(
+            folder,
+            torch_dtype=dtype,
+            safety_checker=None,
+            **shared,
+        )
+        pipe = pipe.to(device)
+        #모델 성능 최적화 (프로필 기준)
+        denoiser = getattr(pipe, "unet", None) or getattr(pipe, "transformer", None)
+        if denoiser is not None and PROFILE_SETTINGS["channels_last"]:
+            denoiser.to(memory_format=torch.channels_last)
+        if denoiser is not None and compile_unet:
+            compiled = torch.compile(denoiser)
+            if hasattr(pipe, "unet"):
+                pipe.unet = compiled
+            else:
+                pipe.transformer = compiled
+        return pipe
+
+    def _warmup(self, pipe):
+        # 컴파일은 첫 실행 때 일어나므로 자주 쓰는 해상도로 미리 실행
+        for resolution in WARMUP_RESOLUTIONS:
+            try:
+                width, height = (int(v) for v in resolution.split("x"))
+                started_at = time.perf_counter()
+                pipe(prompt="warmup", width=width, height=height, num_inference_steps=2)
+                print(f"워밍업 완료: {resolution} ({time.perf_counter() - started_at:.1f}초)")
+            except Exception as e:
+                print(f"워밍업 실패 ({resolution}): {str(e)}")
+
+    def _evict(self, needed: int):
+        while self.loaded and self.memory_used() + needed > self.memory_limit:
+            # OrderedDict 순서 = 최근 사용 순서
+            victim = next((model for model, entry in self.loaded.items() if entry.in_use == 0), None)
+            if victim is None:
+                break
+            del self.loaded[victim]
+            embeddings.forget(victim)
+            print(f"모델 내림: {victim}")
+            gc.collect()
+            if device == "mps":
+                torch.mps.empty_cache()
+
+    async def warm(self, models: List[str]):
+        for model in models:
+            try:
+                entry = await self.acquire(model)
+                self.release(entry)
+            except Exception as e:
+                print(f"모델 미리 로드 실패 ({model}): {str(e)}")
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "available": self.models,
+            "loaded": [
+                {"model": e.model, "in_use": e.in_use, "last_used": e.last_used, "loaded_at": e.loaded_at,
+                 "samplers": list(e.schedulers), **e.stats}
+                for e in self.loaded.values()
+            ],
+            "loading": self.loading,
+            "errors": self.errors,
+            "memory_mb": self.memory_used() // (1024 * 1024),
+            "memory_limit_mb": self.memory_limit // (1024 * 1024),
+        }
+
+
+pipelines = PipelineManager()
+
+
+# 같은 배치로 묶을 수 있는 요청인지 판단하는 기준 (프롬프트만 달라야 함)
+def batch_key(request: TextToImageRequest):
+    return (request.model or DEFAULT_MODEL, request.width, request.height, request.steps, request.cfg_scale, request.sampler_name)
+
+
+# SD 1.x latent 4채널 -> RGB 근사 계수 (VAE 디코딩 없이 미리보기 생성)
+LATENT_RGB_FACTORS = [
+    [0.3512, 0.2297, 0.3227],
+    [0.3250, 0.4974, 0.2350],
+    [-0.2829, 0.1762, 0.2721],
+    [-0.2120, -0.2616, -0.7177],
+]
+
+
+def latent_preview(latent) -> bytes:
+    # (4, h/8, w/8) latent를 작은 JPEG로 변환
+    factors = torch.tensor(LATENT_RGB_FACTORS, dtype=torch.float32)
+    rgb = torch.einsum("chw,cr->hwr", latent.detach().float().cpu(), factors)
+    rgb = ((rgb + 1.0) / 2.0).clamp(0, 1).mul(255).byte().numpy()
+    buffered = BytesIO()
+    Image.fromarray(rgb).save(buffered, format="JPEG", quality=70)
+    return buffered.getvalue()
+
+
+# 워커 스레드에서 실행: 프롬프트 목록을 한 번에 생성
+# 파이프라인은 작업 실행 전에 acquire 해둔 상태이므로 여기서는 꺼내 쓰기만 함
+def run_pipeline(jobs: List[GenerationJob]):
+    first = jobs[0].request
+    model = first.model or DEFAULT_MODEL
+    entry = pipelines.loaded[model]
+    pipe = entry.pipe
+    # 배치 안의 요청은 샘플러가 같음 (batch_key)
+    pipe.scheduler = entry.scheduler(first.sampler_name)
+    entry.set_slicing(first.width, first.height)
+
+    # 요청별 batch_size만큼 펼침 (이미지마다 시드 하나)
+    requests = [job.request for job in jobs for _ in job.seeds]
+    generators = [torch.Generator("cpu").manual_seed(seed) for job in jobs for seed in job.seeds]
+    offsets = []
+    offset = 0
+    for job in jobs:
+        offsets.append(offset)
+        offset += len(job.seeds)
+
+    kwargs = {}
+    if isinstance(pipe, StableDiffusionPipeline):
+        # 캐시된 임베딩을 이어붙여서 prompt_embeds로 전달
+        guidance = first.cfg_scale > 1.0
+        encoded = [embeddings.encode(model, pipe, r.prompt, r.negative_prompt, guidance) for r in requests]
+        kwargs["prompt_embeds"] = torch.cat([e[0] for e in encoded])
+        if guidance:
+            kwargs["negative_prompt_embeds"] = torch.cat([e[1] for e in encoded])
+    else:
+        kwargs["prompt"] = [r.prompt for r in requests]
+        # Flux 계열은 negative_prompt를 받지 않음
+        if "negative_prompt" in inspect.signature(pipe.__call__).parameters:
+            kwargs["negative_prompt"] = [r.negative_prompt for r in requests]
+
+    previewable = PREVIEW_EVERY > 0 and isinstance(pipe, StableDiffusionPipeline)
+    started_at = time.perf_counter()
+
+    # 스텝마다 진행률 / ETA 전달, N스텝마다 미리보기, 배치 전체가 취소되면 중단
+    def on_step_end(pipe, step, timestep, callback_kwargs):
+        done = step + 1
+        total = first.steps
+        eta = (time.perf_counter() - started_at) / done * (total - done)
+        latents = callback_kwargs.get("latents")
+        make_preview = previewable and latents is not None and latents.shape[1] == 4 and done % PREVIEW_EVERY == 0 and done < total
+        for job, index in zip(jobs, offsets):
+            preview = latent_preview(latents[index]) if make_preview and not job.cancelled else None
+            job.loop.call_soon_threadsafe(job.set_progress, done, eta, preview)
+        if all(job.cancelled for job in jobs):
+            pipe._interrupt = True
+        return callback_kwargs
+
+    images = pipe(
+        width=first.width,
+        height=first.height,
+        num_inference_steps=first.steps,
+        guidance_scale=first.cfg_scale,
+        generator=generators,
+        callback_on_step_end=on_step_end,
+        **kwargs,
+    ).images
+    if not any(job.cancelled for job in jobs):
+        profile_stats.record(first.width, first.height, first.steps, len(images), time.perf_counter() - started_at)
+    return [images[index:index + len(job.seeds)] for job, index in zip(jobs, offsets)]
+
+
+batcher: Optional[MicroBatcher] = None
+
+
+# 작업 목록 (오래된 완료 작업부터 정리)
+class JobStore:
+    def __init__(self, limit: int = JOB_HISTORY_LIMIT):
+        self.limit = limit
+        self.jobs: "OrderedDict[str, GenerationJob]" = OrderedDict()
+
+    def add(self, job: GenerationJob):
+        self.jobs[job.job_id] = job
+        while len(self.jobs) > self.limit:
+            oldest = next((jid for jid, j in self.jobs.items() if j.finished), None)
+            if oldest is None:
+                break
+            del self.jobs[oldest]
+
+    def get(self, job_id: str) -> Optional[GenerationJob]:
+        return self.jobs.get(job_id)
+
+
+jobs = JobStore()
+encoder = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="encoder")
+os.makedirs(ARTIFACT_DIR, exist_ok=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global batcher
+    batcher = MicroBatcher(run_pipeline, batch_key)
+    batcher.start()
+    # 모델은 백그라운드에서 로드 (/health는 바로 응답)
+    warm_task = asyncio.create_task(pipelines.warm(WARM_MODELS))
+    yield
+    warm_task.cancel()
+    await batcher.stop()
+    encoder.shutdown(wait=False)
+
 
 # FastAPI 프레임워크를 사용해서 서버 생성
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # CORS 설정
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["http://localhost:5173"], 
+    allow_origins=["http://localhost:5173"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
-model_id = "runwayml/stable-diffusion-v1-5" 
 
-# Linaqruf/anything-v3.0
-# runwayml/stable-diffusion-v1-5
+# 요청 검증 후 작업 생성
+def create_job(request: TextToImageRequest) -> GenerationJob:
+    if (request.model or DEFAULT_MODEL) not in pipelines.models:
+        raise HTTPException(status_code=400, detail=f"사용할 수 없는 모델입니다: {request.model}")
+    if request.sampler_name not in SAMPLERS:
+        raise HTTPException(status_code=400, detail=f"지원하지 않는 샘플러입니다: {request.sampler_name} ({', '.join(SAMPLERS)})")
+    if request.response_format not in RESPONSE_FORMATS or request.image_format not in IMAGE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"응답 형식은 {', '.join(RESPONSE_FORMATS)}, 이미지 형식은 {', '.join(IMAGE_FORMATS)} 중 하나여야 합니다.")
+    if not 1 <= request.batch_size <= MAX_IMAGES_PER_REQUEST:
+        raise HTTPException(status_code=400, detail=f"batch_size는 1~{MAX_IMAGES_PER_REQUEST} 사이여야 합니다.")
+    job = GenerationJob(request)
+    jobs.add(job)
+    return job
 
-device = "mps" if torch.backends.mps.is_available() else "cpu"
-print(f"using device: {device}")
 
-# Stable Diffusion의 전체 과정을 하나의 파이프라인으로 처리
-pipe = StableDiffusionPipeline.from_pretrained(
-    model_id,
-     # MPS에서는 float32가 더 안정적
-    torch_dtype=torch.float32, 
-    safety_checker=None
-)
+# 모델 로드 -> 배치 대기열 -> 결과 저장 (작업 상태는 job에 기록)
+async def run_job(job: GenerationJob):
+    model = job.request.model or DEFAULT_MODEL
+    entry = None
+    try:
+        entry = await pipelines.acquire(model)
+        if job.cancelled:
+            raise GenerationCancelled()
+        job.images = await batcher.submit(job)
+        job.status = "completed"
+    except GenerationCancelled:
+        job.status = "cancelled"
+    except Exception as e:
+        job.status = "failed"
+        job.error = str(e)
+    finally:
+        if entry is not None:
+            pipelines.release(entry)
+        job.finished_at = time.perf_counter()
+        job.touch()
+    print(f"이미지 생성 {job.status}: {job.job_id} {job.timings()}")
 
-pipe = pipe.to(device)
-#모델 성능 최적화
-pipe.enable_attention_slicing()
-pipe.enable_vae_tiling()
 
-class TextToImageRequest(BaseModel):
-    prompt: str
-    negative_prompt: str = ""
-    width: int = 512
-    height: int = 512
-    steps: int = 20  
-    cfg_scale: float = 7.0 
-    sampler_name: str = "Euler a"
+# 워커 스레드에서 인코딩 (이벤트 루프를 막지 않음)
+def encode_image(image, image_format: str, compression: Optional[int]) -> bytes:
+    pil_format, _, _ = IMAGE_FORMATS[image_format]
+    options = {}
+    if image_format == "png":
+        # 0(빠름, 큼) ~ 9(느림, 작음)
+        options["compress_level"] = 6 if compression is None else max(0, min(9, compression))
+    else:
+        options["quality"] = 90 if compression is None else max(1, min(100, compression))
+    buffered = BytesIO()
+    image.save(buffered, format=pil_format, **options)
+    return buffered.getvalue()
+
+
+async def encode_images(job: GenerationJob, image_format: str = "png", compression: Optional[int] = None) -> List[bytes]:
+    # 같은 형식으로 다시 요청하면 인코딩 결과 재사용
+    key = (image_format, compression)
+    if key not in job.encoded:
+        loop = asyncio.get_running_loop()
+        job.encoded[key] = list(await asyncio.gather(*(
+            loop.run_in_executor(encoder, encode_image, image, image_format, compression)
+            for image in job.images
+        )))
+    return job.encoded[key]
+
+
+def artifact_name(job: GenerationJob, index: int, image_format: str) -> str:
+    return f"{job.job_id}_{index}.{IMAGE_FORMATS[image_format][2]}"
+
+
+async def store_artifacts(job: GenerationJob, image_format: str, compression: Optional[int]) -> List[str]:
+    # 결과를 파일로 저장하고 URL 반환
+    urls, written = [], []
+    loop = asyncio.get_running_loop()
+    for index, data in enumerate(await encode_images(job, image_format, compression)):
+        name = artifact_name(job, index, image_format)
+        path = os.path.join(ARTIFACT_DIR, name)
+        if not os.path.exists(path):
+            await loop.run_in_executor(encoder, _write_file, path, data)
+            written.append(name)
+        urls.append(f"/sdapi/v1/artifacts/{name}")
+    if written:
+        await loop.run_in_executor(encoder, _prune_artifacts, set(written))
+    return urls
+
+
+def _write_file(path: str, data: bytes):
+    tmp_path = f"{path}.part"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _prune_artifacts(keep: set):
+    # 폴더 크기가 ARTIFACT_MAX_MB를 넘으면 오래된 파일부터 삭제 (방금 저장한 파일은 남김)
+    files = []
+    for entry in os.scandir(ARTIFACT_DIR):
+        if entry.is_file() and not entry.name.endswith(".part"):
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path, entry.name))
+    total = sum(size for _, size, _, _ in files)
+    limit = ARTIFACT_MAX_MB * 1024 * 1024
+    for _, size, path, name in sorted(files):
+        if total <= limit:
+            break
+        if name in keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+# 결과 응답 형식
+# - base64: A1111 호환 JSON (기본값)
+# - binary: 이미지 한 장이면 본문 그대로, 여러 장이면 multipart/mixed
+# - url: 파일로 저장하고 JSON에 URL만 반환
+async def image_response(job: GenerationJob, payload: Dict[str, Any], response_format: str,
+                         image_format: str, compression: Optional[int]):
+    if response_format not in RESPONSE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"지원하지 않는 응답 형식입니다: {response_format} ({', '.join(RESPONSE_FORMATS)})")
+    if image_format not in IMAGE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"지원하지 않는 이미지 형식입니다: {image_format} ({', '.join(IMAGE_FORMATS)})")
+
+    if response_format == "url":
+        return {**payload, "images": await store_artifacts(job, image_format, compression)}
+
+    images = await encode_images(job, image_format, compression)
+    if response_format == "base64":
+        return {**payload, "images": [base64.b64encode(data).decode() for data in images]}
+
+    media_type = IMAGE_FORMATS[image_format][1]
+    headers = {"X-Job-Id": job.job_id, "X-Seeds": ",".join(str(seed) for seed in job.seeds)}
+    if len(images) == 1:
+        return Response(content=images[0], media_type=media_type, headers=headers)
 
+    boundary = uuid.uuid4().hex
+    parts = []
+    for index, (data, seed) in enumerate(zip(images, job.seeds)):
+        parts.append(
+            f"--{boundary}\r\n"
+            f"Content-Type: {media_type}\r\n"
+            f"Content-Disposition: attachment; filename=\"{artifact_name(job, index, image_format)}\"\r\n"
+            f"X-Seed: {seed}\r\n"
+            f"Content-Length: {len(data)}\r\n\r\n".encode()
+        )
+        parts.append(data)
+        parts.append(b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return Response(content=b"".join(parts), media_type=f"multipart/mixed; boundary={boundary}", headers=headers)
 
-# 이미지 생성 엔드포인트
+
+# 이미지 생성 엔드포인트 (A1111 호환, 끝날 때까지 기다렸다가 응답)
 @app.post("/sdapi/v1/txt2img")
 async def generate_image(request: TextToImageRequest):
-    try:
-      
-        image = pipe(
-            prompt=request.prompt,
-            negative_prompt=request.negative_prompt,
-            width=request.width,
-            height=request.height,
-            num_inference_steps=request.steps, 
-            guidance_scale=request.cfg_scale, 
-    
-        ).images[0]
-
-        # base64 인코딩된 문자열로 변환
-        buffered = BytesIO()
-        image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-
-        return {"images": [img_str]}
+    job = create_job(request)
+    await run_job(job)
+    if job.status == "cancelled":
+        raise HTTPException(status_code=409, detail="작업이 취소되었습니다.")
+    if job.status != "completed":
+        raise HTTPException(status_code=500, detail=job.error)
+    info = {**job.timings(), "seeds": job.seeds, "job_id": job.job_id}
+    return await image_response(job, {"info": json.dumps(info)}, request.response_format,
+                                request.image_format, request.compression)
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+
+# 작업 API: 제출하면 바로 job_id를 반환하고 진행률은 /events로 확인
+@app.post("/sdapi/v1/jobs")
+async def submit_job(request: TextToImageRequest):
+    job = create_job(request)
+    asyncio.create_task(run_job(job))
+    return job.to_dict()
+
+
+def get_job_or_404(job_id: str) -> GenerationJob:
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"작업 '{job_id}'를 찾을 수 없습니다.")
+    return job
+
+
+@app.get("/sdapi/v1/jobs/{job_id}")
+async def get_job(job_id: str, response_format: Optional[str] = None,
+                  image_format: Optional[str] = None, compression: Optional[int] = None):
+    job = get_job_or_404(job_id)
+    if job.status != "completed":
+        return job.to_dict()
+    # 지정하지 않으면 작업 요청에 있던 형식 사용
+    return await image_response(
+        job, job.to_dict(),
+        response_format or job.request.response_format,
+        image_format or job.request.image_format,
+        compression if compression is not None else job.request.compression,
+    )
+
+
+# 결과 이미지 한 장 (본문 그대로)
+@app.get("/sdapi/v1/jobs/{job_id}/images/{index}")
+async def get_job_image(job_id: str, index: int, image_format: Optional[str] = None,
+                        compression: Optional[int] = None):
+    job = get_job_or_404(job_id)
+    if job.status != "completed" or not 0 <= index < len(job.images):
+        raise HTTPException(status_code=404, detail="이미지를 찾을 수 없습니다.")
+    image_format = image_format or job.request.image_format
+    if image_format not in IMAGE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"지원하지 않는 이미지 형식입니다: {image_format}")
+    if compression is None:
+        compression = job.request.compression
+    data = (await encode_images(job, image_format, compression))[index]
+    return Response(content=data, media_type=IMAGE_FORMATS[image_format][1],
+                    headers={"X-Seed": str(job.seeds[index])})
+
+
+# 저장된 결과 파일
+@app.get("/sdapi/v1/artifacts/{name}")
+async def get_artifact(name: str):
+    path = os.path.join(ARTIFACT_DIR, os.path.basename(name))
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="파일을 찾을 수 없습니다.")
+    return FileResponse(path, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+
+# SSE: progress(스텝 / ETA), preview(base64 JPEG), done
+@app.get("/sdapi/v1/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    job = get_job_or_404(job_id)
+
+    async def event_stream():
+        version = -1
+        preview_step = 0
+        while True:
+            if job.version != version:
+                version = job.version
+                if job.preview is not None and job.preview_step != preview_step:
+                    preview_step = job.preview_step
+                    preview = {"step": preview_step, "image": base64.b64encode(job.preview).decode()}
+                    yield f"event: preview\ndata: {json.dumps(preview)}\n\n"
+                event = "done" if job.finished else "progress"
+                yield f"event: {event}\ndata: {json.dumps(job.to_dict())}\n\n"
+                if job.finished:
+                    return
+            elif not await job.wait_update(version, SSE_KEEPALIVE):
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# 작업 취소 (대기 중이면 바로 제거, 실행 중이면 배치 전체가 취소됐을 때 디노이징 중단)
+@app.delete("/sdapi/v1/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = get_job_or_404(job_id)
+    if not job.finished:
+        batcher.cancel(job)
+    return job.to_dict()
+
+
+# A1111 호환: 실행 중인 작업 전부 중단
+@app.post("/sdapi/v1/interrupt")
+async def interrupt():
+    running = [job for job in jobs.jobs.values() if job.status == "running"]
+    for job in running:
+        batcher.cancel(job)
+    return {"cancelled": [job.job_id for job in running]}
 
 
 # 서버 상태 확인
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "model": model_id, "device": device}
+    return {
+        "status": "healthy",
+        "model": DEFAULT_MODEL,
+        "device": device,
+        "models": pipelines.info(),
+        "profile": profile_stats.info(),
+        "batching": batcher.info(),
+        "prompt_cache": embeddings.info(),
+        "jobs": {
+            "total": len(jobs.jobs),
+            "running": sum(1 for job in jobs.jobs.values() if job.status == "running"),
+            "queued": sum(1 for job in jobs.jobs.values() if job.status == "queued"),
+        },
+    }
 
 if __name__ == "__main__":
     import uvicorn
-    print(f"Starting server with {model_id} model on {device}...")
-    uvicorn.run(app, host="127.0.0.1", port=7861)
\ No newline at end of file
+    print(f"Starting server with {DEFAULT_MODEL} model on {device}...")
+    uvicorn.run(app, host="127.0.0.1", port=7861)
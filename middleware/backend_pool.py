@@ -0,0 +1,180 @@
+import asyncio
+import time
+import urllib.parse
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from config import (
+    COMFY_BACKENDS,
+    COMFY_STATUS_TIMEOUT,
+    BACKEND_HEALTH_INTERVAL,
+    BACKEND_FAILURE_THRESHOLD,
+    BACKEND_AFFINITY_SLACK,
+)
+from comfy_client import ComfyClient
+from log import get_logger
+
+
+logger = get_logger("backend_pool")
+
+
+# 워크플로우가 사용하는 모델 조합 (("unet_name", "flux1-schnell-Q4_1.gguf"), ...)
+ModelSignature = Tuple[Tuple[str, str], ...]
+
+
+def _backend_name(url: str) -> str:
+    return urllib.parse.urlparse(url).netloc or url
+
+
+# ComfyUI 서버 하나
+class Backend:
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.url = url.rstrip("/")
+        self.ws_url = self.url.replace("http", "ws", 1) + "/ws"
+        self.client = ComfyClient(self.url, name=name)
+        self.healthy = True
+        self.failures = 0
+        self.last_check: Optional[float] = None
+        self.last_error: Optional[str] = None
+        # 스케줄러가 보낸 작업 수 / ComfyUI가 알려준 대기열 길이
+        self.inflight = 0
+        self.queue_remaining = 0
+        # 최근에 실행한 모델 조합 (메모리에 올라가 있을 가능성이 높음)
+        self.loaded_models: "OrderedDict[ModelSignature, float]" = OrderedDict()
+
+    @property
+    def available(self) -> bool:
+        # 상태 확인은 통과했어도 최근 요청이 계속 실패해서 서킷이 열려 있으면 보내지 않음
+        return self.healthy and not self.client.breaker.is_open
+
+    @property
+    def load(self) -> int:
+        return max(self.inflight, self.queue_remaining)
+
+    def has_models(self, models: ModelSignature) -> bool:
+        return bool(models) and models in self.loaded_models
+
+    def note_models(self, models: ModelSignature, keep: int = 2):
+        if not models:
+            return
+        self.loaded_models.pop(models, None)
+        self.loaded_models[models] = time.time()
+        while len(self.loaded_models) > keep:
+            self.loaded_models.popitem(last=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "url": self.url,
+            "healthy": self.healthy,
+            "circuit": self.client.breaker.state,
+            "inflight": self.inflight,
+            "queue_remaining": self.queue_remaining,
+            "last_check": self.last_check,
+            "last_error": self.last_error,
+            "loaded_models": [dict(models) for models in self.loaded_models],
+        }
+
+
+# ComfyUI 백엔드 풀
+# - /system_stats 주기 확인으로 상태 판정 (연속 실패 시 unhealthy)
+# - 라우팅: 정상이고 서킷이 닫힌 백엔드 중 대기열이 가장 짧은 곳, 같은 모델이 올라가 있으면 우선
+# - 백엔드가 죽으면 리스너(스케줄러)에 알려서 실행 중이던 작업을 다른 곳으로 옮김
+class BackendPool:
+    def __init__(self, urls: Iterable[str] = COMFY_BACKENDS):
+        self.backends: "OrderedDict[str, Backend]" = OrderedDict()
+        for entry in urls:
+            name, _, url = entry.rpartition("=")
+            url = url.strip()
+            name = name.strip() or _backend_name(url)
+            self.backends[name] = Backend(name, url)
+        self._down_listeners: List[Callable[[Backend], None]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def default(self) -> Backend:
+        return next(iter(self.backends.values()))
+
+    def get(self, name: Optional[str]) -> Backend:
+        if name and name in self.backends:
+            return self.backends[name]
+        return self.default
+
+    def healthy(self) -> List[Backend]:
+        return [b for b in self.backends.values() if b.available]
+
+    def ordered(self, preferred: Optional[str] = None) -> List[Backend]:
+        # preferred 백엔드 먼저, 나머지는 정상 백엔드 우선
+        backends = sorted(self.backends.values(), key=lambda b: not b.available)
+        if preferred in self.backends:
+            backends.remove(self.backends[preferred])
+            backends.insert(0, self.backends[preferred])
+        return backends
+
+    def choose(self, models: ModelSignature = (), capacity: Optional[int] = None,
+               exclude: Iterable[str] = ()) -> Optional[Backend]:
+        candidates = [
+            b for b in self.healthy()
+            if b.name not in exclude and (capacity is None or b.inflight < capacity)
+        ]
+        if not candidates:
+            return None
+        least = min(b.load for b in candidates)
+        # 모델이 이미 올라가 있는 백엔드는 대기열이 조금 더 길어도 우선
+        warm = [b for b in candidates if b.has_models(models) and b.load <= least + BACKEND_AFFINITY_SLACK]
+        return min(warm or candidates, key=lambda b: b.load)
+
+    def add_down_listener(self, listener: Callable[[Backend], None]):
+        self._down_listeners.append(listener)
+
+    # 상태 확인
+    async def check(self, backend: Backend) -> bool:
+        backend.last_check = time.time()
+        try:
+            # 서킷이 열려 있어도 보내서 성공하면 서킷도 닫음
+            await backend.client.request("GET", "/system_stats", timeout=COMFY_STATUS_TIMEOUT, retries=0, probe=True)
+        except Exception as e:
+            backend.failures += 1
+            backend.last_error = str(e)
+            if backend.healthy and backend.failures >= BACKEND_FAILURE_THRESHOLD:
+                backend.healthy = False
+                logger.warning("ComfyUI 백엔드 응답 없음", extra={"backend": backend.name, "error": str(e)})
+                for listener in self._down_listeners:
+                    listener(backend)
+            return False
+
+        if not backend.healthy:
+            logger.info("ComfyUI 백엔드 복구", extra={"backend": backend.name})
+        backend.healthy = True
+        backend.failures = 0
+        backend.last_error = None
+        return True
+
+    def mark_failed(self, backend: Backend, error: str):
+        # 요청 실패를 상태 확인 실패와 같이 취급
+        backend.failures = max(backend.failures, BACKEND_FAILURE_THRESHOLD - 1)
+        backend.last_error = error
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for backend in self.backends.values():
+            await backend.client.close()
+
+    async def _run(self):
+        while True:
+            await asyncio.gather(*(self.check(b) for b in self.backends.values()))
+            await asyncio.sleep(BACKEND_HEALTH_INTERVAL)
+
+
+pool = BackendPool()
@@ -0,0 +1,138 @@
+import random
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import BATCH_MAX_SIZE, JOB_HISTORY_LIMIT
+from job_tracker import Job, tracker
+
+
+# (프롬프트, 시드, batch_size) - ComfyUI 작업 하나
+Variant = Tuple[str, int, int]
+
+
+def plan_variants(prompts: List[str], count: int, seeds: Optional[List[int]] = None,
+                  seed_start: Optional[int] = None, packable: bool = False,
+                  max_size: int = BATCH_MAX_SIZE) -> List[Variant]:
+    # 시드 목록을 직접 지정한 경우: 시드마다 결과를 재현할 수 있어야 하므로 작업을 따로 제출
+    if seeds:
+        return [(prompt, seed, 1) for prompt in prompts for seed in seeds]
+
+    # seed_start를 지정한 경우도 이미지마다 seed_start + i로 생성해야 하므로 묶지 않음
+    # (묶은 작업의 이미지는 시드 하나 + batch_index로 정해져서 seed + i로 다시 만들 수 없음)
+    start = seed_start if seed_start is not None else random.randint(1, 9999999999)
+    if not packable or seed_start is not None:
+        return [(prompt, start + i, 1) for prompt in prompts for i in range(count)]
+
+    # 빈 latent 노드의 batch_size로 묶음 (프롬프트가 다르면 conditioning이 달라서 묶을 수 없음)
+    # 이미지는 (작업 시드, batch_index)로 정해짐
+    variants = []
+    for prompt in prompts:
+        for offset in range(0, count, max_size):
+            variants.append((prompt, start + offset, min(max_size, count - offset)))
+    return variants
+
+
+# 배치 요청 하나 (여러 작업의 진행률 / 결과를 합쳐서 보여줌)
+class Batch:
+    def __init__(self, batch_id: str, client_id: str, workflow_name: str,
+                 prompt_ids: List[str], prompts: Dict[str, str]):
+        self.batch_id = batch_id
+        self.client_id = client_id
+        self.workflow_name = workflow_name
+        self.prompt_ids = prompt_ids
+        self.prompts = prompts
+        self.created_at = time.time()
+
+    def jobs(self) -> List[Job]:
+        return [job for job in (tracker.get(pid) for pid in self.prompt_ids) if job is not None]
+
+    @property
+    def version(self) -> int:
+        return sum(job.version for job in self.jobs())
+
+    @property
+    def finished(self) -> bool:
+        return all(job.finished for job in self.jobs())
+
+    def _status(self, jobs: List[Job]) -> str:
+        if all(job.finished for job in jobs):
+            completed = sum(1 for job in jobs if job.status == "completed")
+            if completed == len(jobs):
+                return "completed"
+            return "partial" if completed else "failed"
+        if any(job.status not in ("pending", "queued") for job in jobs):
+            return "running"
+        return "pending"
+
+    def to_dict(self) -> Dict[str, Any]:
+        jobs = self.jobs()
+        total = sum(job.batch_size for job in jobs)
+        done = 0.0
+        items = []
+        images = []
+        for job in jobs:
+            if job.finished:
+                fraction = 1.0
+            elif job.progress.get("max"):
+                fraction = job.progress["value"] / job.progress["max"]
+            else:
+                fraction = 0.0
+            done += fraction * job.batch_size
+            prompt_text = self.prompts.get(job.prompt_id)
+            items.append({
+                "prompt_id": job.prompt_id,
+                "prompt_text": prompt_text,
+                "seed": job.seed,
+                "batch_size": job.batch_size,
+                "status": job.status,
+                "progress": job.progress,
+                "error": job.error,
+            })
+            # 묶은 작업의 이미지는 seed + index가 아니라 같은 시드의 batch_index번째 latent
+            for index, image in enumerate(job.images):
+                images.append({**image, "prompt_id": job.prompt_id, "prompt_text": prompt_text,
+                               "seed": job.seed, "batch_index": index,
+                               "seed_mode": "batch_index" if job.batch_size > 1 else "seed"})
+
+        finished_at = None
+        if jobs and all(job.finished for job in jobs):
+            finished_at = max(job.finished_at or 0 for job in jobs)
+        return {
+            "batch_id": self.batch_id,
+            "client_id": self.client_id,
+            "workflow_name": self.workflow_name,
+            "status": self._status(jobs) if jobs else "failed",
+            "total": total,
+            "completed": sum(job.batch_size for job in jobs if job.status == "completed"),
+            "progress": round(done / total, 4) if total else 0.0,
+            "jobs": items,
+            "images": images,
+            "created_at": self.created_at,
+            "finished_at": finished_at,
+        }
+
+
+# 배치 목록 (오래된 것부터 정리)
+class BatchManager:
+    def __init__(self, limit: int = JOB_HISTORY_LIMIT):
+        self.limit = limit
+        self.batches: "OrderedDict[str, Batch]" = OrderedDict()
+
+    def create(self, client_id: str, workflow_name: str, prompt_ids: List[str],
+               prompts: Dict[str, str]) -> Batch:
+        batch = Batch(f"batch_{uuid.uuid4()}", client_id, workflow_name, prompt_ids, prompts)
+        self.batches[batch.batch_id] = batch
+        while len(self.batches) > self.limit:
+            self.batches.popitem(last=False)
+        return batch
+
+    def discard(self, batch_id: str):
+        self.batches.pop(batch_id, None)
+
+    def get(self, batch_id: str) -> Optional[Batch]:
+        return self.batches.get(batch_id)
+
+
+batches = BatchManager()
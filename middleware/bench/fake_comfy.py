@@ -0,0 +1,378 @@
+import asyncio
+import io
+import json
+import os
+import random
+import struct
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from PIL import Image
+
+
+# 부하 테스트용 가짜 ComfyUI 서버
+# /prompt, /history, /view, /system_stats, /queue, /interrupt, /ws 를 실제 ComfyUI와 같은 형식으로 흉내냄
+# 실행 시간 / 이미지 크기 / 실패율은 환경변수로 조절
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+FAKE_HOST = os.getenv("FAKE_HOST", "127.0.0.1")
+FAKE_PORT = _env_int("FAKE_PORT", 8188)
+# 작업 하나의 실행 시간 (초) / 무작위 편차 비율 (0.2 = ±20%)
+FAKE_EXEC_TIME = _env_float("FAKE_EXEC_TIME", 2.0)
+FAKE_EXEC_JITTER = _env_float("FAKE_EXEC_JITTER", 0.2)
+# 동시에 실행하는 작업 수 (실제 ComfyUI는 1)
+FAKE_WORKERS = _env_int("FAKE_WORKERS", 1)
+# 샘플러 진행 메시지 수 (0이면 워크플로우의 steps 사용) / 스텝마다 미리보기 프레임 전송 여부
+FAKE_STEPS = _env_int("FAKE_STEPS", 0)
+FAKE_PREVIEWS = _env_int("FAKE_PREVIEWS", 1)
+# 출력 이미지 크기 ("1024x1024", 비워두면 빈 latent 노드의 width / height 사용)
+FAKE_IMAGE_SIZE = os.getenv("FAKE_IMAGE_SIZE", "")
+# 실패 주입 (0~1 확률): 실행 오류 / /prompt 500 / /view 500
+FAKE_EXEC_ERROR_RATE = _env_float("FAKE_EXEC_ERROR_RATE", 0.0)
+FAKE_PROMPT_ERROR_RATE = _env_float("FAKE_PROMPT_ERROR_RATE", 0.0)
+FAKE_VIEW_ERROR_RATE = _env_float("FAKE_VIEW_ERROR_RATE", 0.0)
+# /view 응답 지연 (초)
+FAKE_VIEW_DELAY = _env_float("FAKE_VIEW_DELAY", 0.0)
+# 보관할 히스토리 수
+FAKE_HISTORY_LIMIT = _env_int("FAKE_HISTORY_LIMIT", 10000)
+
+SAMPLER_TYPES = {"KSampler", "KSamplerAdvanced", "SamplerCustom", "SamplerCustomAdvanced"}
+LATENT_TYPES = {"EmptyLatentImage", "EmptySD3LatentImage"}
+OUTPUT_TYPES = {"SaveImage": "output", "PreviewImage": "temp"}
+# 샘플러가 아닌 노드들이 나눠 쓰는 실행 시간 비율
+OVERHEAD_RATIO = 0.2
+
+
+# 이미지 (크기별로 한 번만 생성, 노이즈라 PNG 압축이 거의 안 되어 실제 출력 크기와 비슷함)
+_images: Dict[Tuple[int, int], bytes] = {}
+_preview: Optional[bytes] = None
+
+
+def image_bytes(width: int, height: int) -> bytes:
+    key = (width, height)
+    if key not in _images:
+        buffer = io.BytesIO()
+        Image.frombytes("RGB", key, os.urandom(width * height * 3)).save(buffer, "PNG", compress_level=1)
+        _images[key] = buffer.getvalue()
+    return _images[key]
+
+
+def preview_frame() -> bytes:
+    # ComfyUI 미리보기 바이너리: event 1 (PREVIEW_IMAGE) + format 1 (JPEG) + 이미지
+    global _preview
+    if _preview is None:
+        buffer = io.BytesIO()
+        Image.new("RGB", (64, 64), (128, 96, 64)).save(buffer, "JPEG")
+        _preview = struct.pack(">II", 1, 1) + buffer.getvalue()
+    return _preview
+
+
+def output_size(prompt: Dict[str, Any]) -> Tuple[int, int, int]:
+    # (width, height, batch_size)
+    width = height = 512
+    batch_size = 1
+    for node in prompt.values():
+        if node.get("class_type") in LATENT_TYPES:
+            inputs = node.get("inputs", {})
+            width = int(inputs.get("width", width))
+            height = int(inputs.get("height", height))
+            batch_size = int(inputs.get("batch_size", batch_size))
+    if FAKE_IMAGE_SIZE:
+        width, height = (int(v) for v in FAKE_IMAGE_SIZE.lower().split("x"))
+    return width, height, batch_size
+
+
+# 대기열 / 실행 상태
+class FakeJob:
+    def __init__(self, number: int, prompt_id: str, prompt: Dict[str, Any], client_id: Optional[str],
+                 extra_data: Dict[str, Any]):
+        self.number = number
+        self.prompt_id = prompt_id
+        self.prompt = prompt
+        self.client_id = client_id
+        self.extra_data = extra_data
+        self.interrupted = False
+
+    def queue_item(self) -> List[Any]:
+        outputs = [nid for nid, node in self.prompt.items() if node.get("class_type") in OUTPUT_TYPES]
+        return [self.number, self.prompt_id, self.prompt, self.extra_data, outputs]
+
+
+class FakeComfy:
+    def __init__(self):
+        self.clients: Dict[str, WebSocket] = {}
+        self.pending: Deque[FakeJob] = deque()
+        self.running: Dict[str, FakeJob] = {}
+        self.history: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.files: Dict[str, Tuple[int, int]] = {}
+        self.number = 0
+        self.started_at = time.time()
+        self.stats = {"prompts": 0, "completed": 0, "failed": 0, "interrupted": 0, "views": 0}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+
+    @property
+    def queue_remaining(self) -> int:
+        return len(self.pending) + len(self.running)
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(FAKE_WORKERS)]
+
+    # 웹소켓 전송 (실행 메시지는 작업을 제출한 client_id에게만, status는 전체에게)
+    async def send(self, client_id: Optional[str], message: Dict[str, Any]):
+        websocket = self.clients.get(client_id) if client_id else None
+        if websocket is None:
+            return
+        try:
+            await websocket.send_text(json.dumps(message))
+        except Exception:
+            self.clients.pop(client_id, None)
+
+    async def send_binary(self, client_id: Optional[str], data: bytes):
+        websocket = self.clients.get(client_id) if client_id else None
+        if websocket is None:
+            return
+        try:
+            await websocket.send_bytes(data)
+        except Exception:
+            self.clients.pop(client_id, None)
+
+    def status_message(self, sid: Optional[str] = None) -> Dict[str, Any]:
+        data: Dict[str, Any] = {"status": {"exec_info": {"queue_remaining": self.queue_remaining}}}
+        if sid:
+            data["sid"] = sid
+        return {"type": "status", "data": data}
+
+    async def broadcast_status(self):
+        message = self.status_message()
+        for client_id in list(self.clients):
+            await self.send(client_id, message)
+
+    def enqueue(self, prompt_id: str, prompt: Dict[str, Any], client_id: Optional[str],
+                extra_data: Dict[str, Any]) -> FakeJob:
+        job = FakeJob(self.number, prompt_id, prompt, client_id, extra_data)
+        self.number += 1
+        self.pending.append(job)
+        self.stats["prompts"] += 1
+        self._wakeup.set()
+        return job
+
+    async def _worker(self):
+        while True:
+            while not self.pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            job = self.pending.popleft()
+            self.running[job.prompt_id] = job
+            try:
+                await self._execute(job)
+            finally:
+                self.running.pop(job.prompt_id, None)
+                await self.broadcast_status()
+
+    async def _execute(self, job: FakeJob):
+        async def send(message_type: str, **data):
+            data.update(prompt_id=job.prompt_id, timestamp=int(time.time() * 1000))
+            await self.send(job.client_id, {"type": message_type, "data": data})
+
+        await self.broadcast_status()
+        await send("execution_start")
+        await send("execution_cached", nodes=[])
+
+        total = FAKE_EXEC_TIME * random.uniform(1 - FAKE_EXEC_JITTER, 1 + FAKE_EXEC_JITTER)
+        nodes = list(job.prompt.items())
+        samplers = [nid for nid, node in nodes if node.get("class_type") in SAMPLER_TYPES] or [None]
+        overhead = total * OVERHEAD_RATIO / max(len(nodes), 1)
+        sampling = total * (1 - OVERHEAD_RATIO) / len(samplers)
+        fail_node = random.choice(nodes)[0] if nodes and random.random() < FAKE_EXEC_ERROR_RATE else None
+        width, height, batch_size = output_size(job.prompt)
+        outputs: Dict[str, Any] = {}
+
+        for node_id, node in nodes:
+            if job.interrupted:
+                await send("execution_interrupted", node_id=node_id)
+                self._finish(job, "interrupted", outputs)
+                return
+            await send("executing", node=node_id, display_node=node_id)
+            await asyncio.sleep(overhead)
+            class_type = node.get("class_type")
+
+            if node_id == fail_node:
+                await send("execution_error", node_id=node_id, node_type=class_type,
+                           exception_message="fake failure", exception_type="RuntimeError", traceback=[])
+                self._finish(job, "error", outputs)
+                return
+
+            if class_type in SAMPLER_TYPES:
+                steps = FAKE_STEPS or int(node.get("inputs", {}).get("steps", 20) or 20)
+                for step in range(steps):
+                    if job.interrupted:
+                        break
+                    await asyncio.sleep(sampling / steps)
+                    await send("progress", value=step + 1, max=steps, node=node_id)
+                    if FAKE_PREVIEWS:
+                        await self.send_binary(job.client_id, preview_frame())
+
+            if class_type in OUTPUT_TYPES:
+                images = []
+                for index in range(batch_size):
+                    filename = f"fake_{job.prompt_id[:8]}_{node_id}_{index:05}_.png"
+                    self.files[filename] = (width, height)
+                    images.append({"filename": filename, "subfolder": "", "type": OUTPUT_TYPES[class_type]})
+                outputs[node_id] = {"images": images}
+                await send("executed", node=node_id, display_node=node_id, output=outputs[node_id])
+
+        if job.interrupted:
+            await send("execution_interrupted")
+            self._finish(job, "interrupted", outputs)
+            return
+        await send("execution_success")
+        await send("executing", node=None)
+        self._finish(job, "success", outputs)
+
+    def _finish(self, job: FakeJob, status: str, outputs: Dict[str, Any]):
+        self.stats[{"success": "completed", "error": "failed"}.get(status, "interrupted")] += 1
+        self.history[job.prompt_id] = {
+            "prompt": job.queue_item(),
+            "outputs": outputs,
+            "status": {"status_str": status, "completed": status == "success", "messages": []},
+            "meta": {},
+        }
+        while len(self.history) > FAKE_HISTORY_LIMIT:
+            self.history.popitem(last=False)
+
+
+comfy = FakeComfy()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    comfy.start()
+    # 첫 요청에서 큰 PNG를 만드는 시간이 측정에 섞이지 않도록 미리 생성
+    if FAKE_IMAGE_SIZE:
+        await asyncio.to_thread(image_bytes, *(int(v) for v in FAKE_IMAGE_SIZE.lower().split("x")))
+    yield
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.post("/prompt")
+async def post_prompt(request: Request):
+    body = await request.json()
+    if random.random() < FAKE_PROMPT_ERROR_RATE:
+        raise HTTPException(status_code=500, detail="fake prompt failure")
+    prompt = body.get("prompt")
+    if not isinstance(prompt, dict) or not prompt:
+        return Response(json.dumps({"error": {"type": "invalid_prompt", "message": "empty prompt"},
+                                    "node_errors": {}}), status_code=400, media_type="application/json")
+    prompt_id = body.get("prompt_id") or str(uuid.uuid4())
+    job = comfy.enqueue(prompt_id, prompt, body.get("client_id"), body.get("extra_data") or {})
+    await comfy.broadcast_status()
+    return {"prompt_id": prompt_id, "number": job.number, "node_errors": {}}
+
+
+@app.get("/history/{prompt_id}")
+async def get_history(prompt_id: str):
+    entry = comfy.history.get(prompt_id)
+    return {prompt_id: entry} if entry is not None else {}
+
+
+@app.get("/history")
+async def get_history_all(max_items: Optional[int] = None):
+    items = list(comfy.history.items())
+    if max_items is not None:
+        items = items[-max_items:]
+    return dict(items)
+
+
+@app.get("/view")
+async def view(filename: str, type: str = "output", subfolder: str = ""):
+    if FAKE_VIEW_DELAY:
+        await asyncio.sleep(FAKE_VIEW_DELAY)
+    if random.random() < FAKE_VIEW_ERROR_RATE:
+        raise HTTPException(status_code=500, detail="fake view failure")
+    size = comfy.files.get(filename)
+    if size is None:
+        raise HTTPException(status_code=404)
+    comfy.stats["views"] += 1
+    data = _images.get(size) or await asyncio.to_thread(image_bytes, *size)
+    return Response(data, media_type="image/png")
+
+
+@app.get("/system_stats")
+async def system_stats():
+    return {
+        "system": {"os": "fake", "python_version": "", "embedded_python": False,
+                   "uptime": time.time() - comfy.started_at, "stats": comfy.stats},
+        "devices": [{"name": "fake", "type": "cpu", "index": 0, "vram_total": 0, "vram_free": 0}],
+    }
+
+
+@app.get("/queue")
+async def get_queue():
+    return {
+        "queue_running": [job.queue_item() for job in comfy.running.values()],
+        "queue_pending": [job.queue_item() for job in comfy.pending],
+    }
+
+
+@app.post("/queue")
+async def post_queue(request: Request):
+    body = await request.json()
+    if body.get("clear"):
+        comfy.pending.clear()
+    for prompt_id in body.get("delete", []):
+        for job in list(comfy.pending):
+            if job.prompt_id == prompt_id:
+                comfy.pending.remove(job)
+    await comfy.broadcast_status()
+    return Response(status_code=200)
+
+
+@app.post("/interrupt")
+async def interrupt(request: Request):
+    # prompt_id를 지정하면 그 작업만, 아니면 실행 중인 작업 전체
+    try:
+        body = await request.json()
+    except ValueError:
+        body = {}
+    prompt_id = (body or {}).get("prompt_id")
+    for job in comfy.running.values():
+        if prompt_id is None or job.prompt_id == prompt_id:
+            job.interrupted = True
+    return Response(status_code=200)
+
+
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    await websocket.accept()
+    client_id = websocket.query_params.get("clientId") or uuid.uuid4().hex
+    comfy.clients[client_id] = websocket
+    await websocket.send_text(json.dumps(comfy.status_message(client_id)))
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if comfy.clients.get(client_id) is websocket:
+            del comfy.clients[client_id]
+
+
+if __name__ == "__main__":
+    import uvicorn
+    print(f"가짜 ComfyUI 실행: http://{FAKE_HOST}:{FAKE_PORT} (실행 {FAKE_EXEC_TIME}초, 워커 {FAKE_WORKERS}개)")
+    uvicorn.run(app, host=FAKE_HOST, port=FAKE_PORT, log_level="warning")
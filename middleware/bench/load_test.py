@@ -0,0 +1,320 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+
+# 미들웨어 부하 테스트
+# - generate: 이미지 생성 요청 -> 완료 대기 -> 히스토리 -> 결과 이미지 (요청 하나의 전체 흐름)
+# - history / image: 미리 만든 작업의 히스토리 / 이미지만 반복 요청 (읽기 경로)
+# 구간별 p50/p95/p99 지연 시간, 초당 처리 수, 이벤트 루프 지연(미들웨어 / 부하 생성기)을 출력
+#
+# 예) python bench/fake_comfy.py &
+#     COMFY_SERVER=http://127.0.0.1:8188 python main.py &
+#     python bench/load_test.py --mode generate --concurrency 4 --requests 40 --save baseline.json
+#     python bench/load_test.py --mode generate --concurrency 4 --requests 40 --baseline baseline.json
+
+LAG_METRIC = "middleware_event_loop_lag_seconds"
+LAG_INTERVAL = 0.05
+
+
+def percentile(values: List[float], q: float) -> float:
+    # nearest-rank
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+
+    def ok(self, name: str, seconds: float):
+        self.latencies.setdefault(name, []).append(seconds)
+
+    def error(self, name: str, reason: str):
+        counts = self.errors.setdefault(name, {})
+        counts[reason] = counts.get(reason, 0) + 1
+
+    async def timed(self, name: str, request) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError as e:
+            self.error(name, type(e).__name__)
+            return None
+        if response.status_code >= 400:
+            self.error(name, str(response.status_code))
+            return None
+        self.ok(name, time.perf_counter() - started)
+        return response
+
+    def summary(self, elapsed: float) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            values = self.latencies.get(name, [])
+            result[name] = {
+                "count": len(values),
+                "errors": sum(self.errors.get(name, {}).values()),
+                "error_kinds": self.errors.get(name, {}),
+                "rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+                "p50_ms": round(percentile(values, 0.50) * 1000, 1),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 1),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 1),
+                "max_ms": round(max(values) * 1000, 1) if values else 0.0,
+            }
+        return result
+
+
+# 이벤트 루프 지연
+class LagProbe:
+    # 부하 생성기 자신의 루프 지연 (크면 측정값을 믿기 어려움)
+    def __init__(self, interval: float = LAG_INTERVAL):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(loop.time() - started - self.interval, 0.0))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> Dict[str, float]:
+        if self._task is not None:
+            self._task.cancel()
+        return {
+            "p50_ms": round(percentile(self.samples, 0.50) * 1000, 2),
+            "p99_ms": round(percentile(self.samples, 0.99) * 1000, 2),
+            "max_ms": round(max(self.samples, default=0.0) * 1000, 2),
+        }
+
+
+def parse_histogram(text: str, name: str) -> Tuple[List[Tuple[float, float]], float, float]:
+    # Prometheus 텍스트에서 라벨 없는 히스토그램 하나 읽기: ([(le, 누적 개수)], 합계, 개수)
+    buckets, total, count = [], 0.0, 0.0
+    for line in text.splitlines():
+        if line.startswith(f"{name}_bucket"):
+            le = line.split('le="', 1)[1].split('"', 1)[0]
+            buckets.append((math.inf if le == "+Inf" else float(le), float(line.rsplit(" ", 1)[1])))
+        elif line.startswith(f"{name}_sum"):
+            total = float(line.rsplit(" ", 1)[1])
+        elif line.startswith(f"{name}_count"):
+            count = float(line.rsplit(" ", 1)[1])
+    return buckets, total, count
+
+
+async def server_lag(client: httpx.AsyncClient) -> Optional[Tuple[List[Tuple[float, float]], float, float]]:
+    try:
+        response = await client.get("/metrics")
+        response.raise_for_status()
+    except httpx.HTTPError:
+        return None
+    return parse_histogram(response.text, LAG_METRIC)
+
+
+def lag_delta(before, after) -> Optional[Dict[str, Any]]:
+    # 테스트 구간 동안의 미들웨어 이벤트 루프 지연 (버킷 상한 기준 근사값)
+    if not before or not after:
+        return None
+    count = after[2] - before[2]
+    if count <= 0:
+        return None
+    counts = [(le, c - dict(before[0]).get(le, 0.0)) for le, c in after[0]]
+
+    def quantile(q):
+        for le, cumulative in counts:
+            if cumulative >= q * count:
+                return le
+        return math.inf
+
+    bound = lambda v: "+Inf" if v == math.inf else round(v * 1000, 2)
+    return {
+        "samples": int(count),
+        "mean_ms": round((after[1] - before[1]) / count * 1000, 2),
+        "p50_ms_le": bound(quantile(0.50)),
+        "p99_ms_le": bound(quantile(0.99)),
+    }
+
+
+# 시나리오
+async def generate_flow(client: httpx.AsyncClient, recorder: Recorder, worker: int, args) -> Optional[Dict[str, Any]]:
+    body = {
+        "prompt_text": f"{args.prompt} {random.randint(0, 1 << 30)}",
+        "workflow_name": args.workflow,
+        "client_id": f"bench_{worker}",
+        "use_cache": False,
+    }
+    started = time.perf_counter()
+    response = await recorder.timed("generate", client.post("/api/generate-image", json=body))
+    if response is None:
+        return None
+    prompt_id = response.json()["prompt_id"]
+
+    job = None
+    deadline = time.perf_counter() + args.job_timeout
+    while time.perf_counter() < deadline:
+        response = await recorder.timed("wait", client.get(f"/api/jobs/{prompt_id}/wait", params={"timeout": 30}))
+        if response is None:
+            return None
+        job = response.json()
+        if job["status"] in ("completed", "failed", "interrupted"):
+            break
+    if job is None or job["status"] != "completed":
+        recorder.error("end_to_end", job["status"] if job else "timeout")
+        return None
+
+    await recorder.timed("history", client.get(f"/api/history/{prompt_id}"))
+    for image in job["images"]:
+        await recorder.timed("image", client.get(image["url"]))
+    recorder.ok("end_to_end", time.perf_counter() - started)
+    return job
+
+
+async def history_flow(client, recorder, prompt_ids: List[str]):
+    await recorder.timed("history", client.get(f"/api/history/{random.choice(prompt_ids)}"))
+
+
+async def image_flow(client, recorder, images: List[Dict[str, Any]]):
+    await recorder.timed("image", client.get(random.choice(images)["url"]))
+
+
+async def run(args) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    timeout = httpx.Timeout(args.job_timeout + 30, connect=5.0)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=timeout) as client:
+        # 읽기 시나리오용 작업 미리 생성 (측정에서 제외)
+        prompt_ids: List[str] = []
+        images: List[Dict[str, Any]] = []
+        if args.mode in ("history", "image"):
+            jobs = await asyncio.gather(*(generate_flow(client, Recorder(), i, args) for i in range(args.seed_jobs)))
+            prompt_ids = [job["prompt_id"] for job in jobs if job]
+            images = [image for job in jobs if job for image in job["images"]]
+            if not images:
+                sys.exit("준비 작업이 실패했습니다. 미들웨어 / ComfyUI 상태를 확인하세요.")
+
+        recorder = Recorder()
+        probe = LagProbe()
+        before = await server_lag(client)
+        remaining = args.requests
+        deadline = time.perf_counter() + args.duration if args.duration else None
+
+        def take() -> bool:
+            nonlocal remaining
+            if deadline is not None:
+                return time.perf_counter() < deadline
+            if remaining <= 0:
+                return False
+            remaining -= 1
+            return True
+
+        async def worker(index: int):
+            while take():
+                if args.mode == "generate":
+                    await generate_flow(client, recorder, index, args)
+                elif args.mode == "history":
+                    await history_flow(client, recorder, prompt_ids)
+                else:
+                    await image_flow(client, recorder, images)
+
+        probe.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        client_lag = probe.stop()
+        after = await server_lag(client)
+
+    return {
+        "mode": args.mode,
+        "concurrency": args.concurrency,
+        "elapsed_s": round(elapsed, 2),
+        "operations": recorder.summary(elapsed),
+        "server_loop_lag": lag_delta(before, after),
+        "client_loop_lag": client_lag,
+    }
+
+
+# 출력 / 기준값 비교
+def print_report(report: Dict[str, Any]):
+    print(f"\nmode={report['mode']} concurrency={report['concurrency']} elapsed={report['elapsed_s']}s")
+    header = f"{'operation':<12}{'count':>8}{'errors':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for name, op in report["operations"].items():
+        print(f"{name:<12}{op['count']:>8}{op['errors']:>8}{op['rps']:>9}"
+              f"{op['p50_ms']:>10}{op['p95_ms']:>10}{op['p99_ms']:>10}{op['max_ms']:>10}")
+        if op["error_kinds"]:
+            print(f"{'':<12}errors: {op['error_kinds']}")
+    server = report["server_loop_lag"]
+    if server:
+        print(f"\nmiddleware event loop lag: mean {server['mean_ms']} ms, "
+              f"p50 <= {server['p50_ms_le']} ms, p99 <= {server['p99_ms_le']} ms ({server['samples']} samples)")
+    else:
+        print(f"\nmiddleware event loop lag: /metrics에서 {LAG_METRIC}를 읽지 못했습니다")
+    client = report["client_loop_lag"]
+    print(f"load generator loop lag: p50 {client['p50_ms']} ms, p99 {client['p99_ms']} ms, max {client['max_ms']} ms")
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    # p95가 늘었거나 초당 처리 수가 줄어든 구간 (허용 비율 초과)
+    regressions = []
+    print(f"\nbaseline 비교 (허용 {tolerance:.0%})")
+    if (baseline.get("mode"), baseline.get("concurrency")) != (report["mode"], report["concurrency"]):
+        print(f"경고: 기준값과 조건이 다릅니다 (mode={baseline.get('mode')}, concurrency={baseline.get('concurrency')})")
+    for name, op in report["operations"].items():
+        base = baseline.get("operations", {}).get(name)
+        if not base or not base["count"]:
+            continue
+        p95 = (op["p95_ms"] - base["p95_ms"]) / base["p95_ms"] if base["p95_ms"] else 0.0
+        rps = (op["rps"] - base["rps"]) / base["rps"] if base["rps"] else 0.0
+        flag = ""
+        if p95 > tolerance or rps < -tolerance:
+            flag = "  <- regression"
+            regressions.append(name)
+        print(f"{name:<12} p95 {base['p95_ms']} -> {op['p95_ms']} ms ({p95:+.1%}), "
+              f"rps {base['rps']} -> {op['rps']} ({rps:+.1%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="미들웨어 부하 테스트")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--mode", choices=("generate", "history", "image"), default="generate")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=40, help="전체 반복 횟수 (--duration이 없을 때)")
+    parser.add_argument("--duration", type=float, default=None, help="측정 시간 (초)")
+    parser.add_argument("--workflow", default="0404test")
+    parser.add_argument("--prompt", default="a lighthouse at dusk")
+    parser.add_argument("--seed-jobs", type=int, default=4, help="history / image 모드에서 미리 만들 작업 수")
+    parser.add_argument("--job-timeout", type=float, default=300.0)
+    parser.add_argument("--save", help="결과를 JSON으로 저장 (기준값)")
+    parser.add_argument("--baseline", help="저장한 기준값과 비교, 성능이 떨어지면 종료 코드 1")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import asyncio
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+from config import CANCEL_ON_DISCONNECT, CANCEL_GRACE
+from job_tracker import Job, tracker
+from scheduler import scheduler
+from log import get_logger
+
+
+logger = get_logger("cancellation")
+
+
+# 여러 요청자가 공유하는 작업을 요청자가 아닌 쪽에서 취소하려고 할 때
+class SharedJobError(Exception):
+    def __init__(self, prompt_id: str, requesters: int):
+        super().__init__(f"요청자 {requesters}명이 공유하는 작업입니다. 제출할 때의 client_id로 취소하세요.")
+        self.prompt_id = prompt_id
+        self.requesters = requesters
+
+
+# 아무도 기다리지 않는 작업 / 기한이 지난 작업 자동 취소
+# - 브라우저 웹소켓 구독, SSE, long-poll 요청을 작업 / 클라이언트별 관심 수로 셈
+# - 관심 수가 0이 되면 grace 시간 뒤에도 다시 늘지 않았을 때 취소 (새로고침 / 다음 long-poll 사이 간격 허용)
+# - 기한(deadline)은 요청자마다 지정, 지나면 대기열 / 실행 단계와 상관없이 취소
+# - 같은 그래프 요청이 합쳐진 작업은 요청자(client_id)를 모두 기록하고, 요청자 한 명의 취소 / 이탈은 그 요청자만 빼고
+#   요청자가 한 명 남았을 때부터 ComfyUI 작업을 취소
+class CancellationManager:
+    def __init__(self, enabled: bool = CANCEL_ON_DISCONNECT, grace: float = CANCEL_GRACE):
+        self.enabled = enabled
+        self.grace = grace
+        # 작업별 / 클라이언트별 관심 수 (클라이언트를 모르는 SSE / long-poll은 None)
+        self.interest: Dict[str, Dict[Optional[str], int]] = {}
+        self.requesters: Dict[str, Set[str]] = {}
+        self._abandon_timers: Dict[Tuple[str, Optional[str]], asyncio.TimerHandle] = {}
+        self._deadline_timers: Dict[Tuple[str, str], asyncio.TimerHandle] = {}
+
+    async def cancel(self, prompt_id: str, reason: str = "요청으로 취소되었습니다.") -> bool:
+        cancelled = await scheduler.cancel(prompt_id, reason)
+        if cancelled:
+            logger.info("작업 취소", extra={"prompt_id": prompt_id, "reason": reason})
+        return cancelled
+
+    # 요청자
+    def join(self, prompt_id: str, client_id: str):
+        job = tracker.get(prompt_id)
+        if job is None or job.finished:
+            return
+        self.requesters.setdefault(prompt_id, set()).add(client_id)
+
+    def _leave(self, prompt_id: str, client_id: Optional[str], reason: str) -> bool:
+        # 공유 작업에서 요청자 한 명만 빠지면 True (작업은 계속 실행)
+        requesters = self.requesters.get(prompt_id, set())
+        if client_id not in requesters or len(requesters) < 2:
+            return False
+        requesters.discard(client_id)
+        timer = self._deadline_timers.pop((prompt_id, client_id), None)
+        if timer is not None:
+            timer.cancel()
+        logger.info("요청 철회", extra={"prompt_id": prompt_id, "client_id": client_id,
+                                        "requesters": len(requesters), "reason": reason})
+        tracker.withdraw(prompt_id, client_id, reason)
+        return True
+
+    async def withdraw(self, prompt_id: str, client_id: Optional[str],
+                       reason: str = "요청으로 취소되었습니다.") -> bool:
+        # 요청자 한 명의 취소: 다른 요청자가 남아 있으면 그 요청자만 빼고 작업은 계속 실행
+        requesters = self.requesters.get(prompt_id, set())
+        if client_id not in requesters and len(requesters) > 1:
+            raise SharedJobError(prompt_id, len(requesters))
+        if self._leave(prompt_id, client_id, reason):
+            return True
+        return await self.cancel(prompt_id, reason)
+
+    # 관심 수
+    def acquire(self, prompt_id: str, client_id: Optional[str] = None):
+        job = tracker.get(prompt_id)
+        if job is None or job.finished:
+            return
+        watchers = self.interest.setdefault(prompt_id, {})
+        watchers[client_id] = watchers.get(client_id, 0) + 1
+        timer = self._abandon_timers.pop((prompt_id, client_id), None)
+        if timer is not None:
+            timer.cancel()
+
+    def release(self, prompt_id: str, client_id: Optional[str] = None):
+        watchers = self.interest.get(prompt_id, {})
+        count = watchers.get(client_id, 0) - 1
+        if count > 0:
+            watchers[client_id] = count
+            return
+        watchers.pop(client_id, None)
+        if not watchers:
+            self.interest.pop(prompt_id, None)
+        job = tracker.get(prompt_id)
+        key = (prompt_id, client_id)
+        if not self.enabled or job is None or job.finished or key in self._abandon_timers:
+            return
+        self._abandon_timers[key] = asyncio.get_running_loop().call_later(
+            self.grace, self._abandon, prompt_id, client_id)
+
+    def _abandon(self, prompt_id: str, client_id: Optional[str]):
+        self._abandon_timers.pop((prompt_id, client_id), None)
+        # 떠난 클라이언트가 공유 작업의 요청자면 그 요청자만 빠짐
+        if self._leave(prompt_id, client_id, "작업을 기다리던 클라이언트가 떠났습니다."):
+            return
+        # 요청자가 한 명 이하이고 아무도 기다리지 않을 때만 취소
+        # (철회한 요청자 / 구독만 한 클라이언트가 떠나도 다른 요청자의 작업은 취소하지 않음)
+        requesters = self.requesters.get(prompt_id, set())
+        if self.interest.get(prompt_id) or len(requesters) > 1:
+            return
+        if client_id is not None and requesters and client_id not in requesters:
+            return
+        self._schedule_cancel(prompt_id, "작업을 기다리는 클라이언트가 없어 취소되었습니다.")
+
+    def _schedule_cancel(self, prompt_id: str, reason: str):
+        job = tracker.get(prompt_id)
+        if job is not None and not job.finished:
+            asyncio.create_task(self.cancel(prompt_id, reason))
+
+    @contextmanager
+    def watching(self, prompt_ids: Iterable[str], client_id: Optional[str] = None):
+        # SSE / long-poll 요청이 열려 있는 동안 관심 유지
+        prompt_ids = list(prompt_ids)
+        for prompt_id in prompt_ids:
+            self.acquire(prompt_id, client_id)
+        try:
+            yield
+        finally:
+            for prompt_id in prompt_ids:
+                self.release(prompt_id, client_id)
+
+    # 기한 (요청자별: 공유 작업은 기한이 지난 요청자만 빠지고, 마지막 요청자의 기한이 지나면 취소)
+    def set_deadline(self, prompt_id: str, client_id: str, timeout: Optional[float]):
+        job = tracker.get(prompt_id)
+        if not timeout or timeout <= 0 or job is None or job.finished:
+            return
+        timer = self._deadline_timers.pop((prompt_id, client_id), None)
+        if timer is not None:
+            timer.cancel()
+        self._deadline_timers[(prompt_id, client_id)] = asyncio.get_running_loop().call_later(
+            timeout, self._expire, prompt_id, client_id, timeout)
+
+    def _expire(self, prompt_id: str, client_id: str, timeout: float):
+        self._deadline_timers.pop((prompt_id, client_id), None)
+        reason = f"제한 시간({timeout:g}초)이 지나 취소되었습니다."
+        requesters = self.requesters.get(prompt_id, set())
+        # 이미 철회한 요청자의 기한은 남은 요청자에게 영향 없음
+        if requesters and client_id not in requesters:
+            return
+        if not self._leave(prompt_id, client_id, reason):
+            self._schedule_cancel(prompt_id, reason)
+
+    # JobTracker 리스너: 끝난 작업의 타이머 정리
+    def on_job_event(self, event: str, job: Job, data: Dict[str, Any]):
+        if event != "finished":
+            return
+        for timers in (self._abandon_timers, self._deadline_timers):
+            for key in [key for key in timers if key[0] == job.prompt_id]:
+                timers.pop(key).cancel()
+        self.interest.pop(job.prompt_id, None)
+        self.requesters.pop(job.prompt_id, None)
+
+
+cancellations = CancellationManager()
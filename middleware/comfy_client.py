@@ -0,0 +1,225 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+import httpx
+
+from config import (
+    COMFY_SERVER,
+    COMFY_MAX_CONNECTIONS,
+    COMFY_MAX_KEEPALIVE,
+    COMFY_MAX_CONCURRENCY,
+    COMFY_CONNECT_TIMEOUT,
+    COMFY_TIMEOUT,
+    COMFY_RETRIES,
+)
+from metrics import UPSTREAM_REQUESTS, UPSTREAM_DURATION, UPSTREAM_RETRIES, UPSTREAM_REJECTED, endpoint_label
+from resilience import CircuitBreaker, CircuitOpenError, backoff_delays
+from log import get_logger
+
+
+logger = get_logger("comfy_client")
+
+# 재시도할 응답 코드 (게이트웨이 오류 / 일시적 과부하)
+RETRY_STATUS = {502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+# 요청이 서버에 닿기 전에 난 오류: 멱등이 아닌 요청도 재시도 가능
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+def _outcome(status_code: int) -> str:
+    if status_code < 400:
+        return "ok"
+    return "4xx" if status_code < 500 else "5xx"
+
+
+# ComfyUI 비동기 HTTP 클라이언트
+# - keep-alive 커넥션 풀을 공유해서 매 요청마다 TCP 연결을 새로 열지 않음
+# - 세마포어로 동시에 ComfyUI로 나가는 요청 수를 제한
+# - 호출별로 타임아웃 지정 가능
+# - 호출 결과 / 시간을 백엔드 이름 라벨로 메트릭에 기록
+# - 일시적인 오류는 지터를 준 간격으로 재시도, 계속 실패하면 서킷을 열어 바로 실패
+class ComfyClient:
+    def __init__(
+        self,
+        base_url: str = COMFY_SERVER,
+        max_connections: int = COMFY_MAX_CONNECTIONS,
+        max_keepalive: int = COMFY_MAX_KEEPALIVE,
+        max_concurrency: int = COMFY_MAX_CONCURRENCY,
+        timeout: float = COMFY_TIMEOUT,
+        name: Optional[str] = None,
+        retries: int = COMFY_RETRIES,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.name = name or self.base_url
+        self.timeout = timeout
+        self.retries = retries
+        self.breaker = CircuitBreaker(self.name)
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+        )
+        self._max_concurrency = max_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _timeout(self, timeout: Optional[float]) -> httpx.Timeout:
+        return httpx.Timeout(timeout or self.timeout, connect=COMFY_CONNECT_TIMEOUT)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # 이벤트 루프 안에서 처음 사용할 때 생성
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=self._limits,
+                timeout=self._timeout(None),
+            )
+        return self._client
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        return self._semaphore
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _record(self, path: str, outcome: str, started: float):
+        endpoint = endpoint_label(path)
+        UPSTREAM_REQUESTS.inc(backend=self.name, endpoint=endpoint, outcome=outcome)
+        UPSTREAM_DURATION.observe(time.perf_counter() - started, backend=self.name, endpoint=endpoint)
+
+    async def _send(self, method: str, path: str, params, json_body, timeout: Optional[float]) -> httpx.Response:
+        async with self.semaphore:
+            started = time.perf_counter()
+            try:
+                response = await self.client.request(
+                    method,
+                    path,
+                    params=params,
+                    json=json_body,
+                    timeout=self._timeout(timeout),
+                )
+            except httpx.TimeoutException:
+                self._record(path, "timeout", started)
+                raise
+            except httpx.HTTPError:
+                self._record(path, "error", started)
+                raise
+        self._record(path, _outcome(response.status_code), started)
+        return response
+
+    async def _call(self, path: str, send, *, idempotent: bool, retries: Optional[int], probe: bool):
+        # 서킷 확인 -> 전송 -> 실패 종류에 따라 재시도
+        # - 멱등 요청(GET 등)은 연결 / 타임아웃 오류와 502/503/504에서 재시도
+        # - POST /prompt 같은 요청은 서버에 닿지 않은 연결 오류에서만 재시도 (두 번 실행 방지)
+        # - 상태 확인(probe)은 서킷이 열려 있어도 보내서 복구를 확인
+        if not probe:
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                UPSTREAM_REJECTED.inc(backend=self.name, endpoint=endpoint_label(path))
+                raise
+        retries = self.retries if retries is None else retries
+        delays = backoff_delays()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    response = await send()
+                except httpx.TransportError as e:
+                    if attempt < retries and (idempotent or isinstance(e, NOT_SENT_ERRORS)):
+                        attempt += 1
+                        await self._wait_retry(path, attempt, next(delays), repr(e))
+                        continue
+                    self.breaker.failure()
+                    raise
+                if response.status_code in RETRY_STATUS and idempotent and attempt < retries:
+                    await response.aclose()
+                    attempt += 1
+                    await self._wait_retry(path, attempt, next(delays), f"HTTP {response.status_code}")
+                    continue
+                if response.status_code >= 500:
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()
+                return response
+        except BaseException:
+            self.breaker.abort()
+            raise
+
+    async def _wait_retry(self, path: str, attempt: int, delay: float, error: str):
+        UPSTREAM_RETRIES.inc(backend=self.name, endpoint=endpoint_label(path))
+        logger.warning("ComfyUI 호출 재시도", extra={
+            "backend": self.name, "path": path, "attempt": attempt, "delay": round(delay, 3), "error": error,
+        })
+        await asyncio.sleep(delay)
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        *,
+        params: Optional[Dict[str, Any]] = None,
+        json_body: Any = None,
+        timeout: Optional[float] = None,
+        idempotent: Optional[bool] = None,
+        retries: Optional[int] = None,
+        probe: bool = False,
+    ) -> httpx.Response:
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        response = await self._call(
+            path,
+            lambda: self._send(method, path, params, json_body, timeout),
+            idempotent=idempotent,
+            retries=retries,
+            probe=probe,
+        )
+        response.raise_for_status()
+        return response
+
+    async def get_json(self, path: str, params=None, timeout: Optional[float] = None):
+        response = await self.request("GET", path, params=params, timeout=timeout)
+        return response.json()
+
+    async def post_json(self, path: str, payload: Any, timeout: Optional[float] = None):
+        response = await self.request("POST", path, json_body=payload, timeout=timeout)
+        return response.json()
+
+    async def get_bytes(self, path: str, params=None, timeout: Optional[float] = None) -> bytes:
+        response = await self.request("GET", path, params=params, timeout=timeout)
+        return response.content
+
+    @asynccontextmanager
+    async def stream(self, path: str, params=None, timeout: Optional[float] = None):
+        # 본문을 메모리에 다 올리지 않고 청크 단위로 읽을 때 사용
+        # 재시도는 응답 헤더를 받기 전까지만 (본문을 읽기 시작한 뒤에는 호출한 쪽에서 처리)
+        # 동시 요청 제한은 헤더를 받을 때까지만 차지 (느린 본문 다운로드가 다른 API 호출을 막지 않게,
+        # 본문을 읽는 동안은 커넥션 풀 크기로 제한)
+        async def send() -> httpx.Response:
+            async with self.semaphore:
+                started = time.perf_counter()
+                try:
+                    request = self.client.build_request("GET", path, params=params, timeout=self._timeout(timeout))
+                    response = await self.client.send(request, stream=True)
+                except httpx.TimeoutException:
+                    self._record(path, "timeout", started)
+                    raise
+                except httpx.HTTPError:
+                    self._record(path, "error", started)
+                    raise
+            self._record(path, _outcome(response.status_code), started)
+            return response
+
+        response = await self._call(path, send, idempotent=True, retries=None, probe=False)
+        try:
+            response.raise_for_status()
+            yield response
+        finally:
+            await response.aclose()
@@ -0,0 +1,125 @@
+import os
+
+# 미들웨어 설정 (환경변수로 덮어쓰기 가능)
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+# ComfyUI 서버 주소
+COMFY_SERVER = os.getenv("COMFY_SERVER", "http://192.168.1.133:8188")
+
+# ComfyUI 백엔드 목록 (쉼표로 구분, "이름=주소" 형식 가능). 지정하지 않으면 COMFY_SERVER 하나만 사용
+COMFY_BACKENDS = [u.strip() for u in os.getenv("COMFY_BACKENDS", COMFY_SERVER).split(",") if u.strip()]
+
+# HTTP 커넥션 풀 / 동시 요청 제한
+COMFY_MAX_CONNECTIONS = _env_int("COMFY_MAX_CONNECTIONS", 20)
+COMFY_MAX_KEEPALIVE = _env_int("COMFY_MAX_KEEPALIVE", 10)
+COMFY_MAX_CONCURRENCY = _env_int("COMFY_MAX_CONCURRENCY", 16)
+
+# 호출별 타임아웃 (초)
+COMFY_CONNECT_TIMEOUT = _env_float("COMFY_CONNECT_TIMEOUT", 5.0)
+COMFY_TIMEOUT = _env_float("COMFY_TIMEOUT", 30.0)
+COMFY_PROMPT_TIMEOUT = _env_float("COMFY_PROMPT_TIMEOUT", 30.0)
+COMFY_HISTORY_TIMEOUT = _env_float("COMFY_HISTORY_TIMEOUT", 10.0)
+COMFY_VIEW_TIMEOUT = _env_float("COMFY_VIEW_TIMEOUT", 60.0)
+COMFY_STATUS_TIMEOUT = _env_float("COMFY_STATUS_TIMEOUT", 3.0)
+
+# ComfyUI 호출 재시도 횟수 / 재시도 간격 하한, 상한 (초)
+COMFY_RETRIES = _env_int("COMFY_RETRIES", 2)
+COMFY_RETRY_BASE = _env_float("COMFY_RETRY_BASE", 0.2)
+COMFY_RETRY_CAP = _env_float("COMFY_RETRY_CAP", 2.0)
+
+# 서킷 브레이커: 연속 실패 몇 번에 차단할지 / 차단 후 다시 시도하기까지 (초)
+CIRCUIT_FAILURE_THRESHOLD = _env_int("CIRCUIT_FAILURE_THRESHOLD", 5)
+CIRCUIT_RESET_TIMEOUT = _env_float("CIRCUIT_RESET_TIMEOUT", 10.0)
+
+# 워크플로우 템플릿 폴더 / 변경 확인 간격 (초)
+WORKFLOW_DIR = os.getenv("WORKFLOW_DIR", "workflow")
+WORKFLOW_RELOAD_INTERVAL = _env_float("WORKFLOW_RELOAD_INTERVAL", 1.0)
+
+# ComfyUI 웹소켓 재연결 간격 (초)
+WS_RECONNECT_MIN = _env_float("WS_RECONNECT_MIN", 1.0)
+WS_RECONNECT_MAX = _env_float("WS_RECONNECT_MAX", 30.0)
+
+# 작업 기록 저장소 (SQLite, 보관할 최대 작업 수)
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", os.path.join("cache", "jobs.sqlite3"))
+JOB_STORE_LIMIT = _env_int("JOB_STORE_LIMIT", 100000)
+
+# 메모리에 보관할 작업 수 / long-poll 대기 시간 (초)
+JOB_HISTORY_LIMIT = _env_int("JOB_HISTORY_LIMIT", 1000)
+JOB_WAIT_TIMEOUT = _env_float("JOB_WAIT_TIMEOUT", 30.0)
+JOB_FALLBACK_POLL = _env_float("JOB_FALLBACK_POLL", 2.0)
+SSE_KEEPALIVE = _env_float("SSE_KEEPALIVE", 15.0)
+
+# 작업 취소: 기다리는 클라이언트가 모두 떠나면 취소 (0이면 끔) / 재접속을 기다리는 시간 (초)
+CANCEL_ON_DISCONNECT = bool(_env_int("CANCEL_ON_DISCONNECT", 1))
+CANCEL_GRACE = _env_float("CANCEL_GRACE", 10.0)
+# 요청에 timeout이 없을 때 적용할 작업 제한 시간 (초, 0이면 제한 없음)
+JOB_DEADLINE = _env_float("JOB_DEADLINE", 0.0)
+
+# 브라우저 웹소켓 클라이언트별 전송 큐 크기
+WS_CLIENT_QUEUE_SIZE = _env_int("WS_CLIENT_QUEUE_SIZE", 64)
+
+# 실행 중 미리보기 기본 정책 (클라이언트가 preview_policy 메시지로 변경 가능)
+# 초당 최대 프레임 수 (0이면 보내지 않음) / 최대 너비 (0이면 원본) / 포맷 (original, jpeg, webp, png) / 품질
+# 전송 형식: legacy (ComfyUI 바이너리 + JSON 메시지) / combined (메타데이터가 붙은 바이너리 하나)
+PREVIEW_MAX_FPS = _env_float("PREVIEW_MAX_FPS", 4.0)
+PREVIEW_MAX_WIDTH = _env_int("PREVIEW_MAX_WIDTH", 0)
+PREVIEW_FORMAT = os.getenv("PREVIEW_FORMAT", "original").lower()
+PREVIEW_QUALITY = _env_int("PREVIEW_QUALITY", 70)
+PREVIEW_FRAMING = os.getenv("PREVIEW_FRAMING", "legacy").lower()
+
+# 출력 이미지 캐시 (메모리 / 디스크 LRU, MB 단위)
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join("cache", "images"))
+IMAGE_CACHE_MEMORY_MB = _env_int("IMAGE_CACHE_MEMORY_MB", 128)
+IMAGE_CACHE_DISK_MB = _env_int("IMAGE_CACHE_DISK_MB", 2048)
+IMAGE_CACHE_MEMORY_ITEM_MB = _env_int("IMAGE_CACHE_MEMORY_ITEM_MB", 8)
+
+# ComfyUI 출력 / 임시 폴더를 직접 읽을 수 있을 때 (같은 호스트 또는 마운트) 경로. 비워두면 HTTP /view로만 가져옴
+COMFY_OUTPUT_DIR = os.getenv("COMFY_OUTPUT_DIR", "")
+COMFY_TEMP_DIR = os.getenv("COMFY_TEMP_DIR", "")
+# 위 폴더를 쓰는 백엔드 이름 (비워두면 첫 번째 백엔드)
+COMFY_LOCAL_BACKEND = os.getenv("COMFY_LOCAL_BACKEND", "")
+
+# 이미지 변환본 (썸네일 / WebP·JPEG·AVIF)
+DERIVATIVE_CACHE_MB = _env_int("DERIVATIVE_CACHE_MB", 512)
+DERIVATIVE_WORKERS = _env_int("DERIVATIVE_WORKERS", 2)
+DERIVATIVE_DEFAULT_QUALITY = _env_int("DERIVATIVE_DEFAULT_QUALITY", 80)
+DERIVATIVE_WIDTHS = [int(w) for w in os.getenv("DERIVATIVE_WIDTHS", "128,256,384,512,768,1024,1536,2048").split(",")]
+
+# 작업 스케줄러 (백엔드별 동시 제출 수 / 대기열 길이 / 클라이언트별 할당량)
+SCHEDULER_MAX_INFLIGHT = _env_int("SCHEDULER_MAX_INFLIGHT", 2)
+SCHEDULER_MAX_DEPTH = _env_int("SCHEDULER_MAX_DEPTH", 100)
+SCHEDULER_CLIENT_QUOTA = _env_int("SCHEDULER_CLIENT_QUOTA", 4)
+# 실행 기록이 없는 워크플로우의 예상 실행 시간 (초)
+SCHEDULER_DEFAULT_ESTIMATE = _env_float("SCHEDULER_DEFAULT_ESTIMATE", 20.0)
+# 죽은 백엔드에 보낸 작업이 그 백엔드에 남아 있지 않은지 확인하는 최대 시간 (초, 지나면 확인 없이 다른 백엔드로 재배치)
+SCHEDULER_REQUEUE_TIMEOUT = _env_float("SCHEDULER_REQUEUE_TIMEOUT", 60.0)
+
+# 백엔드 상태 확인 간격 (초) / 연속 실패 허용 횟수
+BACKEND_HEALTH_INTERVAL = _env_float("BACKEND_HEALTH_INTERVAL", 5.0)
+BACKEND_FAILURE_THRESHOLD = _env_int("BACKEND_FAILURE_THRESHOLD", 2)
+# 같은 모델이 올라가 있는 백엔드를 우선할 때 허용하는 대기열 차이
+BACKEND_AFFINITY_SLACK = _env_int("BACKEND_AFFINITY_SLACK", 1)
+
+# 배치 생성 (한 작업의 batch_size로 묶는 최대 이미지 수 / 배치 요청 하나의 최대 이미지 수)
+BATCH_MAX_SIZE = _env_int("BATCH_MAX_SIZE", 8)
+BATCH_MAX_ITEMS = _env_int("BATCH_MAX_ITEMS", 64)
+
+# 결과 캐시 (같은 워크플로우 그래프 요청 재사용, 초 / 항목 수)
+RESULT_CACHE_TTL = _env_float("RESULT_CACHE_TTL", 3600.0)
+RESULT_CACHE_SIZE = _env_int("RESULT_CACHE_SIZE", 1000)
+
+# 로그 레벨 (DEBUG / INFO / WARNING / ERROR / OFF) / 형식 (text / json)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# 노드 프로파일: 워크플로우 / 노드 / cold·warm별로 보관할 최근 실행 시간 수
+PROFILE_SAMPLES = _env_int("PROFILE_SAMPLES", 200)
+# 이벤트 루프 지연 측정 간격 (초)
+EVENT_LOOP_LAG_INTERVAL = _env_float("EVENT_LOOP_LAG_INTERVAL", 0.25)
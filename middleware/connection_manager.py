@@ -0,0 +1,249 @@
+import asyncio
+import json
+from typing import Any, Dict, Optional, Set, Union
+
+from fastapi import WebSocket
+
+from config import WS_CLIENT_QUEUE_SIZE
+from job_tracker import Job
+from cancellation import cancellations
+from preview import PreviewFrame, PreviewPolicy
+from metrics import PREVIEW_FRAMES
+from log import get_logger
+
+
+logger = get_logger("connection_manager")
+
+
+Message = Union[str, bytes]
+
+
+# 브라우저 웹소켓 하나
+# 전송은 클라이언트별 큐 + 전용 태스크로 처리해서 느린 클라이언트가 다른 클라이언트를 막지 않음
+# 미리보기는 큐에 바로 넣지 않고 작업별 최신 프레임만 보관했다가 정책의 프레임 수 이하로 전송
+# (이전 메시지를 다 보내기 전에는 다음 프레임을 보내지 않으므로 느린 클라이언트는 프레임이 줄어듦)
+class ClientConnection:
+    def __init__(self, client_id: str, websocket: WebSocket, queue_size: int = WS_CLIENT_QUEUE_SIZE):
+        self.client_id = client_id
+        self.websocket = websocket
+        self.queue: "asyncio.Queue[Message]" = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.policy = PreviewPolicy()
+        self._previews: Dict[str, PreviewFrame] = {}
+        self._preview_ready = asyncio.Event()
+        self._sender: Optional[asyncio.Task] = None
+        self._previewer: Optional[asyncio.Task] = None
+
+    def start(self, on_error):
+        self._sender = asyncio.create_task(self._send_loop(on_error))
+        self._previewer = asyncio.create_task(self._preview_loop())
+
+    def stop(self):
+        for task in (self._sender, self._previewer):
+            if task is not None:
+                task.cancel()
+        self._sender = self._previewer = None
+
+    def offer(self, message: Message):
+        # 큐가 가득 차면 가장 오래된 메시지를 버리고 최신 메시지를 넣음
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                return
+            except asyncio.QueueFull:
+                try:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                    self.dropped += 1
+                except asyncio.QueueEmpty:
+                    pass
+
+    def offer_preview(self, frame: PreviewFrame):
+        if not self.policy.max_fps:
+            return
+        # 아직 보내지 않은 이전 프레임은 최신 프레임으로 대체
+        if frame.prompt_id in self._previews:
+            PREVIEW_FRAMES.inc(result="dropped")
+        self._previews[frame.prompt_id] = frame
+        self._preview_ready.set()
+
+    def discard_previews(self, prompt_id: str):
+        if self._previews.pop(prompt_id, None) is not None:
+            PREVIEW_FRAMES.inc(result="dropped")
+
+    async def _preview_loop(self):
+        while True:
+            await self._preview_ready.wait()
+            # 앞서 넣은 메시지를 클라이언트가 다 받을 때까지 대기 (그동안 들어온 프레임은 최신 것만 남음)
+            await self.queue.join()
+            self._preview_ready.clear()
+            frames, self._previews = self._previews, {}
+            for frame in frames.values():
+                try:
+                    messages = await frame.messages(self.policy)
+                except Exception as e:
+                    logger.warning("미리보기 전송 오류", extra={"client_id": self.client_id, "error": str(e)})
+                    continue
+                for message in messages:
+                    self.offer(message)
+                PREVIEW_FRAMES.inc(result="sent")
+            await asyncio.sleep(self.policy.interval)
+
+    async def _send_loop(self, on_error):
+        try:
+            while True:
+                message = await self.queue.get()
+                try:
+                    if isinstance(message, bytes):
+                        await self.websocket.send_bytes(message)
+                    else:
+                        await self.websocket.send_text(message)
+                finally:
+                    self.queue.task_done()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("웹소켓 전송 오류", extra={"client_id": self.client_id, "error": str(e)})
+            on_error(self)
+
+
+# 브라우저 웹소켓 관리 + prompt_id 기준 구독/팬아웃
+# ComfyUI 쪽 연결은 JobTracker의 웹소켓 하나만 사용
+class ConnectionManager:
+    def __init__(self):
+        self.active_connections: Dict[str, ClientConnection] = {}
+        self.subscriptions: Dict[str, Set[str]] = {}
+
+    async def connect(self, websocket: WebSocket, client_id: str) -> ClientConnection:
+        await websocket.accept()
+        connection = ClientConnection(client_id, websocket)
+        previous = self.active_connections.get(client_id)
+        if previous is not None:
+            # 같은 client_id로 다시 연결하면 이전 연결을 닫고 대체 (구독 / 미리보기 정책은 새 연결이 이어받음)
+            previous.stop()
+            connection.policy = previous.policy
+            asyncio.create_task(self._close(previous))
+        self.active_connections[client_id] = connection
+        connection.start(self.disconnect)
+        return connection
+
+    @staticmethod
+    async def _close(connection: ClientConnection):
+        try:
+            await connection.websocket.close(code=4000, reason="replaced")
+        except Exception:
+            # 이미 끊긴 연결
+            pass
+
+    def disconnect(self, connection: ClientConnection):
+        # 다른 연결로 대체된 이전 연결이 끝날 때는 현재 연결 / 구독을 건드리지 않음
+        connection.stop()
+        client_id = connection.client_id
+        if self.active_connections.get(client_id) is not connection:
+            return
+        del self.active_connections[client_id]
+        for prompt_id in list(self.subscriptions):
+            self.unsubscribe(client_id, prompt_id)
+
+    # 구독 중인 클라이언트는 작업을 기다리는 것으로 봄 (모두 떠나면 자동 취소 대상)
+    def subscribe(self, client_id: str, prompt_id: str):
+        clients = self.subscriptions.setdefault(prompt_id, set())
+        if client_id not in clients:
+            clients.add(client_id)
+            cancellations.acquire(prompt_id, client_id)
+
+    def unsubscribe(self, client_id: str, prompt_id: str):
+        clients = self.subscriptions.get(prompt_id)
+        if clients is None or client_id not in clients:
+            return
+        clients.discard(client_id)
+        if not clients:
+            del self.subscriptions[prompt_id]
+        cancellations.release(prompt_id, client_id)
+
+    def send_message(self, client_id: str, message: Dict[str, Any]):
+        connection = self.active_connections.get(client_id)
+        if connection is not None:
+            connection.offer(json.dumps(message))
+
+    def send_bytes(self, client_id: str, data: bytes):
+        connection = self.active_connections.get(client_id)
+        if connection is not None:
+            connection.offer(data)
+
+    def publish(self, prompt_id: str, message: Dict[str, Any]):
+        text = json.dumps(message)
+        for client_id in self.subscriptions.get(prompt_id, ()):
+            connection = self.active_connections.get(client_id)
+            if connection is not None:
+                connection.offer(text)
+
+    def publish_preview(self, frame: PreviewFrame):
+        for client_id in self.subscriptions.get(frame.prompt_id, ()):
+            connection = self.active_connections.get(client_id)
+            if connection is not None:
+                connection.offer_preview(frame)
+
+    def set_preview_policy(self, client_id: str, message: Dict[str, Any]) -> PreviewPolicy:
+        # 잘못된 값이면 ValueError / TypeError
+        connection = self.active_connections[client_id]
+        connection.policy = PreviewPolicy.from_message(message, connection.policy)
+        return connection.policy
+
+    # JobTracker 리스너: ComfyUI 메시지를 구독 중인 브라우저로 전달
+    def on_job_event(self, event: str, job: Job, data: Dict[str, Any]):
+        prompt_id = job.prompt_id
+        if prompt_id not in self.subscriptions:
+            return
+
+        if event in ("executing", "progress"):
+            progress = 0
+            if job.progress["max"]:
+                progress = int(job.progress["value"] / job.progress["max"] * 100)
+            self.publish(prompt_id, {
+                "type": "progress",
+                "prompt_id": prompt_id,
+                "node": job.node,
+                "progress": progress,
+                "node_info": job.progress,
+            })
+        elif event == "preview":
+            # 클라이언트별 정책(프레임 수 / 크기 / 포맷 / 전송 형식)에 맞춰 전송
+            self.publish_preview(PreviewFrame(prompt_id, data.get("node"), data["image"]))
+        elif event == "withdrawn":
+            # 요청을 철회한 (취소 / 제한 시간 초과) 클라이언트만 구독 해제, 다른 요청자는 계속 받음
+            client_id = data["client_id"]
+            if client_id in self.subscriptions.get(prompt_id, ()):
+                self.send_message(client_id, {
+                    "type": "error",
+                    "prompt_id": prompt_id,
+                    "status": "withdrawn",
+                    "message": data["reason"],
+                })
+                self.unsubscribe(client_id, prompt_id)
+        elif event == "finished":
+            # 결과 뒤에 이전 미리보기가 도착하지 않도록 남은 프레임은 버림
+            for client_id in self.subscriptions.get(prompt_id, ()):
+                connection = self.active_connections.get(client_id)
+                if connection is not None:
+                    connection.discard_previews(prompt_id)
+            if job.status == "completed":
+                self.publish(prompt_id, {"type": "execution_complete", "prompt_id": prompt_id})
+                self.publish(prompt_id, {
+                    "type": "result",
+                    "prompt_id": prompt_id,
+                    "seed": job.seed,
+                    "images": job.images,
+                })
+            else:
+                self.publish(prompt_id, {
+                    "type": "error",
+                    "prompt_id": prompt_id,
+                    "status": job.status,
+                    "message": job.error or "작업이 중단되었습니다.",
+                })
+            # 완료된 작업은 구독 해제
+            self.subscriptions.pop(prompt_id, None)
+
+
+manager = ConnectionManager()
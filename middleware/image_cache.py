@@ -0,0 +1,438 @@
+import asyncio
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from fastapi import Response
+from fastapi.responses import FileResponse
+
+from config import (
+    IMAGE_CACHE_DIR,
+    IMAGE_CACHE_MEMORY_MB,
+    IMAGE_CACHE_DISK_MB,
+    IMAGE_CACHE_MEMORY_ITEM_MB,
+    COMFY_VIEW_TIMEOUT,
+)
+from backend_pool import Backend
+from log import get_logger
+from metrics import IMAGE_FETCH_TIME, IMAGE_FETCH_BYTES
+
+
+logger = get_logger("image_cache")
+
+
+CHUNK_SIZE = 64 * 1024
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class ImageNotFound(Exception):
+    pass
+
+
+def cache_key(backend: str, filename: str, subfolder: str, folder_type: str) -> str:
+    # 백엔드마다 같은 파일 이름이 있을 수 있으므로 백엔드 이름도 키에 포함
+    return f"{backend}/{folder_type}/{subfolder}/{filename}"
+
+
+def _key_hash(key: str) -> str:
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+# 캐시된 이미지 하나 (본문은 content hash 이름의 blob 파일에 저장)
+class ImageEntry:
+    def __init__(self, key: str, etag: str, size: int, media_type: str, path: str):
+        self.key = key
+        self.etag = etag
+        self.size = size
+        self.media_type = media_type
+        self.path = path
+
+    def to_dict(self):
+        return {"key": self.key, "etag": self.etag, "size": self.size, "media_type": self.media_type}
+
+
+# ComfyUI 출력 이미지 캐시
+# - 출력 이미지는 한 번 저장되면 바뀌지 않으므로 backend/filename/subfolder/type 기준으로 영구 캐시
+# - 디스크: blobs/<sha256> (내용 기준 저장, 중복 제거) + index/<key hash>.json
+# - 메모리: 작은 이미지만 LRU로 보관
+# - 같은 이미지에 대한 동시 미스는 ComfyUI 요청 하나로 합침
+# - 전송 중인 blob은 디스크 LRU에서 밀려나도 전송이 끝난 뒤에 삭제
+class ImageCache:
+    def __init__(
+        self,
+        cache_dir: str = IMAGE_CACHE_DIR,
+        memory_limit: int = IMAGE_CACHE_MEMORY_MB * 1024 * 1024,
+        disk_limit: int = IMAGE_CACHE_DISK_MB * 1024 * 1024,
+        memory_item_limit: int = IMAGE_CACHE_MEMORY_ITEM_MB * 1024 * 1024,
+    ):
+        self.cache_dir = cache_dir
+        self.blob_dir = os.path.join(cache_dir, "blobs")
+        self.index_dir = os.path.join(cache_dir, "index")
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self.memory_item_limit = memory_item_limit
+
+        self._index: "OrderedDict[str, ImageEntry]" = OrderedDict()
+        self._refs: Dict[str, int] = {}
+        # 전송 중인 blob (etag별 응답 수) / 전송이 끝나면 지울 blob
+        self._pins: Dict[str, int] = {}
+        self._doomed: Dict[str, str] = {}
+        self._disk_size = 0
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_size = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.index_dir, exist_ok=True)
+        self._load_index()
+
+    # 디스크 인덱스
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.index_dir):
+            path = os.path.join(self.index_dir, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                blob = os.path.join(self.blob_dir, meta["etag"])
+                if not os.path.exists(blob):
+                    os.remove(path)
+                    continue
+                entries.append((os.path.getmtime(path), meta, blob))
+            except (OSError, ValueError, KeyError):
+                continue
+        # 최근에 사용한 항목이 뒤로 가도록 정렬
+        for _, meta, blob in sorted(entries, key=lambda e: e[0]):
+            self._add_entry(ImageEntry(meta["key"], meta["etag"], meta["size"], meta["media_type"], blob))
+
+    def _add_entry(self, entry: ImageEntry):
+        self._index[entry.key] = entry
+        self.keep(entry.etag)
+        if self._refs.get(entry.etag, 0) == 0:
+            self._disk_size += entry.size
+        self._refs[entry.etag] = self._refs.get(entry.etag, 0) + 1
+
+    def _index_path(self, key: str) -> str:
+        return os.path.join(self.index_dir, f"{_key_hash(key)}.json")
+
+    def _evict_disk(self) -> List[str]:
+        # 지울 파일 목록 반환 (삭제는 호출한 쪽에서 워커 스레드로)
+        paths = []
+        while self._disk_size > self.disk_limit and len(self._index) > 1:
+            key, entry = self._index.popitem(last=False)
+            self._forget_memory(key)
+            paths.append(self._index_path(key))
+            self._refs[entry.etag] -= 1
+            if self._refs[entry.etag] == 0:
+                del self._refs[entry.etag]
+                self._disk_size -= entry.size
+                if self.retire(entry):
+                    paths.append(entry.path)
+        return paths
+
+    # 전송 중인 blob 고정 (FileResponse가 파일을 여는 시점이 응답을 만든 뒤라서 그 사이에 지워지지 않게)
+    def pin(self, entry: ImageEntry):
+        self._pins[entry.etag] = self._pins.get(entry.etag, 0) + 1
+
+    def retire(self, entry: ImageEntry) -> bool:
+        # 캐시에서 빠진 파일: 전송 중이 아니면 True (바로 삭제), 전송 중이면 unpin에서 삭제
+        if self._pins.get(entry.etag):
+            self._doomed[entry.etag] = entry.path
+            return False
+        return True
+
+    def keep(self, etag: str):
+        # 지우기로 한 파일이 다시 캐시에 들어오면 삭제 취소
+        self._doomed.pop(etag, None)
+
+    async def unpin(self, entry: ImageEntry):
+        count = self._pins.get(entry.etag, 0) - 1
+        if count > 0:
+            self._pins[entry.etag] = count
+            return
+        self._pins.pop(entry.etag, None)
+        path = self._doomed.pop(entry.etag, None)
+        if path is not None:
+            await asyncio.to_thread(remove_files, [path])
+
+    # 메모리 캐시
+    def remember(self, key: str, data: bytes):
+        if len(data) > self.memory_item_limit:
+            return
+        self._forget_memory(key)
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_limit and self._memory:
+            _, old = self._memory.popitem(last=False)
+            self._memory_size -= len(old)
+
+    def _forget_memory(self, key: str):
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= len(old)
+
+    def memory_get(self, entry: ImageEntry) -> Optional[bytes]:
+        data = self._memory.get(entry.key)
+        if data is not None:
+            self._memory.move_to_end(entry.key)
+        return data
+
+    # 조회
+    def lookup(self, filename: str, subfolder: str, folder_types: List[str],
+               backends: List[Backend]) -> Optional[ImageEntry]:
+        for backend in backends:
+            for folder_type in folder_types:
+                key = cache_key(backend.name, filename, subfolder, folder_type)
+                entry = self._index.get(key)
+                if entry is not None:
+                    self._index.move_to_end(key)
+                    return entry
+        return None
+
+    async def get(self, filename: str, subfolder: str, folder_types: List[str],
+                  backends: List[Backend]) -> ImageEntry:
+        entry = self.lookup(filename, subfolder, folder_types, backends)
+        if entry is not None:
+            if entry.key in self._memory:
+                self.stats["memory_hits"] += 1
+            else:
+                self.stats["disk_hits"] += 1
+                asyncio.get_running_loop().run_in_executor(None, self._touch, entry.key)
+            return entry
+
+        # 같은 이미지를 동시에 요청하면 다운로드 한 번만 수행
+        flight_key = cache_key(",".join(b.name for b in backends), filename, subfolder, ",".join(folder_types))
+        future = self._inflight.get(flight_key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[flight_key] = future
+        try:
+            self.stats["misses"] += 1
+            entry = await self._fetch(filename, subfolder, folder_types, backends)
+            future.set_result(entry)
+            return entry
+        except Exception as e:
+            future.set_exception(e)
+            # 대기자가 없을 때 경고가 나오지 않도록 예외를 소비
+            future.exception()
+            raise
+        finally:
+            del self._inflight[flight_key]
+
+    def _touch(self, key: str):
+        try:
+            os.utime(self._index_path(key))
+        except OSError:
+            pass
+
+    async def _fetch(self, filename: str, subfolder: str, folder_types: List[str],
+                     backends: List[Backend]) -> ImageEntry:
+        # 백엔드마다 폴더 타입(output / temp)을 동시에 요청해서 먼저 받은 응답을 사용 (하나씩 확인하지 않음)
+        # 남은 요청은 취소 (_download가 임시 파일 정리), 모두 실패하면 다음 백엔드
+        # 404가 아닌 오류(연결 실패, 서킷 차단 등)만 있었으면 ImageNotFound 대신 그 오류를 전달
+        error: Optional[Exception] = None
+        for backend in backends:
+            tasks = {
+                asyncio.create_task(self._download(backend, filename, subfolder, folder_type)): folder_type
+                for folder_type in folder_types
+            }
+            pending = set(tasks)
+            try:
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        try:
+                            return task.result()
+                        except httpx.HTTPStatusError as e:
+                            if e.response.status_code == 404:
+                                logger.info("이미지 없음", extra={"backend": backend.name, "folder": tasks[task],
+                                                               "image": filename})
+                                continue
+                            error = e
+                            logger.warning("이미지 가져오기 오류", extra={"backend": backend.name, "folder": tasks[task],
+                                                                   "image": filename, "status": e.response.status_code})
+                        except Exception as e:
+                            error = e
+                            logger.warning("이미지 가져오기 오류", extra={"backend": backend.name, "folder": tasks[task],
+                                                                   "image": filename, "error": repr(e)})
+            finally:
+                for task in pending:
+                    task.cancel()
+                # 취소된 요청 정리를 기다리고 먼저 끝난 나머지 요청의 예외도 소비
+                await asyncio.gather(*tasks, return_exceptions=True)
+        if error is not None:
+            raise error
+        raise ImageNotFound(filename)
+
+    async def _download(self, backend: Backend, filename: str, subfolder: str, folder_type: str) -> ImageEntry:
+        # 본문을 청크 단위로 임시 파일에 쓰면서 해시 계산 (전체를 메모리에 올리지 않음)
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        hasher = hashlib.sha256()
+        size = 0
+        small = bytearray()
+        started = time.perf_counter()
+        fd, tmp_path = tempfile.mkstemp(dir=self.blob_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async with backend.client.stream("/view", params=params, timeout=COMFY_VIEW_TIMEOUT) as response:
+                    media_type = response.headers.get("content-type", "").split(";")[0]
+                    async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                        hasher.update(chunk)
+                        size += len(chunk)
+                        if size <= self.memory_item_limit:
+                            small.extend(chunk)
+                        await asyncio.to_thread(f.write, chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        IMAGE_FETCH_TIME.observe(time.perf_counter() - started, backend=backend.name)
+        IMAGE_FETCH_BYTES.observe(size, backend=backend.name)
+
+        etag = hasher.hexdigest()
+        blob = os.path.join(self.blob_dir, etag)
+        if not media_type.startswith("image/"):
+            media_type = mimetypes.guess_type(filename)[0] or "image/png"
+
+        key = cache_key(backend.name, filename, subfolder, folder_type)
+        entry = ImageEntry(key, etag, size, media_type, blob)
+        # blob 이동 / 인덱스 기록은 파일 I/O라 워커 스레드에서 실행
+        await asyncio.to_thread(self._store, tmp_path, entry)
+
+        self._add_entry(entry)
+        if size <= self.memory_item_limit:
+            self.remember(key, bytes(small))
+        evicted = self._evict_disk()
+        if evicted:
+            await asyncio.to_thread(remove_files, evicted)
+        logger.debug("이미지 캐시 저장", extra={"backend": backend.name, "folder": folder_type,
+                                               "image": filename, "bytes": size})
+        return entry
+
+    def _store(self, tmp_path: str, entry: ImageEntry):
+        if os.path.exists(entry.path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, entry.path)
+        with open(self._index_path(entry.key), "w", encoding="utf-8") as f:
+            json.dump(entry.to_dict(), f)
+
+    def info(self):
+        return {
+            **self.stats,
+            "entries": len(self._index),
+            "disk_bytes": self._disk_size,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_size,
+        }
+
+
+def remove_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# HTTP 응답 (조건부 요청 / Range 지원)
+# 만족할 수 없는 범위 (416): 형식은 맞지만 파일 크기를 벗어난 단일 범위
+UNSATISFIABLE: Tuple[int, int] = (-1, -1)
+
+
+def _parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    # None: 해석할 수 없거나 지원하지 않는 Range (여러 범위, bytes 외 단위 등) -> 무시하고 전체 200 응답
+    match = _RANGE_RE.match(range_header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if start == "":
+        # 마지막 N 바이트
+        if end == "":
+            return None
+        length = int(end)
+        if length == 0 or size == 0:
+            return UNSATISFIABLE
+        return max(size - length, 0), size - 1
+    start = int(start)
+    if end and int(end) < start:
+        return None
+    if start >= size:
+        return UNSATISFIABLE
+    end = int(end) if end else size - 1
+    return start, min(end, size - 1)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or f'"{etag}"' in tags or f'W/"{etag}"' in tags
+
+
+# 캐시 blob 전송: 응답이 끝날 때까지 (연결이 끊겨도) blob을 고정해서 디스크 LRU가 지우지 못하게 함
+# ignore_range: 지원하지 않는 Range 헤더를 빼고 전체 200 응답 (메모리 응답과 같게, FileResponse는 400으로 응답함)
+class CachedFileResponse(FileResponse):
+    def __init__(self, entry: ImageEntry, cache: "ImageCache", headers: Dict[str, str], ignore_range: bool = False):
+        super().__init__(entry.path, media_type=entry.media_type, headers=headers)
+        self.entry = entry
+        self.cache = cache
+        self.ignore_range = ignore_range
+        cache.pin(entry)
+
+    async def __call__(self, scope, receive, send):
+        if self.ignore_range:
+            scope = {**scope, "headers": [(k, v) for k, v in scope["headers"] if k != b"range"]}
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.cache.unpin(self.entry)
+
+
+def image_response(entry: ImageEntry, request_headers, cache: "ImageCache") -> Response:
+    headers = {
+        "ETag": f'"{entry.etag}"',
+        "Cache-Control": CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, entry.etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request_headers.get("range")
+    byte_range = _parse_range(range_header, entry.size) if range_header else None
+
+    data = cache.memory_get(entry)
+    if data is None:
+        # 디스크 파일은 FileResponse로 전송 (Range / If-Range 처리, 서버가 지원하면 sendfile)
+        return CachedFileResponse(entry, cache, headers=headers,
+                                  ignore_range=bool(range_header) and byte_range is None)
+
+    start, end = 0, entry.size - 1
+    status_code = 200
+    if_range = request_headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == f'"{entry.etag}"'):
+        if byte_range is UNSATISFIABLE:
+            headers["Content-Range"] = f"bytes */{entry.size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{entry.size}"
+
+    headers["Content-Length"] = str(end - start + 1)
+    return Response(content=data[start:end + 1], status_code=status_code,
+                    media_type=entry.media_type, headers=headers)
+
+
+image_cache = ImageCache()
@@ -0,0 +1,228 @@
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from config import (
+    IMAGE_CACHE_DIR,
+    DERIVATIVE_CACHE_MB,
+    DERIVATIVE_WORKERS,
+    DERIVATIVE_WIDTHS,
+    DERIVATIVE_DEFAULT_QUALITY,
+)
+from image_cache import ImageEntry, ImageCache, image_cache, remove_files
+
+
+# 포맷 이름 -> (Pillow 포맷, media type)
+FORMATS = {
+    "avif": ("AVIF", "image/avif"),
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+FORMAT_ALIASES = {"jpg": "jpeg"}
+
+
+def supported_formats():
+    try:
+        from PIL import features
+    except ImportError:
+        return set()
+    supported = {"jpeg", "png"}
+    if features.check("webp"):
+        supported.add("webp")
+    if features.check("avif"):
+        supported.add("avif")
+    return supported
+
+
+SUPPORTED_FORMATS = supported_formats()
+
+
+def negotiate_format(requested: Optional[str], accept: str) -> Optional[str]:
+    # 명시한 포맷 우선, auto이면 Accept 헤더 기준으로 avif > webp > jpeg
+    if requested:
+        requested = FORMAT_ALIASES.get(requested.lower(), requested.lower())
+        if requested != "auto":
+            if requested not in FORMATS:
+                raise ValueError(f"지원하지 않는 이미지 포맷입니다: {requested}")
+            if requested in SUPPORTED_FORMATS:
+                return requested
+    accept = (accept or "").lower()
+    for fmt in ("avif", "webp"):
+        if fmt in SUPPORTED_FORMATS and f"image/{fmt}" in accept:
+            return fmt
+    return "jpeg"
+
+
+def snap_width(width: Optional[int]) -> Optional[int]:
+    # 캐시 적중률을 위해 요청 너비를 정해진 크기로 올림
+    if not width or width <= 0:
+        return None
+    for bucket in DERIVATIVE_WIDTHS:
+        if width <= bucket:
+            return bucket
+    return DERIVATIVE_WIDTHS[-1]
+
+
+def clamp_quality(quality: Optional[int]) -> int:
+    if quality is None:
+        return DERIVATIVE_DEFAULT_QUALITY
+    return max(30, min(95, quality))
+
+
+# 워커 프로세스에서 실행 (리사이즈 + 인코딩)
+def render_derivative(src_path: str, dst_path: str, fmt: str, width: Optional[int], quality: int) -> int:
+    from PIL import Image
+
+    pil_format = FORMATS[fmt][0]
+    with Image.open(src_path) as image:
+        image.load()
+        if width and width < image.width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        if fmt == "jpeg":
+            if has_alpha:
+                # JPEG은 투명도를 지원하지 않으므로 흰 배경에 합성
+                rgba = image.convert("RGBA")
+                background = Image.new("RGB", rgba.size, (255, 255, 255))
+                background.paste(rgba, mask=rgba.getchannel("A"))
+                image = background
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if has_alpha else "RGB")
+
+        options = {}
+        if fmt in ("jpeg", "webp", "avif"):
+            options["quality"] = quality
+        if fmt == "jpeg":
+            options["optimize"] = True
+            options["progressive"] = True
+        elif fmt == "webp":
+            options["method"] = 4
+        elif fmt == "png":
+            options["optimize"] = True
+
+        tmp_path = f"{dst_path}.part"
+        image.save(tmp_path, pil_format, **options)
+    os.replace(tmp_path, dst_path)
+    return os.path.getsize(dst_path)
+
+
+# 원본 캐시 옆(derived/)에 저장하는 변환본 캐시
+# 같은 변환을 동시에 요청하면 작업 하나로 합침
+class DerivativeStore:
+    def __init__(self, cache: ImageCache, cache_dir: str = IMAGE_CACHE_DIR,
+                 disk_limit: int = DERIVATIVE_CACHE_MB * 1024 * 1024,
+                 workers: int = DERIVATIVE_WORKERS):
+        self.cache = cache
+        self.dir = os.path.join(cache_dir, "derived")
+        self.disk_limit = disk_limit
+        self.workers = workers
+        self._entries: "OrderedDict[str, ImageEntry]" = OrderedDict()
+        self._disk_size = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.stats = {"hits": 0, "renders": 0}
+        os.makedirs(self.dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        files = []
+        for name in os.listdir(self.dir):
+            if name.endswith(".part"):
+                os.remove(os.path.join(self.dir, name))
+                continue
+            path = os.path.join(self.dir, name)
+            files.append((os.path.getmtime(path), name, path))
+        for _, name, path in sorted(files):
+            fmt = name.rsplit(".", 1)[-1]
+            if fmt not in FORMATS:
+                continue
+            entry = ImageEntry(name, name.rsplit(".", 1)[0], os.path.getsize(path), FORMATS[fmt][1], path)
+            self._entries[name] = entry
+            self._disk_size += entry.size
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _evict(self) -> List[str]:
+        # 전송 중인 변환본은 전송이 끝난 뒤에 삭제 (ImageCache.retire)
+        paths = []
+        while self._disk_size > self.disk_limit and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self._disk_size -= entry.size
+            if self.cache.retire(entry):
+                paths.append(entry.path)
+        return paths
+
+    async def get(self, source: ImageEntry, fmt: str, width: Optional[int], quality: int) -> ImageEntry:
+        # 변환본 ETag는 원본 해시 + 변환 옵션으로 결정
+        etag = hashlib.sha256(f"{source.etag}:{fmt}:{width or 0}:{quality}".encode()).hexdigest()
+        name = f"{etag}.{fmt}"
+        entry = self._entries.get(name)
+        if entry is not None:
+            self._entries.move_to_end(name)
+            self.stats["hits"] += 1
+            return entry
+
+        future = self._inflight.get(name)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[name] = future
+        try:
+            path = os.path.join(self.dir, name)
+            # 같은 변환본을 지우기로 했으면 취소 (새로 쓴 파일이 지워지지 않게)
+            # 변환하는 동안 원본 blob이 디스크 LRU에서 지워지지 않게 고정
+            self.cache.keep(etag)
+            self.cache.pin(source)
+            try:
+                size = await asyncio.get_running_loop().run_in_executor(
+                    self.pool, render_derivative, source.path, path, fmt, width, quality
+                )
+            finally:
+                await self.cache.unpin(source)
+            entry = ImageEntry(name, etag, size, FORMATS[fmt][1], path)
+            self._entries[name] = entry
+            self._disk_size += size
+            evicted = self._evict()
+            if evicted:
+                await asyncio.to_thread(remove_files, evicted)
+            self.stats["renders"] += 1
+            if size <= self.cache.memory_item_limit:
+                data = await asyncio.to_thread(_read_file, path)
+                self.cache.remember(name, data)
+            future.set_result(entry)
+            return entry
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            del self._inflight[name]
+
+    def info(self):
+        return {**self.stats, "entries": len(self._entries), "disk_bytes": self._disk_size}
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+derivatives = DerivativeStore(image_cache)
@@ -0,0 +1,200 @@
+import asyncio
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import JOB_STORE_PATH, JOB_STORE_LIMIT
+from job_tracker import Job, FINISHED
+from log import get_logger
+
+
+logger = get_logger("job_store")
+
+COLUMNS = (
+    "prompt_id", "client_id", "workflow_name", "prompt_text", "seed", "backend", "status", "error",
+    "batch_id", "batch_size", "trace_id", "created_at", "started_at", "finished_at", "images", "node_timings",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    prompt_id TEXT PRIMARY KEY,
+    client_id TEXT,
+    workflow_name TEXT,
+    prompt_text TEXT,
+    seed INTEGER,
+    backend TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    batch_id TEXT,
+    batch_size INTEGER NOT NULL DEFAULT 1,
+    trace_id TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    images TEXT NOT NULL DEFAULT '[]',
+    node_timings TEXT NOT NULL DEFAULT '[]'
+);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at, prompt_id);
+CREATE INDEX IF NOT EXISTS jobs_client ON jobs (client_id, created_at, prompt_id);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at, prompt_id);
+"""
+
+# 이전 버전 DB에 없는 컬럼 (없으면 추가)
+MIGRATIONS = {
+    "node_timings": "ALTER TABLE jobs ADD COLUMN node_timings TEXT NOT NULL DEFAULT '[]'",
+}
+
+# 오래된 작업 정리 주기 (저장 횟수)
+PRUNE_EVERY = 500
+
+
+def encode_cursor(created_at: float, prompt_id: str) -> str:
+    return f"{created_at!r}_{prompt_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    created_at, _, prompt_id = cursor.partition("_")
+    return float(created_at), prompt_id
+
+
+# 작업 기록 저장소 (SQLite)
+# - 실행 시작 / 종료 시점에 트래커 리스너로 저장 (ComfyUI /history 없이 조회 가능, 재시작 후에도 유지)
+# - 목록은 (created_at, prompt_id) 키셋 페이지네이션이라 페이지 위치와 상관없이 인덱스 탐색 한 번
+# - 연결 하나를 전용 스레드에서만 사용해서 이벤트 루프를 막지 않고 쓰기도 순서대로 처리
+class JobStore:
+    def __init__(self, path: str = JOB_STORE_PATH, limit: int = JOB_STORE_LIMIT):
+        self.path = path
+        self.limit = limit
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for column, sql in MIGRATIONS.items():
+                if column not in columns:
+                    self._conn.execute(sql)
+            # 이전 실행에서 결과를 받지 못한 작업 (미들웨어 재시작 등)은 시작할 때 한 번에 interrupted로 바꿈
+            # (이후 끝나지 않은 기록은 모두 트래커에 있는 작업이라 목록은 status 컬럼만으로 거를 수 있음)
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'interrupted', error = COALESCE(error, ?) "
+                    f"WHERE status NOT IN ({', '.join('?' for _ in FINISHED)})",
+                    ("미들웨어가 재시작되어 작업 상태를 알 수 없습니다.", *FINISHED),
+                )
+        return self._conn
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def start(self):
+        await self._run(self._connect)
+
+    def close(self):
+        self._executor.submit(self._close)
+        self._executor.shutdown(wait=True)
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # 저장
+    def _row(self, job: Job) -> Tuple[Any, ...]:
+        return (
+            job.prompt_id, job.client_id, job.workflow_name, job.prompt_text, job.seed, job.backend,
+            job.status, job.error, job.batch_id, job.batch_size, job.trace_id,
+            job.created_at, job.started_at, job.finished_at, json.dumps(job.images, ensure_ascii=False),
+            json.dumps(job.node_timings),
+        )
+
+    def _save(self, row: Tuple[Any, ...]):
+        conn = self._connect()
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        with conn:
+            conn.execute(f"INSERT OR REPLACE INTO jobs ({', '.join(COLUMNS)}) VALUES ({placeholders})", row)
+        self._writes += 1
+        if self._writes % PRUNE_EVERY == 0:
+            self._prune()
+
+    def _prune(self):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE created_at < ("
+                "SELECT created_at FROM jobs ORDER BY created_at DESC LIMIT 1 OFFSET ?)",
+                (self.limit,),
+            )
+
+    def save(self, job: Job):
+        # 이벤트 루프에서 상태를 복사해두고 쓰기는 저장소 스레드에서 처리
+        future = self._executor.submit(self._save, self._row(job))
+        future.add_done_callback(self._log_error)
+
+    @staticmethod
+    def _log_error(future):
+        if future.exception() is not None:
+            logger.error("작업 기록 저장 오류", extra={"error": str(future.exception())})
+
+    # JobTracker 리스너
+    def on_job_event(self, event: str, job: Job, data: Dict[str, Any]):
+        if event in ("execution_start", "finished"):
+            self.save(job)
+
+    # 조회
+    @staticmethod
+    def to_job(row: sqlite3.Row) -> Job:
+        job = Job(row["prompt_id"], row["client_id"], row["workflow_name"])
+        for column in COLUMNS[3:]:
+            setattr(job, column, row[column])
+        job.images = json.loads(row["images"])
+        job.node_timings = json.loads(row["node_timings"])
+        return job
+
+    def _get(self, prompt_id: str) -> Optional[Job]:
+        row = self._connect().execute("SELECT * FROM jobs WHERE prompt_id = ?", (prompt_id,)).fetchone()
+        return self.to_job(row) if row is not None else None
+
+    async def get(self, prompt_id: str) -> Optional[Job]:
+        return await self._run(self._get, prompt_id)
+
+    def _list(self, client_id: Optional[str], status: Optional[str], limit: int,
+              cursor: Optional[str]) -> Tuple[List[Job], Optional[str]]:
+        where, params = [], []
+        if client_id is not None:
+            where.append("client_id = ?")
+            params.append(client_id)
+        if status is not None:
+            where.append("status = ?")
+            params.append(status)
+        if cursor:
+            created_at, prompt_id = decode_cursor(cursor)
+            where.append("(created_at, prompt_id) < (?, ?)")
+            params.extend([created_at, prompt_id])
+        sql = "SELECT * FROM jobs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC, prompt_id DESC LIMIT ?"
+        rows = self._connect().execute(sql, [*params, limit + 1]).fetchall()
+        jobs = [self.to_job(row) for row in rows[:limit]]
+        next_cursor = encode_cursor(jobs[-1].created_at, jobs[-1].prompt_id) if len(rows) > limit else None
+        return jobs, next_cursor
+
+    async def list(self, client_id: Optional[str] = None, status: Optional[str] = None,
+                   limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[Job], Optional[str]]:
+        # 최신순, next_cursor를 다음 요청의 cursor로 넘기면 다음 페이지
+        return await self._run(self._list, client_id, status, limit, cursor)
+
+
+job_store = JobStore()
@@ -0,0 +1,465 @@
+import asyncio
+import json
+import time
+import uuid
+import urllib.parse
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+import websockets
+from websockets.exceptions import ConnectionClosed
+
+from config import (
+    COMFY_HISTORY_TIMEOUT,
+    JOB_HISTORY_LIMIT,
+    WS_RECONNECT_MIN,
+    WS_RECONNECT_MAX,
+)
+from backend_pool import Backend, pool
+from log import get_logger, trace_id_var
+
+
+logger = get_logger("job_tracker")
+
+
+# pending: 미들웨어 대기열, queued: ComfyUI 대기열
+FINISHED = ("completed", "failed", "interrupted")
+
+
+def image_url(image: Dict[str, Any], backend: Optional[str] = None) -> str:
+    params = {
+        "filename": image["filename"],
+        "subfolder": image.get("subfolder", ""),
+        "folder_type": image.get("type", "output"),
+    }
+    if backend:
+        # 이미지는 작업을 실행한 백엔드에서 가져와야 함
+        params["backend"] = backend
+    return f"/api/image?{urllib.parse.urlencode(params)}"
+
+
+# 미들웨어가 추적하는 ComfyUI 작업 하나
+class Job:
+    def __init__(self, prompt_id: str, client_id: Optional[str] = None, workflow_name: Optional[str] = None):
+        self.prompt_id = prompt_id
+        # ComfyUI 쪽 prompt_id (보통 prompt_id와 같음)
+        self.upstream_id = prompt_id
+        # 작업을 실행하는 ComfyUI 백엔드 이름
+        self.backend: Optional[str] = None
+        self.client_id = client_id
+        self.workflow_name = workflow_name
+        self.prompt_text: Optional[str] = None
+        self.seed: Optional[int] = None
+        # 요청 추적 ID (로그 / ComfyUI extra_data)
+        self.trace_id: Optional[str] = None
+        # 배치 요청에 속한 작업 (batch_size: 이 작업 하나가 만드는 이미지 수)
+        self.batch_id: Optional[str] = None
+        self.batch_size = 1
+        self.status = "queued"
+        self.node: Optional[str] = None
+        self.progress = {"value": 0, "max": 0}
+        self.images: List[Dict[str, Any]] = []
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # 노드별 실행 시간 (executing 메시지 사이 간격) / 노드 ID -> class_type (템플릿과 공유)
+        self.node_timings: List[Dict[str, Any]] = []
+        self.node_types: Dict[str, str] = {}
+        self._node_started: Optional[float] = None
+        self.version = 0
+        self._updated = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def touch(self):
+        # 대기 중인 요청(long-poll / SSE)을 깨움
+        self.version += 1
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    async def wait_update(self, version: int, timeout: float) -> bool:
+        if self.version != version or self.finished:
+            return True
+        event = self._updated
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def add_images(self, output: Dict[str, Any], node: Optional[str] = None):
+        for image in output.get("images", []) or []:
+            entry = {
+                "filename": image["filename"],
+                "subfolder": image.get("subfolder", ""),
+                "type": image.get("type", "output"),
+                "node": node,
+            }
+            entry["url"] = image_url(entry, self.backend)
+            if entry not in self.images:
+                self.images.append(entry)
+
+    def enter_node(self, node: Optional[str]):
+        # 실행 중이던 노드를 닫고 다음 노드 시작 (node가 None이면 닫기만)
+        now = time.monotonic()
+        if self.node is not None and self._node_started is not None:
+            self.node_timings.append({
+                "node": self.node,
+                "class_type": self.node_types.get(self.node),
+                "duration": round(now - self._node_started, 4),
+                "cached": False,
+            })
+        self._node_started = now if node is not None else None
+
+    def add_cached_nodes(self, nodes: List[str]):
+        # ComfyUI가 이전 결과를 재사용해서 실행하지 않은 노드
+        for node in nodes or []:
+            self.node_timings.append({
+                "node": node, "class_type": self.node_types.get(node), "duration": 0.0, "cached": True,
+            })
+
+    @property
+    def model_load(self) -> Optional[str]:
+        # 로더 노드가 실제로 실행됐으면 cold (모델을 새로 읽음), 모두 캐시됐으면 warm
+        loaders = [t for t in self.node_timings if "Loader" in (t.get("class_type") or "")]
+        if not loaders:
+            return None
+        return "cold" if any(not t["cached"] for t in loaders) else "warm"
+
+    def timings(self) -> Dict[str, Optional[float]]:
+        # 단계별 소요 시간 (초): 미들웨어/ComfyUI 대기열 대기, ComfyUI 실행
+        queue_wait = execution = None
+        if self.started_at:
+            queue_wait = round(self.started_at - self.created_at, 3)
+            if self.finished_at:
+                execution = round(self.finished_at - self.started_at, 3)
+        return {"queue_wait": queue_wait, "execution": execution}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "prompt_id": self.prompt_id,
+            "client_id": self.client_id,
+            "trace_id": self.trace_id,
+            "workflow_name": self.workflow_name,
+            "prompt_text": self.prompt_text,
+            "backend": self.backend,
+            "seed": self.seed,
+            "batch_id": self.batch_id,
+            "batch_size": self.batch_size,
+            "status": self.status,
+            "node": self.node,
+            "progress": self.progress,
+            "images": self.images,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "timings": self.timings(),
+            "model_load": self.model_load,
+            "node_timings": self.node_timings,
+        }
+
+
+# ComfyUI 백엔드마다 웹소켓 하나씩만 구독해서 모든 작업 상태를 메모리에서 관리
+# - 작업은 전부 이 트래커의 client_id로 제출해야 실행 메시지를 받을 수 있음
+# - 연결이 끊기면 지수 백오프로 재연결하고, 진행 중이던 작업은 /history로 보정
+class JobTracker:
+    def __init__(self, limit: int = JOB_HISTORY_LIMIT):
+        self.limit = limit
+        self.client_id = f"middleware_{uuid.uuid4()}"
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.connections: Dict[str, bool] = {}
+        # 백엔드별 현재 실행 중인 작업 (미리보기 프레임 연결용)
+        self.current_prompt_ids: Dict[str, str] = {}
+        self.aliases: Dict[str, str] = {}
+        self.listeners: List[Callable[[str, Job, Dict[str, Any]], None]] = []
+        self._completing = set()
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    @property
+    def connected(self) -> bool:
+        return any(self.connections.values())
+
+    # 작업 관리
+    def get(self, prompt_id: str) -> Optional[Job]:
+        return self.jobs.get(prompt_id)
+
+    def _get_or_create(self, prompt_id: str) -> Job:
+        job = self.jobs.get(prompt_id)
+        if job is None:
+            job = Job(prompt_id)
+            self.jobs[prompt_id] = job
+            self._evict()
+        return job
+
+    def register(self, prompt_id: str, client_id: Optional[str] = None,
+                 workflow_name: Optional[str] = None, seed: Optional[int] = None,
+                 status: Optional[str] = None, prompt_text: Optional[str] = None,
+                 node_types: Optional[Dict[str, str]] = None) -> Job:
+        # 웹소켓 메시지가 /prompt 응답보다 먼저 올 수 있으므로 기존 작업과 합침
+        job = self._get_or_create(prompt_id)
+        job.client_id = client_id
+        job.workflow_name = workflow_name
+        job.seed = seed
+        job.prompt_text = prompt_text
+        job.node_types = node_types or {}
+        job.trace_id = trace_id_var.get()
+        if status is not None:
+            job.status = status
+        return job
+
+    def discard(self, prompt_id: str):
+        self.jobs.pop(prompt_id, None)
+
+    def alias(self, upstream_id: str, prompt_id: str):
+        # ComfyUI가 요청한 prompt_id를 무시하고 새 ID를 준 경우 메시지를 원래 작업으로 연결
+        job = self.jobs.get(prompt_id)
+        if upstream_id != prompt_id and job is not None:
+            job.upstream_id = upstream_id
+            self.aliases[upstream_id] = prompt_id
+            stub = self.jobs.pop(upstream_id, None)
+            if stub is not None:
+                # 별칭 등록 전에 도착한 메시지로 만들어진 상태를 합침
+                for field in ("node", "progress", "images", "started_at"):
+                    setattr(job, field, getattr(stub, field))
+                if stub.finished:
+                    self._finish(job, stub.status, stub.error)
+                elif stub.status != "queued":
+                    job.status = stub.status
+                job.touch()
+
+    def assign(self, prompt_id: str, backend: str):
+        job = self.jobs.get(prompt_id)
+        if job is not None:
+            job.backend = backend
+
+    def requeue(self, prompt_id: str):
+        # 백엔드 장애로 다른 백엔드에 다시 보낼 작업
+        job = self.jobs.get(prompt_id)
+        if job is None or job.finished:
+            return
+        job.status = "pending"
+        job.backend = None
+        job.upstream_id = prompt_id
+        job.node = None
+        job.progress = {"value": 0, "max": 0}
+        job.started_at = None
+        job.touch()
+
+    def mark_queued(self, prompt_id: str):
+        job = self.jobs.get(prompt_id)
+        if job is not None and job.status == "pending":
+            job.status = "queued"
+            job.touch()
+
+    def fail(self, prompt_id: str, error: str):
+        job = self.jobs.get(prompt_id)
+        if job is not None:
+            self._finish(job, "failed", error)
+
+    def cancel(self, prompt_id: str, reason: str):
+        job = self.jobs.get(prompt_id)
+        if job is not None:
+            self._finish(job, "interrupted", reason)
+
+    def _evict(self):
+        # 오래된 완료 작업부터 정리
+        while len(self.jobs) > self.limit:
+            for prompt_id, job in self.jobs.items():
+                if job.finished:
+                    del self.jobs[prompt_id]
+                    self.aliases.pop(job.upstream_id, None)
+                    break
+            else:
+                break
+
+    # 업스트림 웹소켓
+    async def start(self):
+        for backend in pool.backends.values():
+            if backend.name not in self._tasks:
+                self._tasks[backend.name] = asyncio.create_task(self._run(backend))
+
+    async def stop(self):
+        for task in self._tasks.values():
+            task.cancel()
+        for task in self._tasks.values():
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks.clear()
+
+    async def _run(self, backend: Backend):
+        delay = WS_RECONNECT_MIN
+        url = f"{backend.ws_url}?clientId={self.client_id}"
+        while True:
+            try:
+                async with websockets.connect(url, max_size=None) as ws:
+                    self.connections[backend.name] = True
+                    delay = WS_RECONNECT_MIN
+                    logger.info("ComfyUI 웹소켓 연결됨", extra={"backend": backend.name, "url": url})
+                    await self._reconcile(backend)
+                    async for message in ws:
+                        if isinstance(message, str):
+                            self.handle_message(json.loads(message), backend)
+                        else:
+                            self.handle_binary(message, backend)
+            except asyncio.CancelledError:
+                raise
+            except (ConnectionClosed, Exception) as e:
+                logger.warning("ComfyUI 웹소켓 연결 끊김", extra={"backend": backend.name, "error": str(e)})
+            finally:
+                self.connections[backend.name] = False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WS_RECONNECT_MAX)
+
+    async def _reconcile(self, backend: Backend):
+        # 연결이 끊긴 동안 끝난 작업 상태를 /history로 보정
+        for job in [j for j in self.jobs.values() if not j.finished and j.backend == backend.name]:
+            await self.refresh_from_history(job.prompt_id)
+
+    # 상태 변경 리스너 (웹소켓 팬아웃 등) - 이벤트 루프를 막지 않도록 동기 함수만 등록
+    def add_listener(self, listener: Callable[[str, Job, Dict[str, Any]], None]):
+        self.listeners.append(listener)
+
+    def _emit(self, event: str, job: Job, data: Dict[str, Any]):
+        for listener in self.listeners:
+            try:
+                listener(event, job, data)
+            except Exception as e:
+                logger.exception("작업 이벤트 처리 오류", extra={"event": event, "prompt_id": job.prompt_id})
+
+    def handle_message(self, message: Dict[str, Any], backend: Optional[Backend] = None):
+        backend = backend or pool.default
+        data = message.get("data") or {}
+        msg_type = message.get("type")
+
+        if msg_type == "status":
+            # ComfyUI 대기열 길이 (라우팅에 사용)
+            exec_info = (data.get("status") or {}).get("exec_info") or {}
+            backend.queue_remaining = exec_info.get("queue_remaining", backend.queue_remaining)
+            return
+
+        prompt_id = data.get("prompt_id")
+        if not prompt_id:
+            return
+        prompt_id = self.aliases.get(prompt_id, prompt_id)
+        job = self._get_or_create(prompt_id)
+        if job.finished:
+            # 취소한 뒤 ComfyUI가 보내는 남은 메시지
+            return
+        job.backend = job.backend or backend.name
+
+        if msg_type == "execution_start":
+            self.current_prompt_ids[backend.name] = prompt_id
+            job.status = "running"
+            job.started_at = time.time()
+        elif msg_type == "execution_cached":
+            job.add_cached_nodes(data.get("nodes"))
+        elif msg_type == "executing":
+            job.enter_node(data.get("node"))
+            if data.get("node") is None:
+                self._complete(job)
+            else:
+                self.current_prompt_ids[backend.name] = prompt_id
+                job.status = "running"
+                job.started_at = job.started_at or time.time()
+                job.node = data["node"]
+                # 진행률은 노드 단위로 다시 시작
+                job.progress = {"value": 0, "max": 0}
+        elif msg_type == "progress":
+            job.node = data.get("node", job.node)
+            job.progress = {"value": data.get("value", 0), "max": data.get("max", 0)}
+        elif msg_type == "executed":
+            job.add_images(data.get("output") or {}, data.get("node"))
+        elif msg_type == "execution_success":
+            self._complete(job)
+        elif msg_type == "execution_error":
+            self._finish(job, "failed", data.get("exception_message") or "실행 오류")
+        elif msg_type == "execution_interrupted":
+            self._finish(job, "interrupted")
+        else:
+            return
+        self._emit(msg_type, job, data)
+        job.touch()
+
+    def handle_binary(self, data: bytes, backend: Optional[Backend] = None):
+        # 미리보기 프레임에는 prompt_id가 없으므로 해당 백엔드에서 실행 중인 작업으로 간주
+        prompt_id = self.current_prompt_ids.get((backend or pool.default).name)
+        job = self.jobs.get(prompt_id) if prompt_id else None
+        if job is not None and not job.finished:
+            self._emit("preview", job, {"image": data, "node": job.node})
+
+    # 공유 작업에서 요청자 한 명이 빠짐 (작업은 계속 실행, 그 요청자에게만 알림)
+    def withdraw(self, prompt_id: str, client_id: str, reason: str):
+        job = self.jobs.get(prompt_id)
+        if job is not None and not job.finished:
+            self._emit("withdrawn", job, {"client_id": client_id, "reason": reason})
+
+    def _finish(self, job: Job, status: str, error: Optional[str] = None):
+        if job.finished:
+            return
+        job.enter_node(None)
+        job.status = status
+        job.error = error
+        job.node = None
+        job.finished_at = time.time()
+        if job.backend and self.current_prompt_ids.get(job.backend) == job.prompt_id:
+            del self.current_prompt_ids[job.backend]
+        self._emit("finished", job, {})
+        job.touch()
+
+    def _complete(self, job: Job):
+        if job.finished or job.prompt_id in self._completing:
+            return
+        if job.images:
+            self._finish(job, "completed")
+        else:
+            # executed 메시지를 놓친 경우 결과 이미지를 /history에서 한 번만 보충
+            self._completing.add(job.prompt_id)
+            asyncio.create_task(self._complete_from_history(job))
+
+    async def _complete_from_history(self, job: Job):
+        try:
+            await self.refresh_from_history(job.prompt_id)
+        finally:
+            self._completing.discard(job.prompt_id)
+            self._finish(job, "completed")
+
+    def _upstream_id(self, prompt_id: str) -> str:
+        job = self.jobs.get(prompt_id)
+        return job.upstream_id if job is not None else prompt_id
+
+    def apply_history(self, prompt_id: str, history: Dict[str, Any]) -> Optional[Job]:
+        entry = history.get(prompt_id) or history.get(self._upstream_id(prompt_id))
+        if not entry:
+            return None
+        job = self._get_or_create(prompt_id)
+        for node_id, output in (entry.get("outputs") or {}).items():
+            job.add_images(output, node_id)
+        status = entry.get("status") or {}
+        if status.get("completed"):
+            self._finish(job, "completed")
+        elif status.get("status_str") == "error":
+            self._finish(job, "failed", "실행 오류")
+        job.touch()
+        return job
+
+    async def refresh_from_history(self, prompt_id: str) -> Optional[Job]:
+        job = self.jobs.get(prompt_id)
+        if job is not None and job.status == "pending":
+            # 아직 미들웨어 대기열에 있는 작업
+            return job
+        client = pool.get(job.backend if job is not None else None).client
+        try:
+            history = await client.get_json(f"/history/{self._upstream_id(prompt_id)}", timeout=COMFY_HISTORY_TIMEOUT)
+        except Exception as e:
+            logger.warning("히스토리 보정 오류", extra={"prompt_id": prompt_id, "error": str(e)})
+            return self.get(prompt_id)
+        return self.apply_history(prompt_id, history) or self.get(prompt_id)
+
+
+tracker = JobTracker()
@@ -0,0 +1,84 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
+import stat
+from typing import Dict, List, Optional
+
+from config import COMFY_OUTPUT_DIR, COMFY_TEMP_DIR, COMFY_LOCAL_BACKEND
+from backend_pool import pool
+from image_cache import ImageEntry
+from log import get_logger
+
+
+logger = get_logger("local_outputs")
+
+
+# ComfyUI 출력 폴더 직접 읽기
+# - 미들웨어가 ComfyUI와 같은 호스트에 있거나 출력 폴더를 마운트한 경우 /view 다운로드 없이 파일을 바로 응답
+# - filename / subfolder / type을 출력(output) / 임시(temp) 폴더 아래 경로로 변환, 폴더 밖을 가리키면 거부
+# - 파일이 없으면 None을 반환하고 호출한 쪽에서 HTTP /view로 가져옴
+class LocalOutputs:
+    def __init__(self, output_dir: str = COMFY_OUTPUT_DIR, temp_dir: str = COMFY_TEMP_DIR,
+                 backend: str = COMFY_LOCAL_BACKEND):
+        self.roots: Dict[str, str] = {
+            folder_type: os.path.realpath(root)
+            for folder_type, root in (("output", output_dir), ("temp", temp_dir)) if root
+        }
+        self.backend = backend or pool.default.name
+        self.stats = {"hits": 0, "misses": 0, "rejected": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.roots)
+
+    def resolve(self, filename: str, subfolder: str, folder_type: str) -> Optional[str]:
+        root = self.roots.get(folder_type)
+        if root is None:
+            return None
+        # 파일 이름에는 경로를 넣을 수 없고, 심볼릭 링크를 따라간 최종 경로도 폴더 안이어야 함
+        if not filename or os.path.basename(filename) != filename or filename in (".", ".."):
+            self.stats["rejected"] += 1
+            return None
+        try:
+            path = os.path.realpath(os.path.join(root, subfolder or "", filename))
+        except ValueError:
+            # 경로에 NUL 문자
+            self.stats["rejected"] += 1
+            return None
+        if os.path.commonpath([root, path]) != root:
+            self.stats["rejected"] += 1
+            logger.warning("출력 폴더 밖 경로 요청", extra={"image": filename, "subfolder": subfolder,
+                                                     "folder": folder_type})
+            return None
+        return path
+
+    def _entry(self, filename: str, subfolder: str, folder_types: List[str]) -> Optional[ImageEntry]:
+        for folder_type in folder_types:
+            path = self.resolve(filename, subfolder, folder_type)
+            if path is None:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            # 내용 해시 대신 경로 / 크기 / 수정 시간으로 ETag 결정 (파일을 읽지 않음)
+            etag = hashlib.sha256(f"{path}:{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()
+            media_type = mimetypes.guess_type(filename)[0] or "image/png"
+            key = f"local/{folder_type}/{subfolder}/{filename}"
+            return ImageEntry(key, etag, st.st_size, media_type, path)
+        return None
+
+    async def get(self, filename: str, subfolder: str, folder_types: List[str],
+                  backend: Optional[str] = None) -> Optional[ImageEntry]:
+        # 다른 백엔드가 만든 이미지는 이 폴더에 없음
+        if not self.enabled or (backend and backend != self.backend):
+            return None
+        entry = await asyncio.to_thread(self._entry, filename, subfolder, folder_types)
+        self.stats["hits" if entry is not None else "misses"] += 1
+        return entry
+
+
+local_outputs = LocalOutputs()
@@ -0,0 +1,78 @@
+import json
+import logging
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+
+from config import LOG_LEVEL, LOG_FORMAT
+
+
+# 요청 단위 추적 ID (HTTP 미들웨어에서 설정, 로그와 ComfyUI extra_data에 전달)
+trace_id_var: ContextVar[str] = ContextVar("trace_id", default="-")
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class _TraceFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "trace_id"):
+            record.trace_id = trace_id_var.get()
+        return True
+
+
+# key=value 형식의 extra 필드를 메시지 뒤에 붙임
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "trace_id"}
+
+
+def _fields(record: logging.LogRecord):
+    return {k: v for k, v in vars(record).items() if k not in _RESERVED}
+
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        timestamp = time.strftime("%H:%M:%S", time.localtime(record.created))
+        fields = " ".join(f"{k}={v}" for k, v in _fields(record).items())
+        line = f"{timestamp} {record.levelname:<7} [{record.trace_id}] {record.name}: {record.getMessage()}"
+        if fields:
+            line += f" {fields}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "trace_id": record.trace_id,
+            "msg": record.getMessage(),
+            **_fields(record),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# 로그 설정 (LOG_LEVEL=OFF면 전부 끔)
+def setup_logging():
+    root = logging.getLogger("middleware")
+    if root.handlers:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.addFilter(_TraceFilter())
+    handler.setFormatter(_JsonFormatter() if LOG_FORMAT == "json" else _TextFormatter())
+    root.addHandler(handler)
+    root.propagate = False
+    if LOG_LEVEL == "OFF":
+        root.disabled = True
+    else:
+        root.setLevel(LOG_LEVEL)
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"middleware.{name}")
@@ -1,16 +1,81 @@
-from fastapi import FastAPI, HTTPException, Response
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 import uuid
 import json
-import urllib.request
-import urllib.parse
-from pydantic import BaseModel
-from typing import Dict, Any, Optional, List
+import logging
+from pydantic import BaseModel, ValidationError
+from typing import Optional, List
 import os
 import random
 import asyncio
+import time
 
-app = FastAPI()
+import httpx
+
+from config import (
+    WORKFLOW_DIR,
+    COMFY_PROMPT_TIMEOUT,
+    COMFY_HISTORY_TIMEOUT,
+    COMFY_VIEW_TIMEOUT,
+    JOB_WAIT_TIMEOUT,
+    JOB_DEADLINE,
+    JOB_FALLBACK_POLL,
+    SSE_KEEPALIVE,
+    BATCH_MAX_ITEMS,
+    EVENT_LOOP_LAG_INTERVAL,
+    PROFILE_SAMPLES,
+)
+from backend_pool import pool
+from workflow_registry import registry, WorkflowError, WorkflowNotFound
+from job_tracker import tracker, FINISHED
+from job_store import job_store, decode_cursor
+from connection_manager import manager
+from cancellation import cancellations, SharedJobError
+from scheduler import scheduler, QueuedJob, AdmissionError
+from batch_manager import batches, plan_variants
+from result_cache import result_cache, graph_hash
+from image_cache import image_cache, image_response, ImageNotFound
+from local_outputs import local_outputs
+from resilience import CircuitOpenError
+from profiler import profiler
+from image_derivatives import derivatives, negotiate_format, snap_width, clamp_quality
+from log import setup_logging, get_logger, new_trace_id, trace_id_var
+import metrics
+from metrics import Gauge, HTTP_DURATION
+
+setup_logging()
+logger = get_logger("main")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # ComfyUI 웹소켓 구독 시작 (작업 상태 추적 + 브라우저 팬아웃)
+    tracker.add_listener(manager.on_job_event)
+    tracker.add_listener(scheduler.on_job_event)
+    tracker.add_listener(metrics.on_job_event)
+    tracker.add_listener(job_store.on_job_event)
+    tracker.add_listener(cancellations.on_job_event)
+    tracker.add_listener(profiler.on_job_event)
+    await job_store.start()
+    # 노드 프로파일은 저장소의 최근 완료 작업으로 복원
+    recent, _ = await job_store.list(status="completed", limit=PROFILE_SAMPLES)
+    profiler.load(reversed(recent))
+    await pool.start()
+    await tracker.start()
+    await scheduler.start(send_queued_job)
+    lag_monitor = asyncio.create_task(metrics.monitor_event_loop(EVENT_LOOP_LAG_INTERVAL))
+    yield
+    lag_monitor.cancel()
+    await scheduler.stop()
+    await tracker.stop()
+    derivatives.shutdown()
+    # 상태 확인 중지 + 백엔드별 HTTP 커넥션 풀 정리
+    await pool.stop()
+    job_store.close()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,209 +83,741 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id"],
 )
 
-COMFY_SERVER = "http://192.168.1.133:8188"
+# 요청마다 추적 ID 설정 (X-Trace-Id 헤더가 있으면 그대로 사용) + 처리 시간 기록
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    trace_id = request.headers.get("x-trace-id") or new_trace_id()
+    token = trace_id_var.set(trace_id)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Trace-Id"] = trace_id
+        return response
+    finally:
+        # 경로 파라미터가 들어간 URL 대신 라우트 템플릿으로 기록 (라벨 수 제한)
+        route = request.scope.get("route")
+        HTTP_DURATION.observe(time.perf_counter() - started, method=request.method,
+                              route=getattr(route, "path", "unmatched"), status=status)
+        trace_id_var.reset(token)
+
+# 수집 시점에 계산하는 메트릭 (대기열 / 백엔드 / 캐시 상태)
+Gauge("middleware_queue_depth", "미들웨어 대기열에 있는 작업 수",
+      callback=lambda: [((), scheduler.depth)])
+Gauge("middleware_jobs_inflight", "ComfyUI에 제출되어 실행 중인 작업 수", ["backend"],
+      callback=lambda: [((b.name,), b.inflight) for b in pool.backends.values()])
+Gauge("middleware_backend_healthy", "백엔드 상태 (1: 정상)", ["backend"],
+      callback=lambda: [((b.name,), int(b.healthy)) for b in pool.backends.values()])
+Gauge("middleware_backend_circuit_open", "백엔드 서킷 상태 (1: 차단 중)", ["backend"],
+      callback=lambda: [((b.name,), int(b.client.breaker.is_open)) for b in pool.backends.values()])
+Gauge("middleware_backend_queue_remaining", "ComfyUI가 알려준 대기열 길이", ["backend"],
+      callback=lambda: [((b.name,), b.queue_remaining) for b in pool.backends.values()])
+Gauge("middleware_cache_requests_total", "캐시 조회 결과별 횟수", ["cache", "result"], kind="counter",
+      callback=lambda: [((name, result), count)
+                        for name, stats in (("image", image_cache.stats), ("derivative", derivatives.stats),
+                                            ("result", result_cache.stats), ("local", local_outputs.stats))
+                        for result, count in stats.items()])
 
 class PromptRequest(BaseModel):              
     prompt_text: str  # 텍스트 프롬프트
     workflow_name: str = "0404test" 
     client_id: Optional[str] = None
     seed: Optional[int] = None  # 옵션: 시드값
+    priority: str = "normal"  # 우선순위: high / normal / low
+    use_cache: bool = True  # False면 같은 요청의 결과 캐시 / 실행 중인 작업을 재사용하지 않음
+    timeout: Optional[float] = None  # 제한 시간 (초): 지나면 대기 / 실행 중이어도 취소
+    outputs: Optional[List[str]] = None  # 받을 출력 ("raw", "background-removed", 노드 ID): 필요한 노드만 실행
 
-workflow_dir = "workflow"
-os.makedirs(workflow_dir, exist_ok=True)
+# 배치 생성 요청: prompts × 시드 (seeds 목록 또는 seed_start부터 count개, 둘 다 없으면 랜덤 시작 시드)
+# 시드를 지정하면 이미지마다 작업을 따로 제출, 랜덤 시드일 때만 batch_size로 묶음
+class BatchRequest(BaseModel):
+    prompts: List[str] = []
+    prompt_text: Optional[str] = None
+    workflow_name: str = "0404test"
+    client_id: Optional[str] = None
+    seeds: Optional[List[int]] = None
+    seed_start: Optional[int] = None
+    count: int = 1
+    pack: bool = True  # 가능하면 batch_size로 묶어서 한 번에 생성
+    priority: str = "normal"
+    timeout: Optional[float] = None  # 작업별 제한 시간 (초)
+    outputs: Optional[List[str]] = None
 
-# 워크플로우 호출
-def load_workflow(workflow_name="0404test"):
-    workflow_path = os.path.join(workflow_dir, f"{workflow_name}.json")
-    print(f"워크플로우 로드 경로: {workflow_path}")
+os.makedirs(WORKFLOW_DIR, exist_ok=True)
 
+# 워크플로우 호출 (파싱된 템플릿은 레지스트리에 캐시됨)
+# outputs를 지정하면 그 출력에 필요한 노드만 남긴 템플릿 사용
+def load_workflow(workflow_name="0404test", outputs=None):
     try:
-        if os.path.exists(workflow_path):
-            with open(workflow_path, 'r', encoding="utf-8") as f:
-                workflow = json.load(f)
-                print(f"워크플로우 노드 목록: {list(workflow.keys())}")
-                return workflow
-        else:
-            raise HTTPException(status_code=404, detail=f"워크플로우 '{workflow_name}'를 찾을 수 없습니다.")
-    except Exception as e:
-        print(f"워크플로우 로드 오류: {str(e)}")
+        template = registry.get(workflow_name)
+    except WorkflowNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except (WorkflowError, ValueError, OSError) as e:
+        logger.error("워크플로우 로드 오류", extra={"workflow": workflow_name, "error": str(e)})
         raise HTTPException(status_code=500, detail=f"워크플로우 로드 오류: {str(e)}")
+    try:
+        return template.select(outputs)
+    except WorkflowError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# ComfyUI 호출 오류를 HTTP 응답으로 변환
+# 서킷이 열려 있으면 503 + Retry-After (클라이언트가 동시에 다시 몰리지 않게), 타임아웃은 504, 나머지 연결 / 응답 오류는 502
+def upstream_error(e: Exception, message: str) -> HTTPException:
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, CircuitOpenError):
+        return HTTPException(status_code=503, detail=f"{message}: {str(e)}",
+                             headers={"Retry-After": str(e.retry_after)})
+    if isinstance(e, httpx.TimeoutException):
+        return HTTPException(status_code=504, detail=f"{message}: ComfyUI 응답 시간 초과")
+    if isinstance(e, httpx.HTTPError):
+        return HTTPException(status_code=502, detail=f"{message}: {str(e)}")
+    return HTTPException(status_code=500, detail=f"{message}: {str(e)}")
 
 # CompyUI에 이미지 생성 요청
-def queue_prompt(prompt, client_id=None):
+# 실행 메시지를 트래커 웹소켓으로 받기 위해 기본적으로 트래커의 client_id로 제출
+# 추적 ID는 client_id 대신 extra_data로 전달 (ComfyUI 히스토리에 함께 남음)
+async def queue_prompt(prompt, client_id=None, prompt_id=None, backend=None, trace_id=None):
     if not client_id:
-        client_id = str(uuid.uuid4())
+        client_id = tracker.client_id
     
     p = {
         "prompt": prompt,
         "client_id": client_id
     }
-    
-    data = json.dumps(p).encode("utf-8")
-    req = urllib.request.Request(f"{COMFY_SERVER}/prompt", data=data, method="POST")
+    if prompt_id:
+        # 미들웨어에서 정한 prompt_id 사용 (대기열 단계부터 같은 ID로 추적)
+        p["prompt_id"] = prompt_id
+    if trace_id:
+        p["extra_data"] = {"trace_id": trace_id}
 
     try:
-        with urllib.request.urlopen(req) as res:
-            return json.loads(res.read())
+        return await (backend or pool.default).client.post_json("/prompt", p, timeout=COMFY_PROMPT_TIMEOUT)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code >= 500:
+            raise upstream_error(e, "ComfyUI 서버 오류")
+        # 워크플로우 검증 실패(prompt_outputs_failed_validation) 등 요청 자체의 문제
+        # 상태 코드와 ComfyUI 응답 본문(node_errors 포함)을 그대로 전달
+        raise HTTPException(status_code=e.response.status_code, detail=f"ComfyUI 요청 오류: {e.response.text}")
     except Exception as e:
         # 에러 발생
-        raise HTTPException(status_code=500, detail=f"ComfyUI 서버 오류: {str(e)}")
+        raise upstream_error(e, "ComfyUI 서버 오류")
 
 # 이미지 가져오기
-def fetch_image(filename, subfolder, folder_type):
+async def fetch_image(filename, subfolder, folder_type, backend=None):
     try:
         data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
-        url_values = urllib.parse.urlencode(data)
-        url = f"{COMFY_SERVER}/view?{url_values}"
-        print(f"이미지 요청 URL: {url}")
-        with urllib.request.urlopen(url) as response:
-            return response.read()
+        logger.debug("이미지 요청", extra={"image": filename, "folder": folder_type})
+        return await (backend or pool.default).client.get_bytes("/view", params=data, timeout=COMFY_VIEW_TIMEOUT)
     except Exception as e:
-        print(f"이미지 가져오기 오류 상세: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"이미지 가져오기 오류: {str(e)}")
+        logger.warning("이미지 가져오기 오류", extra={"image": filename, "error": str(e)})
+        raise upstream_error(e, "이미지 가져오기 오류")
         
 # 히스토리 데이터 가져오기
-def fetch_history(prompt_id):
+# 작업을 실행한 백엔드에 요청
+async def fetch_history(prompt_id=None):
     try:
-        url = f"{COMFY_SERVER}/history/{prompt_id}"
-        print(f"히스토리 요청 URL: {url}")
-        with urllib.request.urlopen(url) as response:
-            return json.loads(response.read())
+        job = tracker.get(prompt_id) if prompt_id else None
+        backend = pool.get(job.backend if job is not None else None)
+        if job is not None:
+            prompt_id = job.upstream_id
+        path = f"/history/{prompt_id}" if prompt_id else "/history"
+        logger.debug("히스토리 요청", extra={"backend": backend.name, "path": path})
+        return await backend.client.get_json(path, timeout=COMFY_HISTORY_TIMEOUT)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"히스토리 데이터 가져오기 오류: {str(e)}")
+        raise upstream_error(e, "히스토리 데이터 가져오기 오류")
+
+# 스케줄러가 대기열에서 꺼낸 작업을 ComfyUI에 제출
+# 백엔드는 스케줄러가 선택 (실패하면 스케줄러가 다른 백엔드로 다시 호출)
+async def send_queued_job(job: QueuedJob, backend):
+    tracked = tracker.get(job.prompt_id)
+    trace_id = tracked.trace_id if tracked is not None else None
+    result = await queue_prompt(job.workflow, prompt_id=job.prompt_id, backend=backend, trace_id=trace_id)
+    tracker.alias(result["prompt_id"], job.prompt_id)
+    return result
+
+# 워크플로우에 프롬프트/시드를 주입해서 스케줄러 대기열에 등록하고 작업 추적 시작
+async def submit_prompt(request: PromptRequest):
+    # 워크플로우 템플릿 로드
+    template = load_workflow(request.workflow_name, request.outputs)
+
+    # 시드 설정 (없으면 랜덤 시드 생성)
+    seed = request.seed if request.seed is not None else random.randint(1, 9999999999)
+
+    # 프롬프트/시드를 주입한 요청용 복사본 생성
+    workflow = template.render(prompt_text=request.prompt_text, seed=seed)
+
+    logger.info("이미지 생성 요청", extra={"workflow": request.workflow_name, "seed": seed})
+    logger.debug("프롬프트", extra={"prompt_text": request.prompt_text})
+
+    client_id = request.client_id or f"api_{uuid.uuid4()}"
+
+    # 같은 그래프의 작업이 실행 중이면 합치고, 완료된 결과가 있으면 바로 반환
+    key = graph_hash(request.workflow_name, workflow)
+    if request.use_cache:
+        job, cached = result_cache.lookup(key)
+        if job is not None:
+            logger.info("작업 재사용", extra={"prompt_id": job.prompt_id, "cached": cached})
+            # 실행 중인 작업에 합쳐지면 요청자로 등록 (다른 요청자의 취소로 끊기지 않게)
+            cancellations.join(job.prompt_id, client_id)
+            cancellations.set_deadline(job.prompt_id, client_id, request.timeout or JOB_DEADLINE)
+            position = scheduler.position(job.prompt_id) or {}
+            return {
+                "prompt_id": job.prompt_id,
+                "client_id": client_id,
+                "seed": seed,
+                "status": job.status,
+                "position": position.get("position"),
+                "estimated_start": position.get("estimated_start"),
+                "cached": cached,
+                "deduplicated": not cached,
+                "images": job.images,
+            }
+
+    prompt_id = str(uuid.uuid4())
+
+    # 작업 상태 추적 등록 후 대기열에 추가 (초과 시 429)
+    tracker.register(prompt_id, client_id, request.workflow_name, seed, status="pending",
+                     prompt_text=request.prompt_text, node_types=template.node_types)
+    try:
+        scheduler.submit(QueuedJob(prompt_id, client_id, request.workflow_name, workflow,
+                                   request.priority, models=template.models))
+    except AdmissionError as e:
+        tracker.discard(prompt_id)
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except ValueError as e:
+        tracker.discard(prompt_id)
+        raise HTTPException(status_code=400, detail=str(e))
+    result_cache.remember(key, prompt_id)
+    cancellations.join(prompt_id, client_id)
+    cancellations.set_deadline(prompt_id, client_id, request.timeout or JOB_DEADLINE)
+
+    position = scheduler.position(prompt_id) or {}
+    return {
+        "prompt_id": prompt_id,
+        "client_id": client_id,
+        "seed": seed,
+        "status": "pending",
+        "position": position.get("position"),
+        "estimated_start": position.get("estimated_start"),
+        "cached": False,
+        "deduplicated": False,
+    }
+
+# 배치 요청을 작업 여러 개로 나눠서 한 번에 대기열에 등록
+async def submit_batch(request: BatchRequest):
+    prompts = list(request.prompts)
+    if request.prompt_text:
+        prompts.insert(0, request.prompt_text)
+    if not prompts:
+        raise HTTPException(status_code=400, detail="prompts 또는 prompt_text가 필요합니다.")
+    count = len(request.seeds) if request.seeds else request.count
+    if count < 1:
+        raise HTTPException(status_code=400, detail="count는 1 이상이어야 합니다.")
+    if len(prompts) * count > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"배치 하나에 최대 {BATCH_MAX_ITEMS}장까지 요청할 수 있습니다.")
+
+    template = load_workflow(request.workflow_name, request.outputs)
+    packable = request.pack and bool(template.batch_slots)
+    variants = plan_variants(prompts, count, request.seeds, request.seed_start, packable)
+
+    client_id = request.client_id or f"api_{uuid.uuid4()}"
+    queued = []
+    prompt_texts = {}
+    for prompt_text, seed, batch_size in variants:
+        workflow = template.render(prompt_text=prompt_text, seed=seed,
+                                   batch_size=batch_size if packable else None)
+        prompt_id = str(uuid.uuid4())
+        job = tracker.register(prompt_id, client_id, request.workflow_name, seed, status="pending",
+                               prompt_text=prompt_text, node_types=template.node_types)
+        job.batch_size = batch_size
+        prompt_texts[prompt_id] = prompt_text
+        queued.append(QueuedJob(prompt_id, client_id, request.workflow_name, workflow,
+                                request.priority, models=template.models))
+
+    batch = batches.create(client_id, request.workflow_name, list(prompt_texts), prompt_texts)
+    for queued_job in queued:
+        tracker.get(queued_job.prompt_id).batch_id = batch.batch_id
+
+    try:
+        scheduler.submit_many(queued)
+    except (AdmissionError, ValueError) as e:
+        for queued_job in queued:
+            tracker.discard(queued_job.prompt_id)
+        batches.discard(batch.batch_id)
+        if isinstance(e, AdmissionError):
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+        raise HTTPException(status_code=400, detail=str(e))
+
+    for queued_job in queued:
+        cancellations.join(queued_job.prompt_id, client_id)
+        cancellations.set_deadline(queued_job.prompt_id, client_id, request.timeout or JOB_DEADLINE)
+    logger.info("배치 등록", extra={"batch_id": batch.batch_id, "prompts": len(prompts),
+                                    "count": count, "jobs": len(queued)})
+    return {
+        "batch_id": batch.batch_id,
+        "client_id": client_id,
+        "workflow_name": request.workflow_name,
+        "total": len(prompts) * count,
+        "packed": any(size > 1 for _, _, size in variants),
+        "jobs": [
+            # seed_mode: seed (이 시드로 이미지 하나) / batch_index (이 시드의 batch_index 0..batch_size-1)
+            {"prompt_id": pid, "prompt_text": text, "seed": seed, "batch_size": size,
+             "seed_mode": "batch_index" if size > 1 else "seed"}
+            for pid, (text, seed, size) in zip(prompt_texts, variants)
+        ],
+    }
 
 # 엔드포인트
 # 이미지 생성
 @app.post('/api/generate-image')
 async def generate_image(request: PromptRequest):
     try:
-        # 워크플로우 로드
-        workflow = load_workflow(request.workflow_name)
-        
-        # 프롬프트 텍스트 적용
-        workflow["4"]["inputs"]["text"] = request.prompt_text
-        
-        # 시드 설정 (제공된 경우)
-        if request.seed is not None:
-            workflow["11"]["inputs"]["seed"] = request.seed
-        else:
-            # 랜덤 시드 생성
-            workflow["11"]["inputs"]["seed"] = random.randint(1, 9999999999)
-        
-        print(f"워크플로우 로드: {request.workflow_name}, 프롬프트: {request.prompt_text}")
-        
-        # SaveImage 노드가 있는지 확인 (이미 워크플로우에 있으므로 추가 필요 없음)
-        print("SaveImage 노드 확인:", "12" in workflow)
-
-        # ComfyUI에 요청 보내기
-        client_id = request.client_id or f"api_{uuid.uuid4()}"
-        result = queue_prompt(workflow, client_id)
-        return result
+        return await submit_prompt(request)
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"이미지 생성 오류 상세: {str(e)}")
+        logger.exception("이미지 생성 오류")
         raise HTTPException(status_code=500, detail=f"이미지 생성 오류: {str(e)}")
 
 
-@app.get('/api/image')
-async def get_image_preview(filename: str, subfolder: str = "", folder_type: str = "output"):
+# 배치 이미지 생성 (프롬프트 여러 개 / 시드 범위)
+@app.post('/api/generate-batch')
+async def generate_batch(request: BatchRequest):
     try:
-        print(f"이미지 요청: filename={filename}, subfolder={subfolder}, folder_type={folder_type}")
-        
-        # 여러 폴더 타입 시도
-        folder_types_to_try = [folder_type]  # 우선 요청된 타입부터 시도
-        
-        # 요청된 타입이 output이나 temp가 아니면 둘 다 추가로 시도
-        if folder_type != "output":
-            folder_types_to_try.append("output")
-        if folder_type != "temp":
-            folder_types_to_try.append("temp")
-            
-        # 요청된 타입이 빈 문자열이면 기본값으로 output 사용
-        if folder_type == "":
-            folder_types_to_try = ["output", "temp"]
-        
-        for type_to_try in folder_types_to_try:
-            try:
-                data = {"filename": filename, "subfolder": subfolder, "type": type_to_try}
-                url_values = urllib.parse.urlencode(data)
-                print('이미지 값', url_values)
-                full_url = f"{COMFY_SERVER}/view?{url_values}"
-                print(f"시도 중: {full_url}")
-                
-                with urllib.request.urlopen(full_url) as response:
-                    image_data = response.read()
-                    print(f"이미지 로드 성공 ({type_to_try}): {len(image_data)} 바이트")
-                    return Response(content=image_data, media_type="image/png")
-            except urllib.error.HTTPError as e:
-                print(f"{type_to_try} 폴더에서 이미지를 찾지 못했습니다: {e.code} {e.reason}")
-                continue
-                
-        # 모든 시도 실패
-        raise HTTPException(status_code=404, detail="이미지를 찾을 수 없습니다")
-                
+        return await submit_batch(request)
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"이미지 호출 상세 오류: {str(e)}")
-        
-        # 사용 가능한 파일 목록 확인 시도
+        logger.exception("배치 생성 오류")
+        raise HTTPException(status_code=500, detail=f"배치 생성 오류: {str(e)}")
+
+
+# 워크플로우 정보 (주입 슬롯 / 선택 가능한 출력)
+@app.get('/api/workflows/{workflow_name}')
+async def get_workflow(workflow_name: str):
+    return load_workflow(workflow_name).describe()
+
+
+# 이미지 미리보기 (로컬 캐시 우선, ETag / Range 지원)
+# width / format / quality를 지정하면 변환본(썸네일, WebP·JPEG·AVIF)을 반환
+# format=auto 또는 width만 지정하면 Accept 헤더로 포맷 결정
+@app.api_route('/api/image', methods=["GET", "HEAD"])
+async def get_image_preview(
+    request: Request,
+    filename: str,
+    subfolder: str = "",
+    folder_type: str = "output",
+    width: Optional[int] = None,
+    image_format: Optional[str] = Query(None, alias="format"),
+    quality: Optional[int] = None,
+    backend: Optional[str] = None,
+):
+    # 여러 폴더 타입 시도 (요청된 타입부터, 빈 문자열이면 output/temp)
+    folder_types_to_try = [folder_type] if folder_type else []
+    for type_to_try in ("output", "temp"):
+        if type_to_try not in folder_types_to_try:
+            folder_types_to_try.append(type_to_try)
+
+    # ComfyUI 출력 폴더를 직접 읽을 수 있으면 파일을 그대로 응답, 없으면 캐시 / HTTP /view
+    entry = await local_outputs.get(filename, subfolder, folder_types_to_try, backend)
+    if entry is None:
         try:
-            # 최근 프롬프트 ID 가져오기
-            with urllib.request.urlopen(f"{COMFY_SERVER}/history") as response:
-                history_data = json.loads(response.read())
-                prompt_ids = list(history_data.keys())
-                
-                if prompt_ids:
-                    latest_prompt_id = prompt_ids[-1]
-                    print(f"최근 프롬프트 ID: {latest_prompt_id}")
-                    
-                    # 최근 이미지 정보 가져오기
-                    prompt_info = history_data[latest_prompt_id]
-                    if "outputs" in prompt_info:
-                        for node_id, output in prompt_info["outputs"].items():
-                            if "images" in output:
-                                print(f"노드 {node_id}의 이미지들:")
-                                for img in output["images"]:
-                                    print(f"  - {img['filename']} (타입: {img['type']}, 폴더: {img['subfolder']})")
-        except Exception as hist_error:
-            print(f"히스토리 정보 확인 중 오류: {str(hist_error)}")
-            
-        raise HTTPException(status_code=500, detail=f"이미지 호출 오류: {str(e)}")
+            # 이미지를 만든 백엔드부터, 없으면 나머지 백엔드 순서로 조회
+            entry = await image_cache.get(filename, subfolder, folder_types_to_try, pool.ordered(backend))
+        except ImageNotFound:
+            raise HTTPException(status_code=404, detail="이미지를 찾을 수 없습니다")
+        except Exception as e:
+            logger.warning("이미지 호출 오류", extra={"image": filename, "error": str(e)})
+            raise upstream_error(e, "이미지 호출 오류")
+
+    # 원본 요청
+    if width is None and image_format is None and quality is None:
+        return image_response(entry, request.headers, image_cache)
+
+    try:
+        fmt = negotiate_format(image_format, request.headers.get("accept", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        derived = await derivatives.get(entry, fmt, snap_width(width), clamp_quality(quality))
+    except Exception as e:
+        logger.exception("이미지 변환 오류", extra={"image": filename})
+        raise HTTPException(status_code=500, detail=f"이미지 변환 오류: {str(e)}")
+
+    response = image_response(derived, request.headers, image_cache)
+    if image_format is None or image_format == "auto":
+        response.headers["Vary"] = "Accept"
+    return response
+
+# 작업 상태를 ComfyUI /history 항목 형식으로 변환
+def history_entry(job):
+    outputs = {}
+    for image in job.images:
+        node = image.get("node") or "0"
+        outputs.setdefault(node, {"images": []})["images"].append(
+            {"filename": image["filename"], "subfolder": image["subfolder"], "type": image["type"]})
+    status_str = {"completed": "success", "failed": "error"}.get(job.status, job.status)
+    return {
+        "outputs": outputs,
+        "status": {"status_str": status_str, "completed": job.status == "completed", "messages": []},
+        "job": job.to_dict(),
+    }
 
 #히스토리 데이터 가져오기
 @app.get('/api/history/{prompt_id}')
 async def get_prompt_history(prompt_id: str):
+    # 미들웨어가 제출한 작업은 ComfyUI를 호출하지 않고 트래커 / 작업 기록에서 응답
+    # (ComfyUI처럼 끝나지 않은 작업은 빈 객체)
+    job = tracker.get(prompt_id) or await job_store.get(prompt_id)
+    if job is not None:
+        return {prompt_id: history_entry(job)} if job.finished else {}
+
     try:
-        history_data = fetch_history(prompt_id)
+        history_data = await fetch_history(prompt_id)
         
 
         # 히스토리 데이터에서 이미지 정보 출력
         if prompt_id in history_data:
             prompt_info = history_data[prompt_id]
-            print("프롬프트 정보:", prompt_info)
-            if "outputs" in prompt_info:
-                print("이미지 출력 정보:")
+            tracker.apply_history(prompt_id, history_data)
+            if "outputs" in prompt_info and logger.isEnabledFor(logging.DEBUG):
                 for node_id, output in prompt_info["outputs"].items():
-                    if "images" in output:
-                        print(f"노드 {node_id}의 이미지들:")
-                        for img in output["images"]:
-                            print(f"  - {img['filename']} (타입: {img['type']}, 폴더: {img['subfolder']})")
+                    for img in output.get("images", []):
+                        logger.debug("이미지 출력", extra={"node": node_id, "image": img["filename"],
+                                                       "folder": img["type"], "subfolder": img["subfolder"]})
         
         return history_data
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"히스토리 호출 오류 상세: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"히스토리 호출 오류: {str(e)}")
+        logger.warning("히스토리 호출 오류", extra={"prompt_id": prompt_id, "error": str(e)})
+        raise upstream_error(e, "히스토리 호출 오류")
+
+# 대기열 현황 (위치 / 예상 시작 시간)
+@app.get('/api/queue')
+async def get_queue(client_id: Optional[str] = None):
+    return scheduler.snapshot(client_id)
+
+# 작업 상태 조회
+async def get_job_or_404(prompt_id: str):
+    job = tracker.get(prompt_id)
+    if job is None:
+        # 메모리에서 정리된 작업은 작업 기록에서 조회
+        job = await job_store.get(prompt_id)
+    if job is None:
+        # 미들웨어가 모르는 작업이면 ComfyUI 히스토리에서 한 번 확인
+        job = await tracker.refresh_from_history(prompt_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"작업 '{prompt_id}'를 찾을 수 없습니다.")
+    return job
+
+async def wait_job_update(job, version: int, timeout: float) -> bool:
+    if tracker.connected:
+        return await job.wait_update(version, timeout)
+    # 웹소켓이 끊긴 동안에는 히스토리를 느린 주기로 확인
+    updated = await job.wait_update(version, min(timeout, JOB_FALLBACK_POLL))
+    if not updated:
+        await tracker.refresh_from_history(job.prompt_id)
+    return job.version != version
+
+# 작업 목록 (갤러리 / 히스토리, 최신순 페이지네이션)
+# 다음 페이지는 응답의 next_cursor를 cursor로 전달
+@app.get('/api/jobs')
+async def list_jobs(
+    client_id: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+):
+    if status is not None and status not in FINISHED + ("running",):
+        raise HTTPException(status_code=400, detail=f"알 수 없는 상태입니다: {status}")
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="잘못된 cursor입니다.")
+    jobs, next_cursor = await job_store.list(client_id, status, limit, cursor)
+    # 실행 중인 작업은 트래커의 현재 상태로 표시
+    return {
+        "jobs": [(tracker.get(job.prompt_id) or job).to_dict() for job in jobs],
+        "next_cursor": next_cursor,
+    }
+
+@app.get('/api/jobs/{prompt_id}')
+async def get_job(prompt_id: str):
+    job = await get_job_or_404(prompt_id)
+    return job.to_dict()
+
+# 작업 취소 (미들웨어 대기열이면 제거, ComfyUI 대기열이면 삭제, 실행 중이면 interrupt)
+# 여러 요청자가 공유하는 작업은 client_id의 요청만 철회하고, 마지막 요청자일 때 취소
+@app.delete('/api/jobs/{prompt_id}')
+async def cancel_job(prompt_id: str, client_id: Optional[str] = None):
+    job = await get_job_or_404(prompt_id)
+    if job.finished:
+        raise HTTPException(status_code=409, detail=f"이미 끝난 작업입니다: {job.status}")
+    try:
+        await cancellations.withdraw(job.prompt_id, client_id)
+    except SharedJobError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return job.to_dict()
+
+# long-poll: 작업이 끝나면 즉시 응답, timeout이 지나면 현재 상태 반환
+# client_id를 주면 그 요청자의 관심으로 셈 (공유 작업에서 다른 요청자가 떠나도 영향 없음)
+@app.get('/api/jobs/{prompt_id}/wait')
+async def wait_job(prompt_id: str, timeout: float = JOB_WAIT_TIMEOUT, client_id: Optional[str] = None):
+    job = await get_job_or_404(prompt_id)
+    deadline = asyncio.get_running_loop().time() + min(timeout, 120.0)
+    with cancellations.watching([job.prompt_id], client_id):
+        while not job.finished:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            await wait_job_update(job, job.version, remaining)
+    return job.to_dict()
+
+# SSE: 상태가 바뀔 때마다 전송하고 작업이 끝나면 스트림 종료
+@app.get('/api/jobs/{prompt_id}/events')
+async def job_events(prompt_id: str, client_id: Optional[str] = None):
+    job = await get_job_or_404(prompt_id)
+
+    async def event_stream():
+        version = -1
+        # 스트림이 열려 있는 동안 관심 유지 (연결이 끊기면 자동 취소 대상)
+        with cancellations.watching([job.prompt_id], client_id):
+            while True:
+                if job.version != version:
+                    version = job.version
+                    event = "done" if job.finished else "update"
+                    yield f"event: {event}\ndata: {json.dumps(job.to_dict())}\n\n"
+                    if job.finished:
+                        return
+                elif not await wait_job_update(job, version, SSE_KEEPALIVE):
+                    yield ": keepalive\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# 배치 상태 조회 (작업별 상태 + 전체 진행률 + 결과 이미지)
+def get_batch_or_404(batch_id: str):
+    batch = batches.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail=f"배치 '{batch_id}'를 찾을 수 없습니다.")
+    return batch
+
+async def wait_batch_update(batch, timeout: float) -> bool:
+    # 아직 안 끝난 작업 중 하나라도 바뀌면 깨어남
+    waiters = [
+        asyncio.create_task(wait_job_update(job, job.version, timeout))
+        for job in batch.jobs() if not job.finished
+    ]
+    if not waiters:
+        return True
+    done, pending = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    return any(task.result() for task in done)
+
+@app.get('/api/batches/{batch_id}')
+async def get_batch(batch_id: str):
+    return get_batch_or_404(batch_id).to_dict()
+
+# 배치 취소 (끝나지 않은 작업 전부)
+@app.delete('/api/batches/{batch_id}')
+async def cancel_batch(batch_id: str):
+    batch = get_batch_or_404(batch_id)
+    # 미들웨어 대기열에 있는 작업부터 빼서 다른 작업을 취소하는 동안 ComfyUI로 제출되지 않게 함
+    jobs = sorted(batch.jobs(), key=lambda job: job.status != "pending")
+    for job in jobs:
+        if not job.finished:
+            await cancellations.withdraw(job.prompt_id, batch.client_id)
+    return batch.to_dict()
+
+# long-poll: 배치가 모두 끝나면 즉시 응답
+@app.get('/api/batches/{batch_id}/wait')
+async def wait_batch(batch_id: str, timeout: float = JOB_WAIT_TIMEOUT):
+    batch = get_batch_or_404(batch_id)
+    deadline = asyncio.get_running_loop().time() + min(timeout, 120.0)
+    with cancellations.watching(batch.prompt_ids):
+        while not batch.finished:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            await wait_batch_update(batch, remaining)
+    return batch.to_dict()
+
+# SSE: 배치 진행률이 바뀔 때마다 전송
+@app.get('/api/batches/{batch_id}/events')
+async def batch_events(batch_id: str):
+    batch = get_batch_or_404(batch_id)
+
+    async def event_stream():
+        version = -1
+        with cancellations.watching(batch.prompt_ids):
+            while True:
+                if batch.version != version:
+                    version = batch.version
+                    finished = batch.finished
+                    event = "done" if finished else "update"
+                    yield f"event: {event}\ndata: {json.dumps(batch.to_dict())}\n\n"
+                    if finished:
+                        return
+                elif not await wait_batch_update(batch, SSE_KEEPALIVE):
+                    yield ": keepalive\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# 구독 시작 시 이미 끝난 작업이면 결과를 바로 전송
+def send_finished_result(client_id: str, prompt_id: str):
+    job = tracker.get(prompt_id)
+    if job is not None and job.finished:
+        manager.subscribe(client_id, prompt_id)
+        manager.on_job_event("finished", job, {})
+
+# 브라우저 웹소켓: ComfyUI 연결은 트래커가 공유하는 하나만 사용
+@app.websocket("/ws/{client_id}")
+async def websocket_endpoint(websocket: WebSocket, client_id: str):
+    connection = await manager.connect(websocket, client_id)
+
+    # 연결 성공 메시지 전송
+    manager.send_message(client_id, {
+        "type": "connection_status",
+        "status": "connected" if tracker.connected else "connecting",
+        "message": "ComfyUI 서버에 연결되었습니다." if tracker.connected else "ComfyUI 서버에 연결 중입니다.",
+    })
 
-@app.get('/api/status')
-async def check_status():
     try:
-        # ComfyUI 서버 연결 확인
-        with urllib.request.urlopen(f"{COMFY_SERVER}/system_stats") as response:
-            return {"status": "connected", "message": "ComfyUI 서버가 실행 중입니다."}
+        # 클라이언트 메시지 처리
+        while True:
+            request_data = json.loads(await websocket.receive_text())
+
+            # 메시지 유형에 따라 처리
+            if request_data.get("type") == "prompt":
+                # 웹소켓은 HTTP 미들웨어를 거치지 않으므로 메시지마다 추적 ID 설정
+                trace_id_var.set(request_data.get("trace_id") or new_trace_id())
+                try:
+                    result = await submit_prompt(PromptRequest(
+                        prompt_text=request_data.get("prompt_text", ""),
+                        workflow_name=request_data.get("workflow_name", "0404test"),
+                        client_id=client_id,
+                        seed=request_data.get("seed"),
+                        priority=request_data.get("priority", "normal"),
+                        use_cache=request_data.get("use_cache", True),
+                        timeout=request_data.get("timeout"),
+                        outputs=request_data.get("outputs"),
+                    ))
+                except ValidationError as e:
+                    manager.send_message(client_id, {"type": "error", "message": str(e)})
+                    continue
+                except HTTPException as e:
+                    manager.send_message(client_id, {"type": "error", "message": e.detail})
+                    continue
+
+                prompt_id = result["prompt_id"]
+                manager.subscribe(client_id, prompt_id)
+
+                # 프롬프트 ID 전송
+                manager.send_message(client_id, {
+                    "type": "prompt_queued",
+                    "prompt_id": prompt_id,
+                    "seed": result["seed"],
+                    "position": result["position"],
+                    "estimated_start": result["estimated_start"],
+                })
+                send_finished_result(client_id, prompt_id)
+
+            # HTTP로 제출한 작업 구독
+            elif request_data.get("type") == "subscribe":
+                prompt_id = request_data.get("prompt_id")
+                if prompt_id:
+                    manager.subscribe(client_id, prompt_id)
+                    send_finished_result(client_id, prompt_id)
+
+            elif request_data.get("type") == "unsubscribe":
+                manager.unsubscribe(client_id, request_data.get("prompt_id"))
+
+            # 작업 취소
+            elif request_data.get("type") == "cancel":
+                prompt_id = request_data.get("prompt_id")
+                try:
+                    cancelled = not prompt_id or await cancellations.withdraw(prompt_id, client_id)
+                    message = "취소할 수 없는 작업입니다."
+                except SharedJobError as e:
+                    cancelled, message = False, str(e)
+                if not cancelled:
+                    manager.send_message(client_id, {
+                        "type": "error",
+                        "prompt_id": prompt_id,
+                        "message": message,
+                    })
+
+            # 미리보기 정책 변경 (max_fps / max_width / format / quality / framing 중 지정한 것만)
+            elif request_data.get("type") == "preview_policy":
+                try:
+                    policy = manager.set_preview_policy(client_id, request_data)
+                except (ValueError, TypeError) as e:
+                    manager.send_message(client_id, {"type": "error", "message": str(e)})
+                    continue
+                manager.send_message(client_id, {"type": "preview_policy", **policy.to_dict()})
+
+    except WebSocketDisconnect:
+        # 연결 해제
+        manager.disconnect(connection)
     except Exception as e:
-        return {"status": "disconnected", "message": f"ComfyUI 서버에 연결할 수 없습니다: {str(e)}"}
+        if manager.active_connections.get(client_id) is not connection:
+            # 같은 client_id의 새 연결로 대체되어 닫힌 연결
+            manager.disconnect(connection)
+            return
+        # 오류 처리
+        logger.warning("웹소켓 오류", extra={"client_id": client_id, "error": str(e)})
+        manager.send_message(client_id, {"type": "error", "message": str(e)})
+        manager.disconnect(connection)
+
+# 워크플로우 노드별 실행 시간 (cold: 모델을 새로 읽은 작업 / warm: 로더가 캐시된 작업)
+@app.get('/api/profile/{workflow_name}')
+async def get_profile(workflow_name: str):
+    report = profiler.report(workflow_name)
+    if not report["nodes"]:
+        # 기록이 없으면 워크플로우가 있는지 확인 (없으면 404)
+        load_workflow(workflow_name)
+    return report
+
+# Prometheus 메트릭
+@app.get('/metrics')
+async def get_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get('/api/status')
+async def check_status():
+    # 백엔드 풀이 주기적으로 확인한 상태를 그대로 반환 (요청마다 ComfyUI를 호출하지 않음)
+    backends = [b.to_dict() for b in pool.backends.values()]
+    healthy = pool.healthy()
+    if healthy:
+        return {
+            "status": "connected",
+            "message": f"ComfyUI 서버가 실행 중입니다. ({len(healthy)}/{len(backends)})",
+            "backends": backends,
+        }
+    errors = ", ".join(f"{b.name}: {b.last_error}" for b in pool.backends.values())
+    return {
+        "status": "disconnected",
+        "message": f"ComfyUI 서버에 연결할 수 없습니다: {errors}",
+        "backends": backends,
+    }
     
 if __name__ == "__main__":
     import uvicorn
-    print("파이썬 FastAPI 서버 실행")
+    logger.info("파이썬 FastAPI 서버 실행")
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
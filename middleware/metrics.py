@@ -0,0 +1,214 @@
+import asyncio
+import bisect
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+# Prometheus 텍스트 포맷 메트릭 (외부 의존성 없이 필요한 만큼만 구현)
+
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+EXECUTION_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+BYTES_BUCKETS = (1e4, 5e4, 1e5, 5e5, 1e6, 2e6, 5e6, 1e7, 5e7)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, key)} {_number(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    # 값은 수집 시점에 callback으로 계산 ((라벨 값, 값) 목록 반환)
+    # 다른 모듈이 이미 세고 있는 누적값(캐시 적중 수 등)은 kind="counter"로 노출
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 callback: Optional[Callable[[], Iterable[Tuple[LabelValues, float]]]] = None,
+                 kind: str = "gauge"):
+        super().__init__(name, help_text, labels)
+        self.callback = callback
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        if self.callback is None:
+            return lines
+        try:
+            samples = list(self.callback())
+        except Exception:
+            return lines
+        for key, value in samples:
+            lines.append(f"{self.name}{_labels(self.label_names, key)} {_number(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # 라벨 값 -> (버킷별 개수, 합계, 전체 개수)
+        self.values: Dict[LabelValues, List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric):
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+# HTTP
+HTTP_DURATION = Histogram(
+    "middleware_http_request_duration_seconds", "HTTP 요청 처리 시간", ["method", "route", "status"])
+
+# 작업 단계별 시간 (대기열 대기 / ComfyUI 실행)
+QUEUE_WAIT = Histogram(
+    "middleware_job_queue_wait_seconds", "요청부터 ComfyUI 실행 시작까지 걸린 시간", ["workflow"], EXECUTION_BUCKETS)
+EXECUTION_TIME = Histogram(
+    "middleware_job_execution_seconds", "ComfyUI 실행 시간", ["workflow", "backend"], EXECUTION_BUCKETS)
+JOBS_FINISHED = Counter(
+    "middleware_jobs_finished_total", "끝난 작업 수", ["workflow", "status"])
+
+# 이미지 전송
+IMAGE_FETCH_TIME = Histogram(
+    "middleware_image_fetch_seconds", "ComfyUI /view에서 이미지를 받아오는 시간", ["backend"])
+IMAGE_FETCH_BYTES = Histogram(
+    "middleware_image_fetch_bytes", "ComfyUI /view에서 받은 이미지 크기", ["backend"], BYTES_BUCKETS)
+
+# ComfyUI 호출 (오류율 = outcome!="ok" 비율)
+UPSTREAM_REQUESTS = Counter(
+    "middleware_upstream_requests_total", "ComfyUI HTTP 요청 수", ["backend", "endpoint", "outcome"])
+UPSTREAM_DURATION = Histogram(
+    "middleware_upstream_request_duration_seconds", "ComfyUI HTTP 요청 시간", ["backend", "endpoint"])
+# 재시도 / 서킷이 열려 있어서 보내지 않은 요청
+UPSTREAM_RETRIES = Counter(
+    "middleware_upstream_retries_total", "ComfyUI HTTP 재시도 수", ["backend", "endpoint"])
+UPSTREAM_REJECTED = Counter(
+    "middleware_upstream_rejected_total", "서킷 차단으로 보내지 않은 ComfyUI 요청 수", ["backend", "endpoint"])
+
+# 노드별 실행 시간 (load: 로더 노드가 실행된 작업이면 cold, 모두 캐시됐으면 warm)
+NODE_DURATION = Histogram(
+    "middleware_node_duration_seconds", "ComfyUI 노드 실행 시간", ["workflow", "class_type", "load"])
+
+# 웹소켓 미리보기 프레임 (sent: 전송, dropped: 더 새 프레임으로 대체되어 버림)
+PREVIEW_FRAMES = Counter(
+    "middleware_preview_frames_total", "웹소켓 미리보기 프레임 수", ["result"])
+
+# 이벤트 루프 지연 (동기 작업이 루프를 막으면 늘어남)
+EVENT_LOOP_LAG = Histogram(
+    "middleware_event_loop_lag_seconds", "예정 시각보다 늦게 깨어난 시간", buckets=LAG_BUCKETS)
+
+
+def endpoint_label(path: str) -> str:
+    # /history/<id> 같은 경로는 앞부분만 라벨로 사용
+    return "/" + path.lstrip("/").split("/", 1)[0].split("?", 1)[0]
+
+
+# JobTracker 리스너
+def on_job_event(event: str, job, data):
+    if event != "finished":
+        return
+    workflow = job.workflow_name or "-"
+    JOBS_FINISHED.inc(workflow=workflow, status=job.status)
+    if job.started_at:
+        QUEUE_WAIT.observe(max(job.started_at - job.created_at, 0.0), workflow=workflow)
+        if job.finished_at:
+            EXECUTION_TIME.observe(max(job.finished_at - job.started_at, 0.0),
+                                   workflow=workflow, backend=job.backend or "-")
+
+
+async def monitor_event_loop(interval: float):
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(loop.time() - started - interval, 0.0))
@@ -0,0 +1,161 @@
+import asyncio
+import io
+import json
+import struct
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from config import (
+    PREVIEW_MAX_FPS,
+    PREVIEW_MAX_WIDTH,
+    PREVIEW_FORMAT,
+    PREVIEW_QUALITY,
+    PREVIEW_FRAMING,
+)
+from image_derivatives import FORMATS, FORMAT_ALIASES, SUPPORTED_FORMATS
+from log import get_logger
+
+
+logger = get_logger("preview")
+
+
+# ComfyUI 바이너리 이벤트 (4바이트 big-endian 타입 + 본문)
+PREVIEW_IMAGE = 1
+PREVIEW_IMAGE_WITH_METADATA = 4
+# PREVIEW_IMAGE 본문의 이미지 포맷 코드 (webp는 ComfyUI에 없는 코드라 미들웨어에서 추가)
+IMAGE_FORMAT_CODES = {"image/jpeg": 1, "image/png": 2, "image/webp": 3}
+MIME_TYPES = {code: mime for mime, code in IMAGE_FORMAT_CODES.items()}
+FRAMINGS = ("legacy", "combined")
+
+
+# 클라이언트별 미리보기 전송 정책
+# - max_fps: 초당 최대 프레임 수 (0이면 미리보기를 보내지 않음)
+# - max_width: 이보다 넓으면 서버에서 줄여서 전송 (0이면 원본 크기)
+# - format: original / jpeg / webp / png
+# - framing: legacy (ComfyUI 바이너리 + JSON preview 메시지) / combined (메타데이터가 붙은 바이너리 하나)
+class PreviewPolicy:
+    def __init__(self, max_fps: float = PREVIEW_MAX_FPS, max_width: int = PREVIEW_MAX_WIDTH,
+                 fmt: str = PREVIEW_FORMAT, quality: int = PREVIEW_QUALITY, framing: str = PREVIEW_FRAMING):
+        self.max_fps = max(0.0, float(max_fps))
+        self.max_width = max(0, int(max_width))
+        self.format = FORMAT_ALIASES.get(fmt.lower(), fmt.lower())
+        self.quality = max(30, min(95, int(quality)))
+        self.framing = framing.lower()
+        if self.format not in ("original", "jpeg", "png", "webp"):
+            raise ValueError(f"지원하지 않는 미리보기 포맷입니다: {fmt}")
+        if self.format == "webp" and SUPPORTED_FORMATS and "webp" not in SUPPORTED_FORMATS:
+            self.format = "jpeg"
+        if self.framing not in FRAMINGS:
+            raise ValueError(f"지원하지 않는 미리보기 형식입니다: {framing}")
+
+    @classmethod
+    def from_message(cls, message: Dict[str, Any], base: "PreviewPolicy") -> "PreviewPolicy":
+        # 웹소켓 preview_policy 메시지: 지정한 항목만 바꿈
+        fmt = message.get("format", base.format)
+        framing = message.get("framing", base.framing)
+        if not isinstance(fmt, str):
+            raise ValueError(f"미리보기 포맷은 문자열이어야 합니다: {fmt!r}")
+        if not isinstance(framing, str):
+            raise ValueError(f"미리보기 형식은 문자열이어야 합니다: {framing!r}")
+        return cls(
+            max_fps=message.get("max_fps", base.max_fps),
+            max_width=message.get("max_width", base.max_width),
+            fmt=fmt,
+            quality=message.get("quality", base.quality),
+            framing=framing,
+        )
+
+    @property
+    def interval(self) -> float:
+        return 1.0 / self.max_fps if self.max_fps else 0.0
+
+    @property
+    def transform(self) -> Tuple[int, str, int]:
+        # 변환 결과를 클라이언트끼리 공유하는 키
+        return self.max_width, self.format, self.quality
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "max_fps": self.max_fps,
+            "max_width": self.max_width,
+            "format": self.format,
+            "quality": self.quality,
+            "framing": self.framing,
+        }
+
+
+def transcode(image: bytes, max_width: int, fmt: str, quality: int) -> Tuple[bytes, str, int, int]:
+    # 미리보기 이미지 축소 / 재인코딩 (워커 스레드에서 실행)
+    from PIL import Image
+
+    with Image.open(io.BytesIO(image)) as im:
+        source_format = (im.format or "JPEG").lower()
+        width, height = im.size
+        resize = bool(max_width) and width > max_width
+        if not resize and fmt in ("original", source_format):
+            return image, Image.MIME.get(im.format, "image/jpeg"), width, height
+        if fmt == "original":
+            fmt = source_format if source_format in FORMATS else "jpeg"
+        if resize:
+            height = max(1, round(height * max_width / width))
+            width = max_width
+            im = im.resize((width, height), Image.BILINEAR, reducing_gap=2.0)
+        if fmt == "jpeg" and im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        buffer = io.BytesIO()
+        pil_format, mime_type = FORMATS[fmt]
+        im.save(buffer, pil_format, quality=quality)
+        return buffer.getvalue(), mime_type, width, height
+
+
+# ComfyUI가 보낸 미리보기 프레임 하나
+# 구독자가 여럿이어도 같은 변환은 한 번만 수행
+class PreviewFrame:
+    def __init__(self, prompt_id: str, node: Optional[str], data: bytes):
+        self.prompt_id = prompt_id
+        self.node = node
+        self.data = data
+        self.event = struct.unpack(">I", data[:4])[0] if len(data) >= 4 else None
+        self.image: Optional[bytes] = None
+        self.mime_type = "image/jpeg"
+        if self.event == PREVIEW_IMAGE and len(data) >= 8:
+            self.mime_type = MIME_TYPES.get(struct.unpack(">I", data[4:8])[0], "image/jpeg")
+            self.image = data[8:]
+        self._variants: Dict[Tuple[int, str, int], asyncio.Future] = {}
+
+    @property
+    def is_image(self) -> bool:
+        return self.image is not None
+
+    async def render(self, policy: PreviewPolicy) -> Tuple[bytes, str, Optional[int], Optional[int]]:
+        if not policy.max_width and policy.format == "original":
+            return self.image, self.mime_type, None, None
+        key = policy.transform
+        future = self._variants.get(key)
+        if future is None:
+            future = asyncio.ensure_future(asyncio.to_thread(transcode, self.image, *key))
+            self._variants[key] = future
+        try:
+            return await asyncio.shield(future)
+        except Exception as e:
+            # Pillow가 없거나 디코딩할 수 없는 프레임은 원본 그대로 전송
+            logger.debug("미리보기 변환 실패", extra={"prompt_id": self.prompt_id, "error": str(e)})
+            return self.image, self.mime_type, None, None
+
+    async def messages(self, policy: PreviewPolicy) -> List[Union[str, bytes]]:
+        # 정책에 맞는 웹소켓 메시지 목록
+        if not self.is_image:
+            # 이미지가 아닌 바이너리 이벤트는 그대로 전달
+            return [self.data]
+        image, mime_type, width, height = await self.render(policy)
+        meta = {"type": "preview", "prompt_id": self.prompt_id, "node": self.node, "mime_type": mime_type}
+        if width is not None:
+            meta.update(width=width, height=height)
+        if policy.framing == "combined":
+            # ComfyUI PREVIEW_IMAGE_WITH_METADATA와 같은 배치: 타입 + 메타데이터 길이 + JSON + 이미지
+            header = json.dumps(meta).encode("utf-8")
+            return [struct.pack(">II", PREVIEW_IMAGE_WITH_METADATA, len(header)) + header + image]
+        if image is self.image:
+            frame = self.data
+        else:
+            frame = struct.pack(">II", PREVIEW_IMAGE, IMAGE_FORMAT_CODES.get(mime_type, 1)) + image
+        return [frame, json.dumps(meta)]
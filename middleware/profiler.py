@@ -0,0 +1,134 @@
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+from config import PROFILE_SAMPLES
+from job_tracker import Job
+from metrics import NODE_DURATION
+
+
+def _percentile(values: List[float], q: float) -> float:
+    # values는 정렬된 상태
+    index = min(len(values) - 1, max(0, round(q * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(samples: Iterable[float]) -> Optional[Dict[str, float]]:
+    values = sorted(samples)
+    if not values:
+        return None
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 4),
+        "p50": round(_percentile(values, 0.5), 4),
+        "p95": round(_percentile(values, 0.95), 4),
+        "max": round(values[-1], 4),
+    }
+
+
+# 워크플로우 안의 노드 하나의 실행 시간 기록
+class NodeStats:
+    def __init__(self, node: str, class_type: Optional[str], samples: int):
+        self.node = node
+        self.class_type = class_type
+        self.runs = 0
+        self.cached = 0
+        self.durations: Dict[str, Deque[float]] = {}
+        self._samples = samples
+
+    def add(self, duration: float, cached: bool, load: str):
+        if cached:
+            self.cached += 1
+            return
+        self.runs += 1
+        self.durations.setdefault(load, deque(maxlen=self._samples)).append(duration)
+
+    @property
+    def total(self) -> float:
+        # 보관 중인 최근 실행 시간의 합
+        return sum(sum(samples) for samples in self.durations.values())
+
+    def to_dict(self, total: float) -> Dict[str, Any]:
+        return {
+            "node": self.node,
+            "class_type": self.class_type,
+            "runs": self.runs,
+            "cached": self.cached,
+            # 최근 실행 시간 합계 중 이 노드가 차지하는 비율
+            "share": round(self.total / total, 4) if total else 0.0,
+            **{load: summarize(samples) for load, samples in self.durations.items()},
+        }
+
+
+# 워크플로우 하나의 프로파일
+class WorkflowProfile:
+    def __init__(self, samples: int):
+        self.samples = samples
+        self.jobs: Dict[str, int] = {}
+        self.execution: Dict[str, Deque[float]] = {}
+        self.nodes: Dict[str, NodeStats] = {}
+
+    def add(self, job: Job, load: str):
+        self.jobs[load] = self.jobs.get(load, 0) + 1
+        elapsed = 0.0
+        for timing in job.node_timings:
+            stats = self.nodes.get(timing["node"])
+            if stats is None:
+                stats = self.nodes[timing["node"]] = NodeStats(timing["node"], timing.get("class_type"), self.samples)
+            stats.class_type = stats.class_type or timing.get("class_type")
+            stats.add(timing["duration"], timing["cached"], load)
+            elapsed += timing["duration"]
+        self.execution.setdefault(load, deque(maxlen=self.samples)).append(elapsed)
+
+    def to_dict(self) -> Dict[str, Any]:
+        total = sum(stats.total for stats in self.nodes.values())
+        nodes = sorted(self.nodes.values(), key=lambda s: s.total, reverse=True)
+        return {
+            "jobs": {"total": sum(self.jobs.values()), **self.jobs},
+            "execution": {load: summarize(samples) for load, samples in self.execution.items()},
+            "nodes": [stats.to_dict(total) for stats in nodes],
+        }
+
+
+# 노드별 실행 시간 프로파일러
+# - 트래커가 executing 메시지 사이 간격으로 기록한 작업별 노드 시간을 워크플로우 / 노드 단위로 집계
+# - 로더 노드가 실제로 실행된 작업(cold: 모델을 새로 읽음)과 캐시된 작업(warm)을 나눠서 분포 계산
+# - 최근 PROFILE_SAMPLES개만 보관 (워크플로우를 바꾸면 최근 실행 기준으로 바로 반영)
+class NodeProfiler:
+    def __init__(self, samples: int = PROFILE_SAMPLES):
+        self.samples = samples
+        self.workflows: Dict[str, WorkflowProfile] = {}
+
+    def record(self, job: Job, observe: bool = True):
+        if not job.node_timings or not job.workflow_name:
+            return
+        load = job.model_load or "-"
+        profile = self.workflows.get(job.workflow_name)
+        if profile is None:
+            profile = self.workflows[job.workflow_name] = WorkflowProfile(self.samples)
+        profile.add(job, load)
+        if not observe:
+            return
+        for timing in job.node_timings:
+            if not timing["cached"]:
+                NODE_DURATION.observe(timing["duration"], workflow=job.workflow_name,
+                                      class_type=timing.get("class_type") or "-", load=load)
+
+    def load(self, jobs: Iterable[Job]):
+        # 재시작 후 저장소의 최근 작업으로 복원 (오래된 것부터)
+        for job in jobs:
+            if job.status == "completed":
+                self.record(job, observe=False)
+
+    def report(self, workflow_name: str) -> Dict[str, Any]:
+        profile = self.workflows.get(workflow_name)
+        if profile is None:
+            return {"workflow_name": workflow_name, "jobs": {"total": 0}, "execution": {}, "nodes": []}
+        return {"workflow_name": workflow_name, **profile.to_dict()}
+
+    # JobTracker 리스너: 정상 완료된 작업만 집계 (실패 / 취소는 중간에 끊긴 시간이라 제외)
+    def on_job_event(self, event: str, job: Job, data: Dict[str, Any]):
+        if event == "finished" and job.status == "completed":
+            self.record(job)
+
+
+profiler = NodeProfiler()
@@ -0,0 +1,75 @@
+import random
+import time
+from typing import Iterator
+
+from config import (
+    COMFY_RETRY_BASE,
+    COMFY_RETRY_CAP,
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_TIMEOUT,
+)
+
+
+# 서킷이 열려 있어서 ComfyUI를 호출하지 않고 바로 실패 (503 + Retry-After)
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"ComfyUI 백엔드 {name} 일시 차단 중 ({retry_after:.0f}초 후 재시도)")
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+def backoff_delays(base: float = COMFY_RETRY_BASE, cap: float = COMFY_RETRY_CAP) -> Iterator[float]:
+    # decorrelated jitter: 재시도 간격을 무작위로 벌려서 클라이언트들이 동시에 다시 몰리지 않게 함
+    delay = base
+    while True:
+        delay = min(cap, random.uniform(base, delay * 3))
+        yield delay
+
+
+# 백엔드 하나의 서킷 브레이커
+# - closed: 정상. 연속 실패가 threshold에 닿으면 open
+# - open: reset_timeout 동안 호출하지 않고 바로 실패
+# - half-open: 시간이 지나면 요청 하나만 통과시켜서 성공하면 closed, 실패하면 다시 open
+class CircuitBreaker:
+    def __init__(self, name: str, threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float = 0.0
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self.failures < self.threshold:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open":
+            raise CircuitOpenError(self.name, self.opened_at + self.reset_timeout - time.monotonic())
+        if state == "half-open":
+            if self._trial:
+                raise CircuitOpenError(self.name, self.reset_timeout)
+            self._trial = True
+
+    def success(self):
+        self.failures = 0
+        self._trial = False
+
+    def abort(self):
+        # 결과 없이 끝난 호출 (취소 등): half-open 시험 자리만 반납
+        self._trial = False
+
+    def failure(self):
+        self.failures += 1
+        self._trial = False
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
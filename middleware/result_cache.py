@@ -0,0 +1,64 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from config import RESULT_CACHE_TTL, RESULT_CACHE_SIZE
+from job_tracker import Job, tracker
+
+
+def graph_hash(workflow_name: str, workflow: Dict[str, Any]) -> str:
+    # 프롬프트/시드를 주입한 최종 그래프 기준 (노드 타이틀 같은 _meta는 결과와 무관하므로 제외)
+    nodes = {
+        node_id: {"class_type": node["class_type"], "inputs": node.get("inputs", {})}
+        for node_id, node in workflow.items()
+    }
+    canonical = json.dumps([workflow_name, nodes], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+# 같은 그래프에 대한 작업 재사용
+# - 실행 중인 작업이 있으면 그 작업에 합침 (더블 클릭 / 재시도)
+# - 완료된 작업은 TTL 동안 결과를 그대로 반환
+# - 실패 / 중단된 작업이나 트래커에서 사라진 작업은 캐시에서 제거
+class ResultCache:
+    def __init__(self, ttl: float = RESULT_CACHE_TTL, limit: int = RESULT_CACHE_SIZE):
+        self.ttl = ttl
+        self.limit = limit
+        self.entries: "OrderedDict[str, str]" = OrderedDict()
+        self.stats = {"hits": 0, "coalesced": 0, "misses": 0}
+
+    def lookup(self, key: str) -> Tuple[Optional[Job], bool]:
+        # (작업, 완료 여부) - 재사용할 작업이 없으면 (None, False)
+        prompt_id = self.entries.get(key)
+        job = tracker.get(prompt_id) if prompt_id is not None else None
+        if job is None or job.status in ("failed", "interrupted"):
+            self.entries.pop(key, None)
+            self.stats["misses"] += 1
+            return None, False
+
+        if not job.finished:
+            self.stats["coalesced"] += 1
+            return job, False
+
+        if not job.images or time.time() - (job.finished_at or 0) > self.ttl:
+            self.entries.pop(key, None)
+            self.stats["misses"] += 1
+            return None, False
+
+        self.entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return job, True
+
+    def remember(self, key: str, prompt_id: str):
+        self.entries[key] = prompt_id
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.limit:
+            self.entries.popitem(last=False)
+
+    def info(self) -> Dict[str, Any]:
+        return {**self.stats, "entries": len(self.entries), "ttl": self.ttl}
+
+
+result_cache = ResultCache()
@@ -0,0 +1,476 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from config import (
+    BACKEND_HEALTH_INTERVAL,
+    COMFY_HISTORY_TIMEOUT,
+    SCHEDULER_MAX_INFLIGHT,
+    SCHEDULER_MAX_DEPTH,
+    SCHEDULER_CLIENT_QUOTA,
+    SCHEDULER_DEFAULT_ESTIMATE,
+    SCHEDULER_REQUEUE_TIMEOUT,
+)
+from backend_pool import Backend, ModelSignature, pool
+from job_tracker import Job, tracker
+from log import get_logger
+
+
+logger = get_logger("scheduler")
+
+
+# 우선순위 (앞쪽이 먼저 처리됨)
+PRIORITIES = ("high", "normal", "low")
+
+
+# 대기열이 가득 차거나 클라이언트 할당량을 넘은 경우 (429 + Retry-After)
+class AdmissionError(Exception):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+# 백엔드 장애로 볼 제출 오류인지 (연결 오류 / 타임아웃 / 5xx)
+# 4xx는 워크플로우 검증 실패 같은 요청 자체의 문제라 백엔드를 실패 처리하지 않음
+def _backend_error(e: Exception) -> bool:
+    status = getattr(e, "status_code", None)
+    return status is None or status >= 500
+
+
+# 미들웨어 대기열의 작업 하나
+class QueuedJob:
+    def __init__(self, prompt_id: str, client_id: str, workflow_name: str,
+                 workflow: Dict[str, Any], priority: str = "normal", models: ModelSignature = ()):
+        self.prompt_id = prompt_id
+        self.client_id = client_id
+        self.workflow_name = workflow_name
+        self.workflow = workflow
+        self.priority = priority
+        self.models = models
+        self.backend: Optional[Backend] = None
+        # 같은 배치 요청으로 들어온 작업 묶음 (클라이언트 할당량을 하나로 셈)
+        self.group: Optional[str] = None
+        self.enqueued_at = time.time()
+        self.dispatched_at: Optional[float] = None
+
+
+# ComfyUI 앞단 스케줄러
+# - 전체 대기열 길이 / 클라이언트별 작업 수 제한 (초과하면 AdmissionError)
+# - 우선순위 클래스 안에서는 client_id 단위 라운드로빈으로 공정하게 배분
+# - 백엔드별로 동시에 보내는 작업은 SCHEDULER_MAX_INFLIGHT개로 제한
+# - 백엔드 선택은 BackendPool.choose (대기열 길이 + 모델 선호), 장애 시 다른 백엔드로 재배치
+# - 워크플로우별 실행 시간(EMA)으로 대기 위치와 예상 시작 시간 계산
+class Scheduler:
+    def __init__(
+        self,
+        max_inflight: int = SCHEDULER_MAX_INFLIGHT,
+        max_depth: int = SCHEDULER_MAX_DEPTH,
+        client_quota: int = SCHEDULER_CLIENT_QUOTA,
+        default_estimate: float = SCHEDULER_DEFAULT_ESTIMATE,
+        requeue_timeout: float = SCHEDULER_REQUEUE_TIMEOUT,
+    ):
+        self.max_inflight = max_inflight
+        self.max_depth = max_depth
+        self.client_quota = client_quota
+        self.default_estimate = default_estimate
+        self.requeue_timeout = requeue_timeout
+        self.queues: Dict[str, OrderedDict[str, Deque[QueuedJob]]] = {
+            priority: OrderedDict() for priority in PRIORITIES
+        }
+        self.inflight: Dict[str, QueuedJob] = {}
+        self.client_counts: Dict[str, int] = {}
+        # 배치 묶음별 남은 작업 수 (마지막 작업이 끝나면 할당량 반환)
+        self.groups: Dict[str, int] = {}
+        self.exec_time: Dict[str, float] = {}
+        # 죽은 백엔드에서 복구 중인 작업
+        self._recovering: Set[str] = set()
+        self._send: Optional[Callable[[QueuedJob, Backend], Awaitable[Any]]] = None
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        return sum(len(q) for queues in self.queues.values() for q in queues.values())
+
+    def estimate(self, workflow_name: Optional[str]) -> float:
+        return self.exec_time.get(workflow_name, self.default_estimate)
+
+    # 대기열 등록
+    def submit(self, job: QueuedJob):
+        if job.priority not in PRIORITIES:
+            raise ValueError(f"알 수 없는 우선순위입니다: {job.priority}")
+
+        if self.client_counts.get(job.client_id, 0) >= self.client_quota:
+            raise AdmissionError(
+                f"클라이언트당 최대 {self.client_quota}개의 작업만 요청할 수 있습니다.",
+                self._client_retry_after(job.client_id),
+            )
+        if self.depth >= self.max_depth:
+            raise AdmissionError("대기열이 가득 찼습니다. 잠시 후 다시 시도해주세요.", self._running_remaining())
+
+        self.queues[job.priority].setdefault(job.client_id, deque()).append(job)
+        self.client_counts[job.client_id] = self.client_counts.get(job.client_id, 0) + 1
+        self._wakeup.set()
+
+    def submit_many(self, jobs: List[QueuedJob]):
+        # 배치 요청: 전부 넣거나 하나도 넣지 않음
+        # 배치 하나는 클라이언트 할당량을 하나만 차지하고 마지막 작업이 끝날 때 반환
+        # (작업은 클라이언트 단위 라운드로빈으로 하나씩 배치되므로 큰 배치도 다른 클라이언트를 막지 않음)
+        if not jobs:
+            return
+        client_id = jobs[0].client_id
+        for job in jobs:
+            if job.priority not in PRIORITIES:
+                raise ValueError(f"알 수 없는 우선순위입니다: {job.priority}")
+
+        if self.client_counts.get(client_id, 0) >= self.client_quota:
+            raise AdmissionError(
+                f"클라이언트당 최대 {self.client_quota}개의 작업만 요청할 수 있습니다.",
+                self._client_retry_after(client_id),
+            )
+        if self.depth + len(jobs) > self.max_depth:
+            raise AdmissionError("대기열이 가득 찼습니다. 잠시 후 다시 시도해주세요.", self._running_remaining())
+
+        group = jobs[0].prompt_id
+        for job in jobs:
+            job.group = group
+            self.queues[job.priority].setdefault(job.client_id, deque()).append(job)
+        self.groups[group] = len(jobs)
+        self.client_counts[client_id] = self.client_counts.get(client_id, 0) + 1
+        self._wakeup.set()
+
+    def _remove_pending(self, prompt_id: str) -> bool:
+        # 아직 ComfyUI로 보내지 않은 작업만 대기열에서 제거
+        for queues in self.queues.values():
+            for client_id, queue in list(queues.items()):
+                for job in queue:
+                    if job.prompt_id == prompt_id:
+                        queue.remove(job)
+                        if not queue:
+                            del queues[client_id]
+                        self._release_client(job)
+                        return True
+        return False
+
+    # 작업 취소
+    # - 미들웨어 대기열: 제거만 하면 됨
+    # - ComfyUI 대기열: /queue delete
+    # - ComfyUI에서 실행 중: /interrupt (해당 백엔드에서 지금 실행 중인 작업일 때만)
+    async def cancel(self, prompt_id: str, reason: str) -> bool:
+        job = tracker.get(prompt_id)
+        if job is None or job.finished:
+            return False
+        if self._remove_pending(prompt_id):
+            tracker.cancel(prompt_id, reason)
+            self._wakeup.set()
+            return True
+
+        queued = self.inflight.get(prompt_id)
+        backend = queued.backend if queued is not None else pool.get(job.backend)
+        submitted = job.status != "pending"
+        running = tracker.current_prompt_ids.get(backend.name) == prompt_id
+        upstream_id = job.upstream_id
+        # 먼저 종료 처리해서 슬롯을 반환 (제출 중인 작업은 _dispatch가 제출 후에 정리)
+        tracker.cancel(prompt_id, reason)
+        if submitted:
+            await self._cancel_upstream(backend, upstream_id, running)
+        return True
+
+    async def _cancel_upstream(self, backend: Backend, upstream_id: str, running: bool):
+        # 같은 작업을 여러 번 지우거나 중단해도 결과가 같으므로 재시도 허용
+        try:
+            await backend.client.request("POST", "/queue", json_body={"delete": [upstream_id]}, idempotent=True)
+            if running:
+                await backend.client.request("POST", "/interrupt", json_body={"prompt_id": upstream_id},
+                                             idempotent=True)
+        except Exception as e:
+            logger.warning("ComfyUI 작업 취소 오류", extra={"prompt_id": upstream_id, "backend": backend.name,
+                                                         "error": str(e)})
+
+    def _release_client(self, job: QueuedJob):
+        if job.group is not None:
+            remaining = self.groups.get(job.group, 0) - 1
+            if remaining > 0:
+                self.groups[job.group] = remaining
+                return
+            self.groups.pop(job.group, None)
+        client_id = job.client_id
+        count = self.client_counts.get(client_id, 0) - 1
+        if count > 0:
+            self.client_counts[client_id] = count
+        else:
+            self.client_counts.pop(client_id, None)
+
+    def _next(self) -> Optional[QueuedJob]:
+        for priority in PRIORITIES:
+            queues = self.queues[priority]
+            if not queues:
+                continue
+            client_id, queue = next(iter(queues.items()))
+            job = queue.popleft()
+            # 방금 처리한 클라이언트는 맨 뒤로
+            del queues[client_id]
+            if queue:
+                queues[client_id] = queue
+            return job
+        return None
+
+    # 디스패치 루프
+    async def start(self, send: Callable[[QueuedJob, Backend], Awaitable[Any]]):
+        self._send = send
+        pool.add_down_listener(self.on_backend_down)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            # 백엔드가 복구되는 경우도 있으므로 주기적으로도 확인
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), BACKEND_HEALTH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self.depth and pool.choose(capacity=self.max_inflight) is not None:
+                job = self._next()
+                backend = pool.choose(job.models, capacity=self.max_inflight)
+                self._assign(job, backend)
+                asyncio.create_task(self._dispatch(job))
+
+    def _assign(self, job: QueuedJob, backend: Backend):
+        job.backend = backend
+        job.dispatched_at = time.time()
+        backend.inflight += 1
+        self.inflight[job.prompt_id] = job
+        tracker.assign(job.prompt_id, backend.name)
+
+    def _unassign(self, job: QueuedJob):
+        if job.backend is not None:
+            job.backend.inflight -= 1
+            job.backend = None
+
+    async def _dispatch(self, job: QueuedJob):
+        tried = []
+        while True:
+            backend = job.backend
+            tried.append(backend.name)
+            try:
+                await self._send(job, backend)
+                tracked = tracker.get(job.prompt_id)
+                if tracked is not None and tracked.status == "interrupted":
+                    # 제출하는 동안 취소된 작업
+                    await self._cancel_upstream(backend, tracked.upstream_id, running=False)
+                    return
+                tracker.mark_queued(job.prompt_id)
+                return
+            except Exception as e:
+                if not _backend_error(e):
+                    # 요청 자체가 거부됨 (다른 백엔드에서도 같은 결과라 재시도하지 않고 바로 실패 처리)
+                    detail = getattr(e, "detail", str(e))
+                    logger.warning("작업 제출 거부", extra={"prompt_id": job.prompt_id, "backend": backend.name,
+                                                        "error": detail})
+                    tracker.fail(job.prompt_id, detail)
+                    self._done(job.prompt_id)
+                    return
+                logger.warning("작업 제출 오류", extra={"prompt_id": job.prompt_id, "backend": backend.name, "error": str(e)})
+                pool.mark_failed(backend, str(e))
+                self._unassign(job)
+                # 다른 백엔드로 재시도 (백엔드별 동시 제출 수 제한은 그대로 적용)
+                fallback = pool.choose(job.models, capacity=self.max_inflight, exclude=tried)
+                if (fallback is None and job.prompt_id in self.inflight
+                        and pool.choose(job.models, exclude=tried) is not None):
+                    # 남은 백엔드가 모두 가득 찼으면 대기열 맨 앞으로 (슬롯이 나면 다시 배치)
+                    self._requeue(job)
+                    return
+                if fallback is None or job.prompt_id not in self.inflight:
+                    tracker.fail(job.prompt_id, f"ComfyUI 서버 오류: {str(e)}")
+                    self._done(job.prompt_id)
+                    return
+                self._assign(job, fallback)
+
+    def _done(self, prompt_id: str):
+        job = self.inflight.pop(prompt_id, None)
+        if job is not None:
+            self._unassign(job)
+            self._release_client(job)
+            self._wakeup.set()
+
+    def _requeue(self, job: QueuedJob):
+        # 제출한 작업을 대기열 맨 앞으로 되돌림
+        self.inflight.pop(job.prompt_id, None)
+        self._unassign(job)
+        tracker.requeue(job.prompt_id)
+        queues = self.queues[job.priority]
+        queues.setdefault(job.client_id, deque()).appendleft(job)
+        queues.move_to_end(job.client_id, last=False)
+        self._wakeup.set()
+
+    # BackendPool 리스너: 죽은 백엔드에 보낸 작업 복구
+    # 그 백엔드에서 실행되지 않는 것을 확인한 뒤에만 다시 대기열에 넣음 (두 번 실행 방지)
+    def on_backend_down(self, backend: Backend):
+        for job in [j for j in self.inflight.values() if j.backend is backend]:
+            tracker_job = tracker.get(job.prompt_id)
+            if tracker_job is None or tracker_job.finished or job.prompt_id in self._recovering:
+                continue
+            self._recovering.add(job.prompt_id)
+            asyncio.create_task(self._recover(job, backend))
+
+    async def _recover(self, job: QueuedJob, backend: Backend):
+        # 1. 대기열에서 지우고 실행 중이면 interrupt (중복 요청이어도 결과가 같음)
+        # 2. 히스토리에 완료 기록이 있으면 그 결과를 반영하고 끝
+        # 3. 없으면 (그 백엔드에서 다시 실행되지 않으므로) 대기열 맨 앞으로
+        # 백엔드가 응답하지 않으면 상태 확인 간격마다 다시 시도, requeue_timeout이 지나면 확인 없이 재배치
+        tracked = tracker.get(job.prompt_id)
+        upstream_id = tracked.upstream_id
+        running = tracker.current_prompt_ids.get(backend.name) == job.prompt_id
+        deadline = time.monotonic() + self.requeue_timeout
+        try:
+            while self.inflight.get(job.prompt_id) is job and not tracked.finished:
+                try:
+                    await backend.client.request("POST", "/queue", json_body={"delete": [upstream_id]},
+                                                 idempotent=True, retries=0, probe=True)
+                    if running:
+                        await backend.client.request("POST", "/interrupt", json_body={"prompt_id": upstream_id},
+                                                     idempotent=True, retries=0, probe=True)
+                    response = await backend.client.request("GET", f"/history/{upstream_id}",
+                                                            timeout=COMFY_HISTORY_TIMEOUT, retries=0, probe=True)
+                except Exception as e:
+                    if time.monotonic() < deadline:
+                        await asyncio.sleep(BACKEND_HEALTH_INTERVAL)
+                        continue
+                    logger.warning("백엔드 작업 확인 실패, 재배치", extra={"prompt_id": job.prompt_id,
+                                                                    "backend": backend.name, "error": str(e)})
+                else:
+                    history = response.json()
+                    entry = history.get(upstream_id) or {}
+                    if (entry.get("status") or {}).get("completed"):
+                        # 장애 전에 끝난 작업: 결과 반영 (on_job_event에서 슬롯 반환)
+                        logger.info("백엔드 작업 완료 확인", extra={"prompt_id": job.prompt_id,
+                                                                 "backend": backend.name})
+                        tracker.apply_history(job.prompt_id, history)
+                        return
+                    logger.warning("작업 재배치", extra={"prompt_id": job.prompt_id, "backend": backend.name})
+                if self.inflight.get(job.prompt_id) is job and not tracked.finished:
+                    self._requeue(job)
+                return
+        finally:
+            self._recovering.discard(job.prompt_id)
+
+    # JobTracker 리스너: 작업이 끝나면 슬롯 반환 + 실행 시간 갱신
+    def on_job_event(self, event: str, job: Job, data: Dict[str, Any]):
+        if event != "finished" or job.prompt_id not in self.inflight:
+            return
+        queued = self.inflight[job.prompt_id]
+        if job.status == "completed":
+            if queued.backend is not None:
+                queued.backend.note_models(queued.models)
+            # 여러 장을 묶은 작업은 실행 시간이 달라서 EMA에 반영하지 않음
+            if job.started_at and job.finished_at and job.batch_size == 1:
+                elapsed = job.finished_at - job.started_at
+                previous = self.exec_time.get(job.workflow_name)
+                self.exec_time[job.workflow_name] = elapsed if previous is None else previous * 0.8 + elapsed * 0.2
+        self._done(job.prompt_id)
+
+    # 대기 현황
+    def _remaining(self, queued: QueuedJob) -> float:
+        job = tracker.get(queued.prompt_id)
+        estimate = self.estimate(queued.workflow_name)
+        if job is not None and job.started_at:
+            return max(estimate - (time.time() - job.started_at), 0.0)
+        return estimate
+
+    def _running_remaining(self) -> float:
+        if not self.inflight:
+            return 1.0
+        return min(self._remaining(job) for job in self.inflight.values())
+
+    def _client_retry_after(self, client_id: str) -> float:
+        running = [job for job in self.inflight.values() if job.client_id == client_id]
+        if running:
+            return min(self._remaining(job) for job in running)
+        return self._running_remaining() + self.default_estimate
+
+    def _pending_order(self) -> List[QueuedJob]:
+        # _next()와 같은 순서를 대기열을 바꾸지 않고 계산
+        order = []
+        for priority in PRIORITIES:
+            queues = [list(queue) for queue in self.queues[priority].values()]
+            index = 0
+            while any(index < len(queue) for queue in queues):
+                for queue in queues:
+                    if index < len(queue):
+                        order.append(queue[index])
+                index += 1
+        return order
+
+    def snapshot(self, client_id: Optional[str] = None) -> Dict[str, Any]:
+        now = time.time()
+        # ComfyUI는 백엔드마다 작업을 하나씩 실행하므로 백엔드별로 끝나는 시간을 누적
+        timelines = {b.name: 0.0 for b in (pool.healthy() or [pool.default])}
+        running = sorted(self.inflight.values(), key=lambda j: j.dispatched_at or 0)
+        running_items = []
+        for job in running:
+            remaining = self._remaining(job)
+            name = job.backend.name if job.backend is not None else pool.default.name
+            timelines[name] = timelines.get(name, 0.0) + remaining
+            tracked = tracker.get(job.prompt_id)
+            running_items.append({
+                "prompt_id": job.prompt_id,
+                "client_id": job.client_id,
+                "workflow_name": job.workflow_name,
+                "priority": job.priority,
+                "backend": name,
+                "status": tracked.status if tracked is not None else "queued",
+                "estimated_finish": now + timelines[name],
+            })
+
+        pending_items = []
+        for position, job in enumerate(self._pending_order(), start=1):
+            # 가장 먼저 비는 백엔드에 배정된다고 가정
+            name = min(timelines, key=timelines.get)
+            wait = timelines[name]
+            pending_items.append({
+                "prompt_id": job.prompt_id,
+                "client_id": job.client_id,
+                "workflow_name": job.workflow_name,
+                "priority": job.priority,
+                "status": "pending",
+                "position": position,
+                "enqueued_at": job.enqueued_at,
+                "estimated_start": now + wait,
+            })
+            timelines[name] = wait + self.estimate(job.workflow_name)
+
+        if client_id is not None:
+            running_items = [j for j in running_items if j["client_id"] == client_id]
+            pending_items = [j for j in pending_items if j["client_id"] == client_id]
+
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "inflight": len(self.inflight),
+            "max_inflight": self.max_inflight,
+            "backends": [b.to_dict() for b in pool.backends.values()],
+            "running": running_items,
+            "pending": pending_items,
+            "estimates": dict(self.exec_time),
+        }
+
+    def position(self, prompt_id: str) -> Optional[Dict[str, Any]]:
+        for item in self.snapshot()["pending"]:
+            if item["prompt_id"] == prompt_id:
+                return item
+        return None
+
+
+scheduler = Scheduler()
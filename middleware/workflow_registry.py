@@ -0,0 +1,327 @@
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import WORKFLOW_DIR, WORKFLOW_RELOAD_INTERVAL
+from log import get_logger
+
+
+logger = get_logger("workflow_registry")
+
+
+# 워크플로우 템플릿 오류
+class WorkflowError(Exception):
+    pass
+
+
+class WorkflowNotFound(WorkflowError):
+    pass
+
+
+# 프롬프트 입력으로 사용하는 텍스트 인코더 노드
+TEXT_ENCODE_TYPES = {
+    "CLIPTextEncode",
+    "CLIPTextEncodeSDXL",
+    "CLIPTextEncodeFlux",
+    "CLIPTextEncodeSD3",
+}
+# 시드 입력 이름
+SEED_INPUTS = ("seed", "noise_seed")
+# 결과를 내보내는 노드
+OUTPUT_TYPES = {"SaveImage", "PreviewImage", "SaveImageWebsocket"}
+# 출력 이름: 디코드 결과를 그대로 저장하면 "raw", 후처리 노드를 거치면 아래 이름 (없으면 노드 타입 소문자)
+DECODE_TYPES = {"VAEDecode", "VAEDecodeTiled"}
+OUTPUT_ALIASES = {
+    "RMBG": "background-removed",
+    "BRIA_RMBG_Zho": "background-removed",
+    "ImageRemoveBackground+": "background-removed",
+    "ImageUpscaleWithModel": "upscaled",
+    "ImageScaleBy": "upscaled",
+}
+# batch_size로 한 번에 여러 장을 만드는 빈 latent 노드
+LATENT_TYPES = {"EmptyLatentImage", "EmptySD3LatentImage"}
+# 모델 파일을 지정하는 입력 (백엔드 라우팅 시 같은 모델이 올라간 곳을 우선)
+MODEL_INPUTS = (
+    "unet_name", "ckpt_name", "clip_name", "clip_name1", "clip_name2",
+    "vae_name", "lora_name", "control_net_name",
+)
+
+_NAME_RE = re.compile(r"^[\w.\-]+$")
+
+# (노드 ID, 입력 이름)
+Slot = Tuple[str, str]
+
+
+def is_link(value) -> bool:
+    # ComfyUI API 포맷의 노드 연결: ["노드ID", 출력 슬롯]
+    return (
+        isinstance(value, list)
+        and len(value) == 2
+        and isinstance(value[0], str)
+        and isinstance(value[1], int)
+    )
+
+
+def _title(node) -> str:
+    return str(node.get("_meta", {}).get("title", "")).lower()
+
+
+def _is_text_encoder(node) -> bool:
+    class_type = node.get("class_type", "")
+    return class_type in TEXT_ENCODE_TYPES or class_type.endswith("TextEncode")
+
+
+# 한 번 파싱/검증한 워크플로우 템플릿
+class WorkflowTemplate:
+    def __init__(self, name: str, path: str, mtime: float, graph: Dict[str, Any]):
+        self.name = name
+        self.path = path
+        self.mtime = mtime
+        self.graph = graph
+        self.validate()
+        self.prompt_slots: List[Slot] = self._find_prompt_slots()
+        self.negative_slots: List[Slot] = self._find_negative_slots()
+        self.seed_slots: List[Slot] = self._find_seed_slots()
+        self.output_nodes: List[str] = [
+            node_id for node_id, node in graph.items()
+            if node["class_type"] in OUTPUT_TYPES
+        ]
+        self.batch_slots: List[Slot] = [
+            (node_id, "batch_size") for node_id, node in graph.items()
+            if node["class_type"] in LATENT_TYPES and isinstance(node["inputs"].get("batch_size"), int)
+        ]
+        self.models: Tuple[Tuple[str, str], ...] = self._find_models()
+        # 노드 ID -> class_type (작업별 노드 실행 시간 기록에 사용, 모든 작업이 같은 dict를 공유)
+        self.node_types: Dict[str, str] = {node_id: node["class_type"] for node_id, node in graph.items()}
+        self.outputs: Dict[str, List[str]] = self._find_outputs()
+        self._pruned: Dict[Tuple[str, ...], "WorkflowTemplate"] = {}
+
+    def validate(self):
+        if not isinstance(self.graph, dict) or not self.graph:
+            raise WorkflowError(f"워크플로우 '{self.name}'가 비어 있거나 API 포맷이 아닙니다.")
+
+        for node_id, node in self.graph.items():
+            if not isinstance(node, dict) or "class_type" not in node:
+                raise WorkflowError(f"노드 {node_id}에 class_type이 없습니다.")
+            if not isinstance(node.get("inputs", {}), dict):
+                raise WorkflowError(f"노드 {node_id}의 inputs가 올바르지 않습니다.")
+            node.setdefault("inputs", {})
+            for input_name, value in node["inputs"].items():
+                if is_link(value) and value[0] not in self.graph:
+                    raise WorkflowError(
+                        f"노드 {node_id}.{input_name}이 존재하지 않는 노드 {value[0]}를 참조합니다."
+                    )
+
+    def _upstream(self, node_id: str) -> set:
+        # node_id에서 입력 링크를 따라 올라가며 도달 가능한 노드
+        seen = set()
+        stack = [node_id]
+        while stack:
+            current = stack.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            for value in self.graph[current]["inputs"].values():
+                if is_link(value):
+                    stack.append(value[0])
+        return seen
+
+    def _text_encoders(self) -> List[str]:
+        return [
+            node_id for node_id, node in self.graph.items()
+            if _is_text_encoder(node) and isinstance(node["inputs"].get("text"), str)
+        ]
+
+    def _negative_encoders(self) -> set:
+        negative = set()
+        for node_id, node in self.graph.items():
+            # 타이틀로 명시된 경우 우선
+            if _is_text_encoder(node) and "negative" in _title(node):
+                negative.add(node_id)
+            value = node["inputs"].get("negative")
+            if is_link(value):
+                negative |= self._upstream(value[0])
+        return negative
+
+    def _find_prompt_slots(self) -> List[Slot]:
+        encoders = self._text_encoders()
+        titled = [n for n in encoders if "positive" in _title(self.graph[n])]
+        if titled:
+            return [(n, "text") for n in titled]
+        negative = self._negative_encoders()
+        return [(n, "text") for n in encoders if n not in negative]
+
+    def _find_negative_slots(self) -> List[Slot]:
+        negative = self._negative_encoders()
+        return [(n, "text") for n in self._text_encoders() if n in negative]
+
+    def _find_seed_slots(self) -> List[Slot]:
+        slots = []
+        for node_id, node in self.graph.items():
+            for input_name in SEED_INPUTS:
+                value = node["inputs"].get(input_name)
+                # 링크가 아닌 실제 값이 있는 입력만 주입 대상
+                if isinstance(value, int) and not isinstance(value, bool):
+                    slots.append((node_id, input_name))
+        return slots
+
+    def _find_models(self) -> Tuple[Tuple[str, str], ...]:
+        models = set()
+        for node in self.graph.values():
+            for input_name in MODEL_INPUTS:
+                value = node["inputs"].get(input_name)
+                if isinstance(value, str) and value:
+                    models.add((input_name, value))
+        return tuple(sorted(models))
+
+    def _output_alias(self, node_id: str) -> Optional[str]:
+        node = self.graph[node_id]
+        source = next((value[0] for value in node["inputs"].values() if is_link(value)), None)
+        if source is None:
+            return None
+        class_type = self.graph[source]["class_type"]
+        if class_type in DECODE_TYPES:
+            return "raw"
+        return OUTPUT_ALIASES.get(class_type, class_type.lower())
+
+    def _find_outputs(self) -> Dict[str, List[str]]:
+        # 출력 이름 -> 출력 노드 ID 목록 (노드 ID로도 선택 가능)
+        outputs: Dict[str, List[str]] = {}
+        for node_id in self.output_nodes:
+            alias = self._output_alias(node_id)
+            if alias:
+                outputs.setdefault(alias, []).append(node_id)
+        return outputs
+
+    def select(self, outputs: Optional[List[str]]) -> "WorkflowTemplate":
+        # 요청한 출력에 필요한 노드만 남긴 템플릿 (템플릿 / 출력 조합별로 캐시)
+        # 출력 노드에서 입력 링크를 거슬러 올라가서 닿지 않는 노드(다른 출력의 후처리 등)는 ComfyUI에 보내지 않음
+        if not outputs:
+            return self
+        selected = set()
+        for output in outputs:
+            if output in self.outputs:
+                selected.update(self.outputs[output])
+            elif output in self.output_nodes:
+                selected.add(output)
+            else:
+                available = sorted(self.outputs) + self.output_nodes
+                raise WorkflowError(
+                    f"워크플로우 '{self.name}'에 출력 '{output}'이 없습니다. (가능한 출력: {', '.join(available)})"
+                )
+        key = tuple(sorted(selected))
+        if key == tuple(sorted(self.output_nodes)):
+            return self
+        template = self._pruned.get(key)
+        if template is None:
+            keep = set()
+            for node_id in key:
+                keep |= self._upstream(node_id)
+            graph = {node_id: node for node_id, node in self.graph.items() if node_id in keep}
+            template = WorkflowTemplate(self.name, self.path, self.mtime, graph)
+            self._pruned[key] = template
+            logger.info("워크플로우 출력 선택", extra={"workflow": self.name, "outputs": list(key),
+                                                  "nodes": len(graph), "pruned": len(self.graph) - len(graph)})
+        return template
+
+    def instantiate(self, overrides: Dict[Slot, Any]) -> Dict[str, Any]:
+        # copy-on-write: 최상위 dict만 복사하고 값이 바뀌는 노드만 복제
+        # 나머지 노드는 템플릿과 공유하므로 반환된 그래프를 직접 수정하면 안 됨
+        workflow = dict(self.graph)
+        copied = set()
+        for (node_id, input_name), value in overrides.items():
+            if node_id not in copied:
+                node = workflow[node_id]
+                workflow[node_id] = {**node, "inputs": dict(node["inputs"])}
+                copied.add(node_id)
+            workflow[node_id]["inputs"][input_name] = value
+        return workflow
+
+    def render(self, prompt_text: Optional[str] = None, seed: Optional[int] = None,
+               negative_text: Optional[str] = None, batch_size: Optional[int] = None) -> Dict[str, Any]:
+        overrides: Dict[Slot, Any] = {}
+        if prompt_text is not None:
+            for slot in self.prompt_slots:
+                overrides[slot] = prompt_text
+        if negative_text is not None:
+            for slot in self.negative_slots:
+                overrides[slot] = negative_text
+        if seed is not None:
+            for slot in self.seed_slots:
+                overrides[slot] = seed
+        if batch_size is not None:
+            for slot in self.batch_slots:
+                overrides[slot] = batch_size
+        return self.instantiate(overrides)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "nodes": len(self.graph),
+            "prompt_slots": self.prompt_slots,
+            "negative_slots": self.negative_slots,
+            "seed_slots": self.seed_slots,
+            "batch_slots": self.batch_slots,
+            "output_nodes": self.output_nodes,
+            "outputs": self.outputs,
+            "models": self.models,
+        }
+
+
+# 워크플로우 템플릿 레지스트리
+# - 파일별로 한 번만 파싱하고, mtime이 바뀌면 다시 로드
+# - mtime 확인도 WORKFLOW_RELOAD_INTERVAL 간격으로만 수행
+class WorkflowRegistry:
+    def __init__(self, workflow_dir: str = WORKFLOW_DIR, reload_interval: float = WORKFLOW_RELOAD_INTERVAL):
+        self.workflow_dir = workflow_dir
+        self.reload_interval = reload_interval
+        self._templates: Dict[str, WorkflowTemplate] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, name: str) -> str:
+        if not _NAME_RE.match(name) or name.startswith("."):
+            raise WorkflowNotFound(f"잘못된 워크플로우 이름입니다: '{name}'")
+        return os.path.join(self.workflow_dir, f"{name}.json")
+
+    def _load(self, name: str, path: str, mtime: float) -> WorkflowTemplate:
+        with open(path, "r", encoding="utf-8") as f:
+            graph = json.load(f)
+        template = WorkflowTemplate(name, path, mtime, graph)
+        logger.info("워크플로우 로드", extra={"workflow": name, "nodes": len(graph), "prompt_slots": template.prompt_slots, "seed_slots": template.seed_slots})
+        return template
+
+    def get(self, name: str) -> WorkflowTemplate:
+        now = time.monotonic()
+        template = self._templates.get(name)
+        if template is not None and now - self._checked_at.get(name, 0) < self.reload_interval:
+            return template
+
+        path = self._path(name)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            with self._lock:
+                self._templates.pop(name, None)
+            raise WorkflowNotFound(f"워크플로우 '{name}'를 찾을 수 없습니다.")
+
+        with self._lock:
+            template = self._templates.get(name)
+            if template is None or template.mtime != mtime:
+                template = self._load(name, path, mtime)
+                self._templates[name] = template
+            self._checked_at[name] = now
+        return template
+
+    def names(self) -> List[str]:
+        if not os.path.isdir(self.workflow_dir):
+            return []
+        return sorted(
+            f[:-5] for f in os.listdir(self.workflow_dir) if f.endswith(".json")
+        )
+
+
+registry = WorkflowRegistry()